@@ -67,10 +67,9 @@ st.markdown(
         <li><p>
             In the left panel, use the drawing tool to select an area of
             interest on the map. You can delete your selection by clicking on
-            the bin icon. While the flood mapping is generated regardless of
-            the size of the selected region, you will be able to save raster
-            and vector flooding extent only if the side of the rectangular
-            selection does not exceed 100 km.
+            the bin icon. Large regions are split into tiles, both for the
+            analysis and for saving the raster and vector flooding extent,
+            so they may take longer to process.
         </p>
         <li><p>
             In the right panel click on the title <i>Choose Image Dates</i>
@@ -0,0 +1,6 @@
+"""Benchmarks of the stages of the flood pipeline.
+
+Run from the app directory with `python -m benchmarks`; see __main__ for the
+options. The Earth Engine stages run against a local stand-in of the ee
+module (fake_ee), the local stages on synthetic speckled scenes (synthetic).
+"""
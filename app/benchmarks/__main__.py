@@ -0,0 +1,99 @@
+"""Command-line entry point of the benchmarks.
+
+Example, from the app directory:
+    python -m benchmarks --output results.json
+    python -m benchmarks --baseline results.json --tolerance 0.1
+
+Results are written as JSON. With a baseline, the stages that got slower by
+more than the tolerance, or whose Earth Engine graphs grew, are reported and
+the exit code is 1.
+"""
+import argparse
+import json
+import sys
+
+from benchmarks import fake_ee
+
+
+def parse_arguments(arguments=None):
+    """
+    Parse the command-line arguments.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Time the stages of the flood pipeline."
+    )
+    parser.add_argument(
+        "--sizes",
+        type=float,
+        nargs="*",
+        default=[5, 10, 20],
+        help="Sides in km of the areas run with the NumPy backend",
+    )
+    parser.add_argument(
+        "--ee-sizes",
+        type=float,
+        nargs="*",
+        default=[10, 100, 200],
+        help="Sides in km of the areas run with the Earth Engine stand-in",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs of each stage"
+    )
+    parser.add_argument(
+        "--output",
+        default="benchmark_results.json",
+        help="JSON file of the results",
+    )
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown allowed before a regression is reported",
+    )
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    """
+    Run the benchmarks from the command line.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        int: Exit code, 1 if a regression was found.
+    """
+    arguments = parse_arguments(arguments)
+    fake_ee.install()
+    # Imported here, so that the pipeline binds the fake ee module
+    from benchmarks.suite import (
+        compare_results,
+        format_comparison,
+        format_results,
+        run_suite,
+    )
+
+    report = run_suite(arguments.sizes, arguments.ee_sizes, arguments.repeat)
+    with open(arguments.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(format_results(report))
+    print(f"Results written to {arguments.output}")
+
+    if not arguments.baseline:
+        return 0
+    with open(arguments.baseline) as f:
+        baseline = json.load(f)
+    comparison = compare_results(report, baseline, arguments.tolerance)
+    print(format_comparison(comparison))
+    return 1 if any(row["regression"] for row in comparison) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
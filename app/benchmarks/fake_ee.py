@@ -0,0 +1,370 @@
+"""Stand-in for the ee module that records the graphs built by the pipeline.
+
+Every Earth Engine constructor or method call returns a new Node holding the
+name of the call and its arguments, so the functions of utils_flood_analysis
+run without credentials or network. The recorder counts the calls and the
+requests that would reach the server (getInfo, task starts and status
+polls), and graph_size measures a graph as the Earth Engine serializer
+would send it, with identical sub-expressions sent once.
+"""
+import collections
+import functools
+import itertools
+import json
+import sys
+import threading
+
+__version__ = "fake"
+
+
+class EEException(Exception):
+    """Raised as ee.EEException."""
+
+
+class Recorder:
+    """Thread-safe counts of the calls and requests made through the fake."""
+
+    def __init__(self):
+        """Create an empty recorder."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear the counts."""
+        with self._lock:
+            self.calls = collections.Counter()
+            self.requests = collections.Counter()
+
+    def call(self, name):
+        """Count a constructor or method call."""
+        with self._lock:
+            self.calls[name] += 1
+
+    def request(self, name):
+        """Count a request that would be sent to Earth Engine."""
+        with self._lock:
+            self.requests[name] += 1
+
+    def snapshot(self):
+        """
+        Return the counts since the last reset.
+
+        Returns:
+            dict: Total "calls" and "requests", and the counts by name.
+        """
+        with self._lock:
+            return {
+                "calls": sum(self.calls.values()),
+                "requests": sum(self.requests.values()),
+                "calls_by_name": dict(self.calls),
+                "requests_by_name": dict(self.requests),
+            }
+
+
+RECORDER = Recorder()
+
+
+class Node:
+    """An Earth Engine object: the call that built it and its arguments."""
+
+    def __init__(self, name, args=(), kwargs=None):
+        """
+        Record a call.
+
+        Inputs:
+            name (str): Name of the constructor or method, e.g. 'Image' or
+                'updateMask'.
+            args (tuple): Positional arguments, the object first for methods.
+            kwargs (dict): Keyword arguments.
+        """
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs or {}
+        RECORDER.call(name)
+
+    def __getattr__(self, name):
+        """Return a method building a new node on this one."""
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return functools.partial(_method, self, name)
+
+    def getInfo(self):
+        """Count a request and return a placeholder result."""
+        RECORDER.request("getInfo")
+        if self.name == "bounds":
+            west, south, east, north = _bounds(self.args[0])
+            return {
+                "type": "Polygon",
+                "coordinates": [
+                    [
+                        [west, south],
+                        [east, south],
+                        [east, north],
+                        [west, north],
+                        [west, south],
+                    ]
+                ],
+            }
+        return {"type": "FeatureCollection", "features": []}
+
+
+def _method(node, name, *args, **kwargs):
+    """Build the node of a method call."""
+    return Node(name, (node,) + args, kwargs)
+
+
+def _numbers(value):
+    """Yield the numbers nested in lists of coordinates."""
+    if isinstance(value, (int, float)):
+        yield value
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _numbers(item)
+
+
+def _bounds(geometry):
+    """Return the bounding box of a geometry built from coordinates."""
+    while geometry.name not in ("Geometry.Polygon", "Geometry.Rectangle"):
+        geometry = geometry.args[0]
+    numbers = list(_numbers(geometry.args[0]))
+    longitudes, latitudes = numbers[0::2], numbers[1::2]
+    return min(longitudes), min(latitudes), max(longitudes), max(latitudes)
+
+
+class _Namespace:
+    """An Earth Engine class, e.g. ee.Image, and its static methods."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _Namespace(f"{self._name}.{name}")
+
+    def __call__(self, *args, **kwargs):
+        return Node(self._name, args, kwargs)
+
+
+def __getattr__(name):
+    """Return any Earth Engine class, e.g. ee.Image or ee.Reducer."""
+    if not name[:1].isupper():
+        raise AttributeError(name)
+    return _Namespace(name)
+
+
+def _encode(value, values, references, memo):
+    """Encode a value, adding the nodes it uses to values once each."""
+    if isinstance(value, Node):
+        if id(value) not in memo:
+            encoded = json.dumps(
+                {
+                    "name": value.name,
+                    "args": _encode(value.args, values, references, memo),
+                    "kwargs": _encode(value.kwargs, values, references, memo),
+                },
+                sort_keys=True,
+                default=str,
+            )
+            if encoded not in references:
+                references[encoded] = str(len(references))
+                values[references[encoded]] = json.loads(encoded)
+            memo[id(value)] = {"valueReference": references[encoded]}
+        return memo[id(value)]
+    if isinstance(value, (list, tuple)):
+        return [_encode(item, values, references, memo) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: _encode(item, values, references, memo)
+            for key, item in value.items()
+        }
+    return value
+
+
+def to_json(value):
+    """
+    Serialize a graph, as ee.serializer.toJSON.
+
+    Inputs:
+        value (Node): Root of the graph.
+
+    Returns:
+        str: JSON graph, with each distinct node listed once.
+    """
+    values = {}
+    result = _encode(value, values, {}, {})
+    return json.dumps({"result": result, "values": values})
+
+
+def _tree_size(value, memo):
+    """Return the number of nodes of a graph with shared nodes repeated."""
+    if isinstance(value, Node):
+        if id(value) not in memo:
+            memo[id(value)] = 1 + _tree_size(
+                [value.args, list(value.kwargs.values())], memo
+            )
+        return memo[id(value)]
+    if isinstance(value, (list, tuple)):
+        return sum(_tree_size(item, memo) for item in value)
+    if isinstance(value, dict):
+        return sum(_tree_size(item, memo) for item in value.values())
+    return 0
+
+
+def graph_size(value):
+    """
+    Measure the graphs of one or several Earth Engine objects.
+
+    Inputs:
+        value (Node or list): Root(s) of the graph.
+
+    Returns:
+        dict: "nodes" (distinct nodes, as serialized), "tree_nodes" (nodes
+            with every shared sub-expression repeated) and "bytes" (size of
+            the serialized graph).
+    """
+    serialized = to_json(value)
+    return {
+        "nodes": len(json.loads(serialized)["values"]),
+        "tree_nodes": _tree_size(value, {}),
+        "bytes": len(serialized),
+    }
+
+
+class _Serializer:
+    """ee.serializer."""
+
+    toJSON = staticmethod(to_json)
+
+
+def from_json(text):
+    """
+    Rebuild the objects of a graph serialized with to_json.
+
+    Inputs:
+        text (str): JSON graph.
+
+    Returns:
+        The object (Node, or list of Nodes) that was serialized.
+    """
+    graph = json.loads(text)
+    decoded = {}
+
+    def decode(value):
+        if isinstance(value, dict) and set(value) == {"valueReference"}:
+            reference = value["valueReference"]
+            if reference not in decoded:
+                node = graph["values"][reference]
+                decoded[reference] = Node(
+                    node["name"],
+                    tuple(decode(node["args"])),
+                    decode(node["kwargs"]),
+                )
+            return decoded[reference]
+        if isinstance(value, list):
+            return [decode(item) for item in value]
+        if isinstance(value, dict):
+            return {key: decode(item) for key, item in value.items()}
+        return value
+
+    return decode(graph["result"])
+
+
+class _Deserializer:
+    """ee.deserializer."""
+
+    fromJSON = staticmethod(from_json)
+
+
+serializer = _Serializer()
+deserializer = _Deserializer()
+
+_task_ids = itertools.count(1)
+
+
+class _Task:
+    """ee.batch.Task, started without any request but the count."""
+
+    class State:
+        UNSUBMITTED = "UNSUBMITTED"
+        READY = "READY"
+        RUNNING = "RUNNING"
+        COMPLETED = "COMPLETED"
+        FAILED = "FAILED"
+        CANCEL_REQUESTED = "CANCEL_REQUESTED"
+        CANCELLED = "CANCELLED"
+
+    def __init__(self, name, config):
+        self.id = f"FAKE{next(_task_ids)}"
+        self.name = name
+        self.config = config
+        RECORDER.call(name)
+
+    def start(self):
+        # The graph of the task is serialized when it is started
+        to_json(self.config)
+        RECORDER.request("startProcessing")
+
+
+def _export(name):
+    """Return an export function creating tasks of the given name."""
+
+    def export(**config):
+        return _Task(name, config)
+
+    return export
+
+
+class _Batch:
+    """ee.batch."""
+
+    Task = _Task
+
+    class Export:
+        class image:
+            toDrive = staticmethod(_export("Export.image.toDrive"))
+            toAsset = staticmethod(_export("Export.image.toAsset"))
+
+        class table:
+            toDrive = staticmethod(_export("Export.table.toDrive"))
+
+
+class _Data:
+    """ee.data, with every task reported as completed."""
+
+    @staticmethod
+    def getTaskStatus(task_ids):
+        RECORDER.request("getTaskStatus")
+        return [
+            {"id": task_id, "state": _Task.State.COMPLETED}
+            for task_id in task_ids
+        ]
+
+    @staticmethod
+    def deleteAsset(asset_id):
+        RECORDER.request("deleteAsset")
+
+
+batch = _Batch()
+data = _Data()
+
+
+def Initialize(*args, **kwargs):
+    """Do nothing, as ee.Initialize without credentials."""
+
+
+def ServiceAccountCredentials(*args, **kwargs):
+    """Return placeholder credentials."""
+    return None
+
+
+def install():
+    """
+    Make this module the ee module of the process.
+
+    Must be called before importing any module of src, as they bind ee when
+    they are imported.
+    """
+    if "src.utils_flood_analysis" in sys.modules:
+        raise RuntimeError("The pipeline was imported before the fake ee")
+    sys.modules["ee"] = sys.modules[__name__]
@@ -0,0 +1,416 @@
+"""Timings of the stages of the flood pipeline on both backends.
+
+The Earth Engine stages run against benchmarks.fake_ee, so they measure the
+client side of a run: the time spent building the graphs, their size, and
+the number of calls and requests. The local stages run the NumPy backend on
+synthetic scenes, so they measure the processing itself.
+"""
+import datetime
+import importlib
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from benchmarks import fake_ee
+from benchmarks.synthetic import DATES, aoi_coordinates, synthetic_local_inputs
+from src import utils_flood_analysis, utils_flood_analysis_local
+from src.utils_cog import write_cog
+from src.utils_generalise import generalise
+from src.utils_vectorise import write_features
+
+# Stages of the pipeline, in order
+STAGES = (
+    "retrieve_image_collection",
+    "smooth",
+    "mask_permanent_water",
+    "reduce_noise",
+    "mask_slopes",
+    "reduceToVectors",
+    "generalise",
+    "export",
+    "derive_flood_extents_cold",
+    "derive_flood_extents",
+)
+
+# Counters of the Earth Engine stages, which do not depend on the machine
+COUNTERS = ("calls", "requests", "nodes")
+
+
+def _best_time(function, repeat):
+    """Return the shortest run time of a function and its last output."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, output
+
+
+def benchmark_local(size_km, repeat=3, seed=0, difference_threshold=1.25):
+    """
+    Time each stage of the NumPy backend on a synthetic square area.
+
+    Each stage is timed on the output of the previous ones; the stages
+    working on the 'before' and 'after' scenes are timed on one of them.
+    Inputs:
+        size_km (float): Side of the area in kilometers, at 10 m per pixel.
+        repeat (int): Number of runs of each stage; the shortest is kept.
+        seed (int): Seed of the synthetic scenes.
+        difference_threshold (float): Threshold of the ratio image.
+
+    Returns:
+        results (list): One dictionary per stage, with "seconds".
+    """
+    local = utils_flood_analysis_local
+    local_inputs = synthetic_local_inputs(size_km, seed=seed)
+    transform = local_inputs["transform"]
+    results = []
+
+    def record(stage, function):
+        seconds, output = _best_time(function, repeat)
+        results.append(
+            {
+                "backend": "numpy",
+                "stage": stage,
+                "size_km": size_km,
+                "pixels": int(local_inputs["dem"].size),
+                "seconds": seconds,
+            }
+        )
+        return output
+
+    def retrieve(start_date, end_date):
+        return local.mosaic(
+            local.retrieve_image_collection(
+                local_inputs["scenes"], start_date, end_date
+            )
+        )
+
+    before = record(
+        "retrieve_image_collection",
+        lambda: retrieve(DATES["before_start_date"], DATES["before_end_date"]),
+    )
+    after = retrieve(DATES["after_start_date"], DATES["after_end_date"])
+    before_filtered = record("smooth", lambda: local.smooth(before))
+    after_filtered = local.smooth(after)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        binary = after_filtered / before_filtered > difference_threshold
+    masked = record(
+        "mask_permanent_water",
+        lambda: local.mask_permanent_water(
+            binary, local_inputs["surface_water"]
+        ),
+    )
+    reduced = record("reduce_noise", lambda: local.reduce_noise(masked))
+    flood_rasters = record(
+        "mask_slopes", lambda: local.mask_slopes(reduced, local_inputs["dem"])
+    )
+    flood_vectors = record(
+        "reduceToVectors", lambda: local.vectorise(flood_rasters, transform)
+    )
+    # The synthetic coordinates are in meters
+    record(
+        "generalise",
+        lambda: generalise(
+            flood_vectors, quantum=0.1, meters_per_unit=1, topojson=True
+        ),
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        def export():
+            write_cog(
+                os.path.join(directory, "flood_extents.tif"),
+                flood_rasters,
+                transform,
+                crs=local_inputs.get("crs"),
+            )
+            write_features(
+                flood_vectors, os.path.join(directory, "flood_extents.geojson")
+            )
+
+        record("export", export)
+
+    record(
+        "derive_flood_extents",
+        lambda: utils_flood_analysis.derive_flood_extents(
+            None,
+            **DATES,
+            difference_threshold=difference_threshold,
+            backend="numpy",
+            local_inputs=local_inputs,
+        ),
+    )
+    return results
+
+
+def benchmark_ee(
+    size_km,
+    repeat=3,
+    difference_threshold=1.25,
+    max_untiled_side_km=100,
+    tile_size_km=50,
+):
+    """
+    Build the Earth Engine graphs of each stage for a square area.
+
+    Each stage is run on the output of the previous ones; the counters are
+    those of the last run. Areas larger than max_untiled_side_km are tiled
+    in the derive_flood_extents stage, as in the app.
+    Inputs:
+        size_km (float): Side of the area in kilometers.
+        repeat (int): Number of runs of each stage; the shortest is kept.
+        difference_threshold (float): Threshold of the ratio image.
+        max_untiled_side_km (float): Largest side of an untiled area.
+        tile_size_km (float): Side of the tiles in kilometers.
+
+    Returns:
+        results (list): One dictionary per stage, with "seconds", "calls",
+            "requests" and the graph size of the outputs (see
+            fake_ee.graph_size).
+    """
+    flood = utils_flood_analysis
+    aoi = fake_ee.Geometry.Polygon(aoi_coordinates(size_km))
+    results = []
+
+    def record(stage, function):
+        best = None
+        for _ in range(repeat):
+            fake_ee.RECORDER.reset()
+            start = time.perf_counter()
+            output = function()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        counts = fake_ee.RECORDER.snapshot()
+        result = {
+            "backend": "ee",
+            "stage": stage,
+            "size_km": size_km,
+            "seconds": best,
+            "calls": counts["calls"],
+            "requests": counts["requests"],
+        }
+        roots = output if isinstance(output, tuple) else [output]
+        if all(isinstance(root, fake_ee.Node) for root in roots):
+            result.update(fake_ee.graph_size(list(roots)))
+        results.append(result)
+        return output
+
+    def mosaic(start_date, end_date):
+        return (
+            flood.retrieve_image_collection(aoi, start_date, end_date)
+            .mosaic()
+            .clip(aoi)
+        )
+
+    record(
+        "retrieve_image_collection",
+        lambda: flood.retrieve_image_collection(
+            aoi, DATES["before_start_date"], DATES["before_end_date"]
+        ),
+    )
+    before = mosaic(DATES["before_start_date"], DATES["before_end_date"])
+    after = mosaic(DATES["after_start_date"], DATES["after_end_date"])
+    before_filtered = record("smooth", lambda: flood.smooth(before))
+    after_filtered = flood.smooth(after)
+    binary = after_filtered.divide(before_filtered).gt(difference_threshold)
+    static_mask = flood.get_static_mask()
+    masked = record(
+        "mask_permanent_water",
+        lambda: flood.mask_permanent_water(binary, static_mask),
+    )
+    reduced = record("reduce_noise", lambda: flood.reduce_noise(masked))
+    flood_rasters = record(
+        "mask_slopes", lambda: flood.mask_slopes(reduced, static_mask)
+    )
+    flood_vectors = record(
+        "reduceToVectors",
+        lambda: flood.vectorise_flood_rasters(flood_rasters, aoi),
+    )
+    record(
+        "export",
+        lambda: flood.export_flood_data(
+            flood_vectors,
+            flood_rasters,
+            before_filtered,
+            after_filtered,
+            aoi,
+        ),
+    )
+    tiled = size_km > max_untiled_side_km
+
+    def derive(clear_caches=False):
+        if clear_caches:
+            flood.clear_graph_caches()
+        return tuple(
+            flood.derive_flood_extents(
+                aoi,
+                **DATES,
+                difference_threshold=difference_threshold,
+                tile_size_km=tile_size_km if tiled else None,
+            )
+        )
+
+    # First run of a process, then runs reusing the shared expressions
+    record("derive_flood_extents_cold", lambda: derive(clear_caches=True))
+    record("derive_flood_extents", derive)
+    return results
+
+
+def _git_commit():
+    """Return the current git commit, or None outside a repository."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(
+    local_sizes_km=(5, 10, 20), ee_sizes_km=(10, 100, 200), repeat=3
+):
+    """
+    Run the benchmarks of both backends.
+
+    Inputs:
+        local_sizes_km (list): Sides of the areas of the NumPy backend.
+        ee_sizes_km (list): Sides of the areas of the Earth Engine backend.
+        repeat (int): Number of runs of each stage; the shortest is kept.
+
+    Returns:
+        report (dict): "metadata" of the run and "results" of each stage.
+    """
+    # Load the modules that the pipeline imports on first use, so that their
+    # import is not timed as part of the first stage using them
+    for name in ("scipy.ndimage", "scipy.signal"):
+        importlib.import_module(name)
+    results = []
+    for size_km in ee_sizes_km:
+        results.extend(benchmark_ee(size_km, repeat))
+    for size_km in local_sizes_km:
+        results.extend(benchmark_local(size_km, repeat))
+    return {
+        "metadata": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+
+def _result_key(result):
+    return result["backend"], result["stage"], result["size_km"]
+
+
+def compare_results(report, baseline, tolerance=0.2, min_seconds=0.001):
+    """
+    Compare a report with a baseline report.
+
+    Run times are regressions if they grow by more than the tolerance and by
+    more than min_seconds; the counters of the Earth Engine stages are
+    regressions if they grow at all.
+    Inputs:
+        report (dict): Report of run_suite.
+        baseline (dict): Earlier report of run_suite.
+        tolerance (float): Relative growth of the run time allowed.
+        min_seconds (float): Absolute growth of the run time ignored.
+
+    Returns:
+        comparison (list): One dictionary per stage and metric found in both
+            reports, with "baseline", "current", "ratio" and "regression".
+    """
+    baseline_results = {
+        _result_key(result): result for result in baseline["results"]
+    }
+    comparison = []
+    for result in report["results"]:
+        reference = baseline_results.get(_result_key(result))
+        if reference is None:
+            continue
+        for metric in ("seconds",) + COUNTERS:
+            if metric not in result or metric not in reference:
+                continue
+            current, previous = result[metric], reference[metric]
+            if metric == "seconds":
+                regression = (
+                    current > previous * (1 + tolerance)
+                    and current - previous > min_seconds
+                )
+            else:
+                regression = current > previous
+            comparison.append(
+                {
+                    "backend": result["backend"],
+                    "stage": result["stage"],
+                    "size_km": result["size_km"],
+                    "metric": metric,
+                    "baseline": previous,
+                    "current": current,
+                    "ratio": current / previous if previous else None,
+                    "regression": regression,
+                }
+            )
+    return comparison
+
+
+def format_results(report):
+    """
+    Format the results of a report as a table.
+
+    Inputs:
+        report (dict): Report of run_suite.
+
+    Returns:
+        str: One line per stage.
+    """
+    lines = [
+        f"{'backend':<8}{'stage':<27}{'km':>6}{'seconds':>10}"
+        f"{'calls':>8}{'requests':>10}{'nodes':>8}"
+    ]
+    for result in report["results"]:
+        counters = "".join(
+            f"{result.get(name, ''):>{width}}"
+            for name, width in zip(COUNTERS, (8, 10, 8))
+        )
+        lines.append(
+            f"{result['backend']:<8}{result['stage']:<27}"
+            f"{result['size_km']:>6g}{result['seconds']:>10.4f}{counters}"
+        )
+    return "\n".join(lines)
+
+
+def format_comparison(comparison):
+    """
+    Format a comparison as a table, marking the regressions.
+
+    Inputs:
+        comparison (list): Output of compare_results.
+
+    Returns:
+        str: One line per stage and metric.
+    """
+    lines = [
+        f"{'backend':<8}{'stage':<27}{'km':>6}{'metric':>10}"
+        f"{'baseline':>12}{'current':>12}{'ratio':>8}"
+    ]
+    for row in comparison:
+        ratio = "" if row["ratio"] is None else f"{row['ratio']:.2f}"
+        lines.append(
+            f"{row['backend']:<8}{row['stage']:<27}{row['size_km']:>6g}"
+            f"{row['metric']:>10}{row['baseline']:>12.4g}"
+            f"{row['current']:>12.4g}{ratio:>8}"
+            + ("  REGRESSION" if row["regression"] else "")
+        )
+    return "\n".join(lines)
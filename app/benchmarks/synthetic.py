@@ -0,0 +1,129 @@
+"""Synthetic inputs of the flood pipeline, for any size of area."""
+import math
+
+import numpy as np
+from src.utils_speckle import S1_GRD_ENL, synthetic_sar_scene
+from src.utils_tiling import METERS_PER_DEGREE
+
+# Dates of the synthetic scenes and of the search periods
+BEFORE_DATE = "2022-09-05"
+AFTER_DATE = "2022-10-05"
+DATES = {
+    "before_start_date": "2022-09-01",
+    "before_end_date": "2022-09-30",
+    "after_start_date": "2022-10-01",
+    "after_end_date": "2022-10-30",
+}
+
+# Backscatter of open water in dB, as the river of synthetic_sar_scene
+WATER_DB = -24.0
+
+
+def flood_patches(shape, rng, pixels_per_patch=200000):
+    """
+    Return a mask of elliptic flooded patches.
+
+    Inputs:
+        shape (tuple): Shape of the mask in pixels.
+        rng (np.random.Generator): Random generator.
+        pixels_per_patch (int): Number of pixels of the mask per patch.
+
+    Returns:
+        np.ndarray: Boolean mask, True in the patches.
+    """
+    rows, cols = shape
+    flooded = np.zeros(shape, dtype=bool)
+    for _ in range(max(rows * cols // pixels_per_patch, 1)):
+        row, col = rng.integers(0, rows), rng.integers(0, cols)
+        height, width = rng.integers(10, 150, size=2)
+        window = (
+            slice(max(row - height, 0), min(row + height, rows)),
+            slice(max(col - width, 0), min(col + width, cols)),
+        )
+        grid_rows, grid_cols = np.ogrid[window]
+        flooded[window] |= (
+            ((grid_rows - row) / height) ** 2
+            + ((grid_cols - col) / width) ** 2
+        ) <= 1
+    return flooded
+
+
+def synthetic_local_inputs(size_km, pixel_size=10, seed=0):
+    """
+    Return local inputs of derive_flood_extents for a square area.
+
+    The 'before' scene comes from utils_speckle.synthetic_sar_scene; the
+    'after' scene has the same reflectivity with flooded patches and new
+    speckle. The surface water is the river of the scene, and the DEM is a
+    set of hills steep enough to mask some of the patches.
+    Inputs:
+        size_km (float): Side of the area in kilometers.
+        pixel_size (float): Pixel size in meters.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        local_inputs (dict): Scenes, transform, surface water and DEM, see
+            utils_flood_analysis_local.derive_flood_extents_local.
+    """
+    side = max(int(size_km * 1000 / pixel_size), 1)
+    shape = (side, side)
+    before, reflectivity = synthetic_sar_scene(shape, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    flooded = flood_patches(shape, rng)
+    after_reflectivity = np.where(flooded, WATER_DB, reflectivity)
+    speckle = rng.gamma(S1_GRD_ENL, 1 / S1_GRD_ENL, size=shape)
+    after = 10 * np.log10(np.power(10, after_reflectivity / 10) * speckle)
+
+    surface_water = np.where(reflectivity == WATER_DB, 12, 0)
+    # Hills of 300 m with a period of 20 km reach slopes of about 5 degrees
+    period = 20000 / pixel_size
+    grid_rows, grid_cols = np.ogrid[:side, :side]
+    dem = (
+        300
+        * np.sin(2 * np.pi * grid_cols / period)
+        * np.cos(2 * np.pi * grid_rows / period)
+    )
+    return {
+        "scenes": [
+            {
+                "date": BEFORE_DATE,
+                "pass_direction": "Ascending",
+                "VH": before,
+            },
+            {
+                "date": AFTER_DATE,
+                "pass_direction": "Ascending",
+                "VH": after.astype("float32"),
+            },
+        ],
+        "transform": (0, pixel_size, 0, side * pixel_size, 0, -pixel_size),
+        "surface_water": surface_water.astype("float32"),
+        "dem": dem.astype("float32"),
+    }
+
+
+def aoi_coordinates(size_km, longitude=36.8, latitude=-1.3):
+    """
+    Return the coordinates of a square area of interest in degrees.
+
+    Inputs:
+        size_km (float): Side of the area in kilometers.
+        longitude (float): Longitude of the centre of the area.
+        latitude (float): Latitude of the centre of the area.
+
+    Returns:
+        list: Rings of the polygon, as expected by ee.Geometry.Polygon.
+    """
+    half_side = size_km * 1000 / METERS_PER_DEGREE / 2
+    half_width = half_side / math.cos(math.radians(latitude))
+    west, east = longitude - half_width, longitude + half_width
+    south, north = latitude - half_side, latitude + half_side
+    return [
+        [
+            [west, south],
+            [east, south],
+            [east, north],
+            [west, north],
+            [west, south],
+        ]
+    ]
@@ -0,0 +1,91 @@
+"""Command-line entry point to precompute the static masks of an area.
+
+Example:
+    python app/export_static_masks.py --bbox 67,26,69,28 \
+        --asset-id projects/my-project/assets/static_masks --wait
+
+The static mask of permanent water and steep slopes is exported to an image
+collection asset, one image per grid cell of one degree (see
+src/utils_flood_analysis.export_static_mask). Runs then use it when the
+FLOOD_STATIC_MASK_ASSET environment variable is set to the asset id.
+"""
+import argparse
+import sys
+
+from src.utils_batch import initialize_ee
+from src.utils_flood_analysis import export_static_mask, wait_for_tasks
+from src.utils_imports import lazy_import
+
+ee = lazy_import("ee")
+
+
+def parse_arguments(arguments=None):
+    """
+    Parse the command-line arguments.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Export the static masks of an area to an asset."
+    )
+    parser.add_argument(
+        "--bbox", required=True, help="west,south,east,north in degrees"
+    )
+    parser.add_argument(
+        "--asset-id",
+        required=True,
+        help="Image collection asset, created if it does not exist",
+    )
+    parser.add_argument(
+        "--scale", type=int, default=30, help="Pixel size in meters"
+    )
+    parser.add_argument(
+        "--wait", action="store_true", help="Wait for the exports to finish"
+    )
+    parser.add_argument(
+        "--service-account-key",
+        help="JSON key of a service account used to initialise Earth Engine",
+    )
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    """
+    Start the exports, and wait for them if requested.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        int: Exit code, 1 if an export failed, else 0.
+    """
+    arguments = parse_arguments(arguments)
+    bounds = tuple(float(value) for value in arguments.bbox.split(","))
+    initialize_ee(arguments.service_account_key)
+    try:
+        ee.data.getAsset(arguments.asset_id)
+    except ee.EEException:
+        ee.data.createAsset({"type": "IMAGE_COLLECTION"}, arguments.asset_id)
+    task_ids = export_static_mask(
+        bounds, arguments.asset_id, scale=arguments.scale
+    )
+    print(f"Started {len(task_ids)} exports to {arguments.asset_id}")
+    if not arguments.wait:
+        return 0
+    states = wait_for_tasks(task_ids, timeout=0, verbose=True)
+    failed = [
+        task_id
+        for task_id, state in states.items()
+        if state["state"] != "COMPLETED"
+    ]
+    for task_id in failed:
+        print(f"{task_id}: {states[task_id]['error_message']}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
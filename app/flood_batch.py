@@ -0,0 +1,117 @@
+"""Command-line entry point to derive flood extents for many areas.
+
+Example:
+    python app/flood_batch.py districts.yaml --output-dir results --workers 8
+
+See src/utils_batch.read_manifest for the format of the manifest. The state
+of the batch is saved in the output directory, so running the same command
+again resumes an interrupted batch.
+"""
+import argparse
+import functools
+import os
+import sys
+
+from src.config_parameters import params
+from src.utils_batch import (
+    format_summary,
+    initialize_ee,
+    read_manifest,
+    run_batch,
+    run_job,
+)
+
+
+def parse_arguments(arguments=None):
+    """
+    Parse the command-line arguments.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Derive flood extents for the jobs of a manifest."
+    )
+    parser.add_argument("manifest", help="CSV, YAML or GeoJSON manifest")
+    parser.add_argument(
+        "--output-dir", default="batch_output", help="Output directory"
+    )
+    parser.add_argument(
+        "--output",
+        choices=("download", "drive", "stats"),
+        default="download",
+        help=(
+            "Download the raster and vectors, export them to Google Drive, "
+            "or only compute the flooded area"
+        ),
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Number of concurrent jobs"
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Run the jobs in processes instead of threads",
+    )
+    parser.add_argument(
+        "--retries", type=int, default=2, help="Retries of a failed job"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Run completed jobs again"
+    )
+    parser.add_argument(
+        "--service-account-key",
+        help="JSON key of a service account used to initialise Earth Engine",
+    )
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    """
+    Run a batch from the command line.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        int: Exit code, 1 if any job failed.
+    """
+    arguments = parse_arguments(arguments)
+    jobs = read_manifest(arguments.manifest)
+    os.makedirs(arguments.output_dir, exist_ok=True)
+    if not arguments.processes:
+        initialize_ee(arguments.service_account_key)
+
+    run = functools.partial(
+        run_job,
+        output_dir=arguments.output_dir,
+        output=arguments.output,
+        cache_dir=params["cache_dir"],
+        max_untiled_side_km=params["max_untiled_side_km"],
+        tile_size_km=params["tile_size_km"],
+        max_workers=params["tile_max_workers"],
+    )
+    state = run_batch(
+        jobs,
+        run,
+        state_path=os.path.join(arguments.output_dir, "state.json"),
+        max_workers=arguments.workers,
+        use_processes=arguments.processes,
+        retries=arguments.retries,
+        initializer=initialize_ee,
+        initargs=(arguments.service_account_key,),
+        force=arguments.force,
+    )
+    print(format_summary(jobs, state))
+    failed = any(
+        state["jobs"].get(job["id"], {}).get("status") != "done"
+        for job in jobs
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
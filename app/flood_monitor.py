@@ -0,0 +1,148 @@
+"""Command-line entry point to monitor an ongoing flood over one area.
+
+Example:
+    python app/flood_monitor.py --bbox 67.8,26.9,68.2,27.3 \
+        --before 2022-07-15 2022-08-10 --after-start 2022-08-25
+
+Each run processes the Sentinel-1 acquisitions made since the previous run
+of the same monitor (see src/utils_monitoring.FloodMonitor) and prints the
+history of the flooded area. The baseline and the maximum extent are
+exported to the asset folder given with --asset-folder or the
+FLOOD_MONITORING_ASSET_FOLDER environment variable.
+"""
+import argparse
+import json
+import sys
+
+from src.config_parameters import params
+from src.utils_batch import bbox_geometry, initialize_ee
+from src.utils_monitoring import MONITORING_ASSET_FOLDER, FloodMonitor
+
+
+def parse_arguments(arguments=None):
+    """
+    Parse the command-line arguments.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Update the flood extent of an area with new scenes."
+    )
+    area = parser.add_mutually_exclusive_group(required=True)
+    area.add_argument("--bbox", help="west,south,east,north in degrees")
+    area.add_argument("--geometry", help="GeoJSON file of the area")
+    parser.add_argument(
+        "--before",
+        nargs=2,
+        required=True,
+        metavar=("START", "END"),
+        help="Dates of the reference period, yyyy-mm-dd",
+    )
+    parser.add_argument(
+        "--after-start",
+        required=True,
+        help="First date of the monitored acquisitions, yyyy-mm-dd",
+    )
+    parser.add_argument(
+        "--end", help="Last date, excluded, of the acquisitions to process"
+    )
+    parser.add_argument("--threshold", type=float, default=1.25)
+    parser.add_argument(
+        "--pass-direction",
+        choices=("Ascending", "Descending"),
+        default="Ascending",
+    )
+    parser.add_argument("--speckle-filter", default="focal_mean")
+    parser.add_argument(
+        "--asset-folder",
+        default=MONITORING_ASSET_FOLDER,
+        help=(
+            "Asset folder to which the baseline and the maximum extent are "
+            "exported, by default FLOOD_MONITORING_ASSET_FOLDER"
+        ),
+    )
+    parser.add_argument(
+        "--state-dir",
+        default=params["monitoring_dir"],
+        help="Directory of the states of the monitors",
+    )
+    parser.add_argument(
+        "--service-account-key",
+        help="JSON key of a service account used to initialise Earth Engine",
+    )
+    arguments = parser.parse_args(arguments)
+    if not arguments.asset_folder:
+        parser.error(
+            "an asset folder is required: set --asset-folder or "
+            "FLOOD_MONITORING_ASSET_FOLDER"
+        )
+    return arguments
+
+
+def read_geometry(path):
+    """Return the geometry of a GeoJSON file, or of its first feature."""
+    with open(path) as f:
+        geojson = json.load(f)
+    if geojson["type"] == "FeatureCollection":
+        geojson = geojson["features"][0]
+    if geojson["type"] == "Feature":
+        geojson = geojson["geometry"]
+    return geojson
+
+
+def format_history(history):
+    """
+    Format the history of a monitor as a table.
+
+    Inputs:
+        history (list): Entries of FloodMonitor.history.
+
+    Returns:
+        str: One line per acquisition date.
+    """
+    lines = [f"{'date':<12}{'flooded km2':>14}"]
+    for entry in history:
+        lines.append(f"{entry['date']:<12}{entry['flooded_km2']:>14.2f}")
+    return "\n".join(lines)
+
+
+def main(arguments=None):
+    """
+    Update a monitor from the command line.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        int: Exit code, 0.
+    """
+    arguments = parse_arguments(arguments)
+    geometry = (
+        bbox_geometry(arguments.bbox)
+        if arguments.bbox
+        else read_geometry(arguments.geometry)
+    )
+    initialize_ee(arguments.service_account_key)
+    monitor = FloodMonitor(
+        arguments.state_dir,
+        geometry,
+        before_start_date=arguments.before[0],
+        before_end_date=arguments.before[1],
+        after_start_date=arguments.after_start,
+        difference_threshold=arguments.threshold,
+        pass_direction=arguments.pass_direction,
+        speckle_filter=arguments.speckle_filter,
+        asset_folder=arguments.asset_folder,
+    )
+    entries = monitor.update(arguments.end)
+    print(format_history(monitor.history))
+    print(f"{len(entries)} new acquisition dates processed")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Command-line entry point to simplify flood polygons at levels of detail.
+
+Example:
+    python app/generalise_vectors.py vector.geojson --output-dir lod \
+        --levels download display --zoom 12 --topojson
+
+Each level is written as <level>.geojson (and <level>.topojson) in the
+output directory, with src/utils_generalise, and the reduction of the
+vertices and of the payload is printed.
+"""
+import argparse
+import json
+import os
+import sys
+
+from src.utils_generalise import (
+    DEFAULT_QUANTUM,
+    LEVELS_OF_DETAIL,
+    generalise,
+    tolerance_for_zoom,
+)
+
+
+def parse_arguments(arguments=None):
+    """
+    Parse the command-line arguments.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Simplify flood polygons at levels of detail."
+    )
+    parser.add_argument("path", help="GeoJSON FeatureCollection of polygons")
+    parser.add_argument("--output-dir", default="generalised")
+    parser.add_argument(
+        "--levels",
+        nargs="*",
+        choices=sorted(LEVELS_OF_DETAIL),
+        default=sorted(LEVELS_OF_DETAIL),
+        help="Levels of detail to write",
+    )
+    parser.add_argument(
+        "--zoom",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Zoom levels of a web map to write a level of detail for",
+    )
+    parser.add_argument(
+        "--quantum",
+        type=float,
+        default=DEFAULT_QUANTUM,
+        help="Step of the quantisation grid, in the units of the coordinates",
+    )
+    parser.add_argument(
+        "--meters-per-unit",
+        type=float,
+        default=None,
+        help="Meters per unit of the coordinates, by default for degrees",
+    )
+    parser.add_argument(
+        "--topojson", action="store_true", help="Also write TopoJSON"
+    )
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    """
+    Write the levels of detail and print their reduction.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        int: Exit code, 0.
+    """
+    arguments = parse_arguments(arguments)
+    levels = {name: LEVELS_OF_DETAIL[name] for name in arguments.levels}
+    for zoom in arguments.zoom:
+        levels[f"z{zoom}"] = tolerance_for_zoom(zoom)
+    options = {}
+    if arguments.meters_per_unit is not None:
+        options["meters_per_unit"] = arguments.meters_per_unit
+    with open(arguments.path) as f:
+        flood_vectors = json.load(f)
+    outputs, report = generalise(
+        flood_vectors,
+        levels=levels,
+        quantum=arguments.quantum,
+        topojson=arguments.topojson,
+        **options,
+    )
+    os.makedirs(arguments.output_dir, exist_ok=True)
+    for name, encodings in outputs.items():
+        for encoding, data in encodings.items():
+            path = os.path.join(arguments.output_dir, f"{name}.{encoding}")
+            with open(path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+    inputs = report.pop("input")
+    print(
+        f"input: {inputs['features']} features, {inputs['vertices']} "
+        f"vertices, {inputs['geojson_bytes']} bytes"
+    )
+    for name, row in report.items():
+        line = (
+            f"{name} ({row['tolerance_m']:g} m): {row['features']} features, "
+            f"{row['vertices']} vertices (-{row['vertices_reduction']:.0%}), "
+            f"GeoJSON {row['geojson_bytes']} bytes "
+            f"(-{row['geojson_reduction']:.0%})"
+        )
+        if "topojson_bytes" in row:
+            line += (
+                f", TopoJSON {row['topojson_bytes']} bytes "
+                f"(-{row['topojson_reduction']:.0%})"
+            )
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
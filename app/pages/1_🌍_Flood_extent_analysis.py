@@ -1,12 +1,13 @@
 """Flood extent analysis page for Streamlit app."""
 import datetime as dt
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import ee
 import folium
-import geemap.foliumap as geemap
-import requests
 import streamlit as st
-import streamlit_ext as ste
 from folium.plugins import Draw, Geocoder, MiniMap
 from src.config_parameters import params
 from src.utils import (
@@ -15,13 +16,59 @@ from src.utils import (
     set_tool_page_style,
     toggle_menu_button,
 )
+from src.utils_cache import ResultCache
 from src.utils_ee import ee_initialize
-from src.utils_flood_analysis import derive_flood_extents
+from src.utils_flood_analysis import (
+    THRESHOLDS,
+    derive_flood_extents,
+    derive_flood_extents_multi,
+    derive_flood_levels,
+    deserialize_outputs,
+    flood_extents_at_threshold,
+    flood_extents_cache_key,
+    flood_levels_cache_key,
+    serialize_outputs,
+    threshold_index,
+)
+from src.utils_imports import lazy_import
+from src.utils_metrics import increment, serve_metrics, span, timed
+from src.utils_scene_index import SCENE_FIXTURE, SceneIndex, preflight_check
+from src.utils_speckle import SPECKLE_FILTERS
+from src.utils_tiling import bounds_side_km, polygon_bounds
 from streamlit_folium import st_folium
 
+# Imported on the first computation, so that the input map is shown without
+# waiting for the Earth Engine client (see utils_imports)
+ee = lazy_import("ee")
+
+# Choices of pass direction running all pass directions and polarizations,
+# and the mode of derive_flood_extents_multi they use
+MULTI_PASS_MODES = {"Best available": "best", "Combine all": "combined"}
+
+# Files offered for download, with the label of their format, the part of
+# their file name and their media type: the raster, the GeoJSON vectors, the
+# vectors with a spatial index, for large extents, and the TopoJSON topology
+# of the polygons. Only the file of the selected format is loaded.
+DOWNLOADS = {
+    "raster.tif": ("Raster (GeoTIFF)", "raster", "image/tif"),
+    "vector.geojson": ("Vector (GeoJSON)", "vector", "text/json"),
+    "vector.fgb": ("Vector (FlatGeobuf)", "vector", "application/x-fgb"),
+    "vector.parquet": (
+        "Vector (GeoParquet)",
+        "vector",
+        "application/vnd.apache.parquet",
+    ),
+    "vector.topojson": ("Vector (TopoJSON)", "vector", "application/json"),
+}
+
 # Page configuration
 st.set_page_config(layout="wide", page_title=params["browser_title"])
 
+# Time each run of the page, and serve the metrics of the app if enabled
+# with the FLOOD_METRICS environment variable (see utils_metrics)
+page_span = span("page.run").start()
+serve_metrics()
+
 # If app is deployed hide menu button
 toggle_menu_button()
 
@@ -35,8 +82,135 @@ st.markdown("# Flood extent analysis")
 # Set page style
 set_tool_page_style()
 
-# Initialise Google Earth Engine
-ee_initialize(force_use_service_account=True)
+
+def remove_downloads(cache_key):
+    """Remove the files downloaded for a run, with its cached result."""
+    shutil.rmtree(
+        os.path.join(params["download_dir"], cache_key), ignore_errors=True
+    )
+
+
+# Cache of the results, shared by all sessions
+@st.experimental_singleton
+def get_result_cache():
+    """Create the result cache once per server process."""
+    return ResultCache(
+        cache_dir=params["cache_dir"],
+        max_memory_bytes=params["cache_max_memory_mb"] * 2**20,
+        max_disk_bytes=params["cache_max_disk_mb"] * 2**20,
+        ttl_seconds=params["cache_ttl_hours"] * 3600,
+        on_evict=remove_downloads,
+    )
+
+
+result_cache = get_result_cache()
+
+
+# HTTP session with a connection pool, shared by all sessions
+@st.experimental_singleton
+def get_http_session():
+    """Create the HTTP session once per server process."""
+    # Imported here, so that requests is loaded on the first export only
+    from src.utils_download import create_session
+
+    return create_session()
+
+
+# Index of the Sentinel-1 scenes, shared by all sessions
+@st.experimental_singleton
+def get_scene_index():
+    """Open the scene index once per server process."""
+    scene_index = SceneIndex(params["scene_index_path"])
+    if SCENE_FIXTURE:
+        scene_index.load_fixture(SCENE_FIXTURE)
+    return scene_index
+
+
+scene_index = get_scene_index()
+
+
+def check_scene_coverage(coords, run_parameters):
+    """
+    Check the coverage of the area by Sentinel-1 scenes in both periods.
+
+    The index is refreshed from Earth Engine for the dates not indexed yet,
+    unless a fixture is used.
+    Inputs:
+        coords (list): (longitude, latitude) pairs of the area of interest.
+        run_parameters (dict): Parameters of the run.
+
+    Returns:
+        report (dict): See utils_scene_index.preflight_check, or None if the
+            index could not be refreshed.
+    """
+    search = dt.timedelta(days=params["scene_search_days"])
+    dates = {
+        name: run_parameters[name]
+        for name in (
+            "before_start_date",
+            "before_end_date",
+            "after_start_date",
+            "after_end_date",
+        )
+    }
+    if not SCENE_FIXTURE:
+        try:
+            scene_index.refresh_from_ee(
+                polygon_bounds(coords),
+                str(
+                    dt.date.fromisoformat(dates["before_start_date"]) - search
+                ),
+                str(dt.date.fromisoformat(dates["after_end_date"]) + search),
+            )
+        except ee.EEException:
+            # The pipeline runs without the check
+            increment("errors", stage="page.preflight_check")
+            return None
+    # Runs over all pass directions and polarizations accept any scene
+    polarization, pass_direction = (
+        None if run_parameters[name] == "all" else run_parameters[name]
+        for name in ("polarization", "pass_direction")
+    )
+    return preflight_check(
+        scene_index,
+        {"type": "Polygon", "coordinates": [coords]},
+        polarization=polarization,
+        pass_direction=pass_direction,
+        min_coverage=params["scene_min_coverage"],
+        search_days=params["scene_search_days"],
+        **dates,
+    )
+
+
+def coverage_message(report, pass_direction):
+    """Describe the periods not covered and the nearest acquisitions."""
+    lines = []
+    orbit = (
+        "any pass direction"
+        if pass_direction == "all"
+        else f"the {pass_direction.lower()} pass direction"
+    )
+    for period in ("before", "after"):
+        result = report[period]
+        if result["coverage"] >= params["scene_min_coverage"]:
+            continue
+        lines.append(
+            f"The Sentinel-1 scenes of the {period} flood period cover "
+            f"{result['coverage']:.0%} of the area of interest with "
+            f"{orbit}."
+        )
+        if result["suggestions"]:
+            acquisitions = ", ".join(
+                f"{suggestion['date']} ({suggestion['pass_direction']}, "
+                f"{suggestion['coverage']:.0%})"
+                for suggestion in result["suggestions"]
+            )
+            lines.append(f"Nearest acquisitions: {acquisitions}.")
+        else:
+            lines.append(
+                "No acquisition was found nearby: choose other dates."
+            )
+    return "\n\n".join(lines)
 
 
 # Output_created is useful to decide whether the bottom panel with the
@@ -52,6 +226,457 @@ def callback():
     st.session_state.output_created = False
 
 
+# Local tile server of the downloaded flood extents, shared by all sessions
+@st.experimental_singleton
+def get_tile_server():
+    """Start the tile server once per server process."""
+    # Imported here, as the tiles are only rendered if local_tiles is set
+    from src.utils_tiles import TileServer
+
+    return TileServer(
+        host=params["tile_server_host"],
+        port=params["tile_server_port"],
+        cache_bytes=params["tile_cache_mb"] * 2**20,
+    ).start()
+
+
+def download_file(path, label, file_name, mime):
+    """
+    Offer a downloaded file to the user.
+
+    With local_tiles, the file is linked from the local tile server, which
+    streams it, so the memory of the page does not depend on its size.
+    Otherwise the download button embeds it in the page, up to
+    download_max_inline_mb.
+    Inputs:
+        path (str): Path of the file.
+        label (str): Label of its format, see DOWNLOADS.
+        file_name (str): Name of the downloaded file.
+        mime (str): Media type of the file.
+    """
+    if params["local_tiles"]:
+        url = get_tile_server().add_file(path, file_name, mime)
+        st.markdown(f"[Download {label}]({url})")
+        return
+    size_mb = os.path.getsize(path) / 2**20
+    if size_mb > params["download_max_inline_mb"]:
+        st.warning(
+            f"The {label} file is {size_mb:,.0f} MB, more than the "
+            f"{params['download_max_inline_mb']} MB the page can send: "
+            "please select another format or a smaller area of interest."
+        )
+        return
+    # Imported here, as it is only needed for downloads
+    import streamlit_ext as ste
+
+    with open(path, "rb") as f:
+        ste.download_button(
+            label=f"Download {label}", data=f, file_name=file_name, mime=mime
+        )
+
+
+@timed("page.local_tiles")
+def local_tile_urls(flood_raster, flood_vector, bounds, cache_key):
+    """
+    Download the flood extent of a run once and serve its tiles locally.
+
+    The files are those of the export, which then reuses them.
+    Inputs:
+        flood_raster (ee.Image): Detected flood extents as a binary raster.
+        flood_vector (ee.FeatureCollection): Detected flood extents.
+        bounds (tuple): (west, south, east, north) of the region in degrees.
+        cache_key (str): Cache key of the run, see flood_extents_cache_key.
+
+    Returns:
+        raster_url (str): URL template of the raster tiles, see
+            utils_tiles.TileServer.
+        vector_url (str): URL template of the vector tiles.
+    """
+    # Imported here, so that requests is loaded on the first download only
+    from src.utils_download import download_flood_extents
+
+    record = result_cache.get(cache_key) or {}
+    if "levels_key" in record:
+        return local_level_urls(record["levels_key"], record["level"], bounds)
+    paths = record.get("download_paths")
+    if paths is None or not all(
+        os.path.exists(path) for path in paths.values()
+    ):
+        paths = download_flood_extents(
+            flood_raster,
+            flood_vector,
+            bounds,
+            os.path.join(params["download_dir"], cache_key),
+            session=get_http_session(),
+            max_workers=params["download_max_workers"],
+            level_of_detail=params["download_level_of_detail"],
+            topojson=True,
+        )
+        result_cache.update(cache_key, download_paths=paths)
+    tile_server = get_tile_server()
+    return (
+        tile_server.add_raster(paths["raster.tif"]),
+        tile_server.add_vectors(paths["vector.fgb"]),
+    )
+
+
+@timed("page.local_levels")
+def local_level_urls(levels_key, level, bounds):
+    """
+    Download the threshold levels of a run once and serve one level locally.
+
+    The levels are downloaded on the first change of threshold, then each
+    threshold is rendered and vectorised from the downloaded levels, without
+    requests to Earth Engine.
+    Inputs:
+        levels_key (str): Cache key of the levels, see
+            flood_levels_cache_key.
+        level (int): Level of the threshold, see
+            utils_flood_analysis.threshold_levels.
+        bounds (tuple): (west, south, east, north) of the region in degrees.
+
+    Returns:
+        raster_url (str): URL template of the raster tiles, see
+            utils_tiles.TileServer.
+        vector_url (str): URL template of the vector tiles.
+    """
+    # Imported here, so that requests is loaded on the first download only
+    from src.utils_download import download_image
+    from src.utils_vectorise import vectorise_raster
+
+    directory = os.path.join(params["download_dir"], levels_key)
+    levels_path = os.path.join(directory, "levels.tif")
+    if not os.path.exists(levels_path):
+        record = result_cache.get(levels_key) or {}
+        download_image(
+            ee.Image(ee.deserializer.fromJSON(record["graph"])),
+            bounds,
+            levels_path,
+            session=get_http_session(),
+            max_workers=params["download_max_workers"],
+        )
+    vector_path = os.path.join(directory, f"vector_{level}.fgb")
+    if not os.path.exists(vector_path):
+        vectorise_raster(levels_path, vector_path, min_value=level)
+    tile_server = get_tile_server()
+    return (
+        tile_server.add_raster(levels_path, min_value=level),
+        tile_server.add_vectors(vector_path),
+    )
+
+
+@timed("page.map_layers")
+def output_map_layers(cache_key, bounds):
+    """
+    Return the layers of the output map of a run, from its cached result.
+
+    Sessions only keep the cache key of their run, and the map is rebuilt
+    from the result on each render. If local_tiles is set in the
+    parameters, the flood extent is downloaded once and its tiles, PNG for
+    the raster and vector tiles for the polygons, are served by the local
+    tile server; otherwise the Earth Engine map ids are stored with the
+    result and requested again once expired.
+    Inputs:
+        cache_key (str): Cache key of the run, see flood_extents_cache_key.
+        bounds (tuple): (west, south, east, north) of the region in degrees.
+
+    Returns:
+        layers (list): Layers of the map, see utils_map.add_tile_layers, or
+            None if the result was evicted from the cache.
+    """
+    record = result_cache.get(cache_key)
+    if record is None or "graph" not in record:
+        return None
+    flood_vector, flood_raster, _, _ = deserialize_outputs(record["graph"])
+    if params["local_tiles"]:
+        try:
+            raster_url, vector_url = local_tile_urls(
+                flood_raster, flood_vector, bounds, cache_key
+            )
+        except Exception:
+            # The layers are then rendered by Earth Engine
+            increment("errors", stage="page.local_tiles")
+        else:
+            return [
+                {
+                    "name": "Flood extent raster",
+                    "url": raster_url,
+                    "attribution": "Flood extent",
+                    "type": "tiles",
+                },
+                {
+                    "name": "Flood extent vector",
+                    "url": vector_url,
+                    "attribution": "Flood extent",
+                    "type": "vector_tiles",
+                },
+            ]
+    map_ids = record.get("map_ids")
+    if map_ids is None or map_ids["expires"] < time.time():
+        ee_initialize(force_use_service_account=True)
+        map_ids = {
+            "layers": ee_map_layers(flood_raster, flood_vector),
+            "expires": time.time() + params["map_id_max_age_hours"] * 3600,
+        }
+        result_cache.update(cache_key, map_ids=map_ids)
+    return map_ids["layers"]
+
+
+def ee_map_layers(flood_raster, flood_vector):
+    """
+    Request the Earth Engine map ids of the layers of a flood extent.
+
+    Inputs:
+        flood_raster (ee.Image): Detected flood extents as a binary raster.
+        flood_vector (ee.FeatureCollection): Detected flood extents.
+
+    Returns:
+        layers (list): Layers of the map, see output_map_layers.
+    """
+    # Imported here, as the map ids are only requested on a miss
+    from src.utils_map import ee_tile_url
+
+    # Each layer requests its map id from Earth Engine
+    increment("ee_requests", 2, kind="getMapId")
+    return [
+        {
+            "name": name,
+            "url": ee_tile_url(ee_object),
+            "attribution": "Google Earth Engine",
+            "type": "tiles",
+        }
+        for name, ee_object in (
+            ("Flood extent raster", flood_raster),
+            ("Flood extent vector", flood_vector),
+        )
+    ]
+
+
+@timed("page.level_map_ids")
+def level_map_ids(levels_key, levels, region, tile_size_km):
+    """
+    Return the Earth Engine layers of all thresholds of a run's levels.
+
+    The map ids of all thresholds are requested concurrently on the first
+    change of threshold and stored with the levels, so that the next
+    changes only look them up.
+    Inputs:
+        levels_key (str): Cache key of the levels, see
+            flood_levels_cache_key.
+        levels (ee.Image): Threshold levels, see derive_flood_levels.
+        region (ee.Geometry.Polygon): Geographic extent of analysis area.
+        tile_size_km (float): Side of the tiles, or None for untiled runs.
+
+    Returns:
+        map_ids (dict): "layers", the layers of each level (as a string),
+            see output_map_layers, and "expires".
+    """
+    record = result_cache.get(levels_key) or {}
+    map_ids = record.get("map_ids")
+    if map_ids is not None and map_ids["expires"] >= time.time():
+        return map_ids
+
+    def threshold_layers(threshold):
+        flood_vector, flood_raster = flood_extents_at_threshold(
+            levels, region, threshold, tile_size_km=tile_size_km
+        )
+        return ee_map_layers(flood_raster, flood_vector)
+
+    expires = time.time() + params["map_id_max_age_hours"] * 3600
+    with ThreadPoolExecutor(
+        max_workers=params["map_id_max_workers"]
+    ) as executor:
+        layers = list(executor.map(threshold_layers, THRESHOLDS))
+    map_ids = {
+        "layers": {
+            str(level): level_layers
+            for level, level_layers in enumerate(layers, start=1)
+        },
+        "expires": expires,
+    }
+    result_cache.update(levels_key, map_ids=map_ids)
+    return map_ids
+
+
+@timed("page.create_output_map")
+def create_output_map(layers, bounds):
+    """
+    Create the output map with the flood raster and vector layers.
+
+    Inputs:
+        layers (list): Layers of the map, see output_map_layers.
+        bounds (tuple): (west, south, east, north) of the region in degrees,
+            on which the map is centred.
+
+    Returns:
+        output_map (geemap.Map): Output map.
+    """
+    # Imported here, as geemap is only needed once a flood extent is shown
+    import geemap.foliumap as geemap
+    from src.utils_map import add_tile_layers
+
+    output_map = geemap.Map(
+        # basemap="HYBRID",
+        plugin_Draw=False,
+        Draw_export=False,
+        locate_control=False,
+        plugin_LatLngPopup=False,
+    )
+    add_tile_layers(output_map, layers)
+    west, south, east, north = bounds
+    output_map.fit_bounds([[south, west], [north, east]])
+    return output_map
+
+
+def compute_flood_extents(aoi, run_parameters, multi_mode, tile_size_km):
+    """
+    Derive the flood extent of a run.
+
+    With multi_mode ('best' or 'combined', see MULTI_PASS_MODES), all pass
+    directions and polarizations are run and their coverage of the area is
+    shown.
+    Inputs:
+        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
+        run_parameters (dict): Parameters of the run.
+        multi_mode (str): Mode of derive_flood_extents_multi, or None.
+        tile_size_km (float): Side of the tiles, or None for untiled runs.
+
+    Returns:
+        flood_vector (ee.FeatureCollection): Detected flood extents.
+        flood_raster (ee.Image): Detected flood extents as a binary raster.
+        run_parameters (dict): Parameters of the run, with the pass direction
+            and polarization used.
+    """
+    if not multi_mode:
+        flood_vector, flood_raster, _, _ = derive_flood_extents(
+            aoi=aoi,
+            export=False,
+            tile_size_km=tile_size_km,
+            max_workers=params["tile_max_workers"],
+            cache=result_cache,
+            **run_parameters,
+        )
+        return flood_vector, flood_raster, run_parameters
+    multi_parameters = dict(run_parameters)
+    del multi_parameters["polarization"]
+    del multi_parameters["pass_direction"]
+    flood_vector, flood_raster, _, _, report = derive_flood_extents_multi(
+        aoi=aoi,
+        mode=multi_mode,
+        tile_size_km=tile_size_km,
+        max_workers=params["tile_max_workers"],
+        cache=result_cache,
+        **multi_parameters,
+    )
+    st.info(
+        "Coverage of the area of interest: "
+        + ", ".join(
+            f"{row['pass_direction']} {row['polarization']} "
+            f"{row['coverage']:.0%}"
+            for row in report["combinations"]
+        )
+    )
+    run_parameters = dict(
+        run_parameters,
+        polarization=report["polarization"],
+        pass_direction=report["pass_direction"],
+    )
+    return flood_vector, flood_raster, run_parameters
+
+
+@timed("page.threshold_result")
+def threshold_result(region, run_parameters, previous_key, tile_size_km):
+    """
+    Store the result of a run at a new threshold, from its threshold levels.
+
+    The levels of all thresholds are derived once per area and dates (see
+    derive_flood_levels) and cached, and the result of each threshold
+    selects its level. The result keeps the key of the levels, from which
+    local tiles are rendered.
+    Inputs:
+        region (ee.Geometry.Polygon): Geographic extent of analysis area.
+        run_parameters (dict): Parameters of the run, with the new threshold.
+        previous_key (str): Cache key of the result of the run at the
+            previous threshold, whose filtered images are kept.
+        tile_size_km (float): Side of the tiles, or None for untiled runs.
+
+    Returns:
+        bool: False if the result of the previous threshold was evicted from
+            the cache.
+    """
+    cache_key = flood_extents_cache_key(region, **run_parameters)
+    record = result_cache.get(cache_key) or {}
+    if "graph" in record:
+        return True
+    previous = result_cache.get(previous_key) or {}
+    if "graph" not in previous:
+        return False
+    _, _, before_filtered, after_filtered = deserialize_outputs(
+        previous["graph"]
+    )
+    levels_parameters = dict(run_parameters)
+    difference_threshold = levels_parameters.pop("difference_threshold")
+    levels = derive_flood_levels(
+        region,
+        tile_size_km=tile_size_km,
+        cache=result_cache,
+        **levels_parameters,
+    )
+    flood_vector, flood_raster = flood_extents_at_threshold(
+        levels, region, difference_threshold, tile_size_km=tile_size_km
+    )
+    levels_key = flood_levels_cache_key(region, **levels_parameters)
+    level = threshold_index(difference_threshold) + 1
+    record = dict(
+        graph=serialize_outputs(
+            (flood_vector, flood_raster, before_filtered, after_filtered)
+        ),
+        levels_key=levels_key,
+        level=level,
+    )
+    if not params["local_tiles"]:
+        map_ids = level_map_ids(levels_key, levels, region, tile_size_km)
+        record["map_ids"] = {
+            "layers": map_ids["layers"][str(level)],
+            "expires": map_ids["expires"],
+        }
+    result_cache.update(cache_key, **record)
+    return True
+
+
+# Function to be used when the threshold changes: the flood extent is
+# selected from the threshold levels of the last run, without building its
+# pipeline again
+def rethreshold():
+    """Apply the new threshold to the output, or reset tool."""
+    if not st.session_state.output_created:
+        callback()
+        return
+    run_parameters = dict(
+        st.session_state.run_parameters,
+        difference_threshold=st.session_state.threshold,
+    )
+    region = ee.Geometry.Polygon(st.session_state.coords)
+    cache_key = flood_extents_cache_key(region, **run_parameters)
+    try:
+        if not threshold_result(
+            region,
+            run_parameters,
+            st.session_state.cache_key,
+            st.session_state.tile_size_km,
+        ):
+            callback()
+            return
+        # Request the layers of the new threshold
+        output_map_layers(cache_key, st.session_state.region_bounds)
+    except ee.EEException:
+        increment("errors", stage="page.rethreshold")
+        callback()
+        return
+    st.session_state.run_parameters = run_parameters
+    st.session_state.cache_key = cache_key
+
+
 # Create two rows: top and bottom panel
 row1 = st.container()
 row2 = st.container()
@@ -84,7 +709,8 @@ with col1:
         # Add minimap to map
         MiniMap().add_to(Map)
         # Export map to Streamlit
-        output = st_folium(Map, width=800, height=600)
+        with span("page.render_input_map"):
+            output = st_folium(Map, width=800, height=600)
 with col2:
     # Add collapsable container for image dates
     with st.expander("Choose Image Dates"):
@@ -125,17 +751,32 @@ with col2:
         # Add slider for threshold
         add_slider = st.slider(
             label="Select a threshold",
-            min_value=0.0,
-            max_value=5.0,
+            min_value=THRESHOLDS[0],
+            max_value=THRESHOLDS[-1],
             value=1.25,
-            step=0.25,
+            step=THRESHOLDS[1] - THRESHOLDS[0],
             help="Higher values might reduce overall noise",
-            on_change=callback,
+            key="threshold",
+            on_change=rethreshold,
         )
         # Add radio buttons for pass direction
         pass_direction = st.radio(
             "Set pass direction",
-            ["Ascending", "Descending"],
+            ["Ascending", "Descending"] + list(MULTI_PASS_MODES),
+            help=(
+                "'Best available' runs both pass directions and both "
+                "polarizations and keeps the one covering most of the area; "
+                "'Combine all' merges their flood extents"
+            ),
+            on_change=callback,
+        )
+        # Add selector for the speckle filter
+        speckle_filter = st.selectbox(
+            "Select a speckle filter",
+            sorted(SPECKLE_FILTERS),
+            index=sorted(SPECKLE_FILTERS).index("focal_mean"),
+            format_func=lambda name: name.replace("_", " ").capitalize(),
+            help="Filter used to reduce the radar speckle",
             on_change=callback,
         )
     # Button for computation
@@ -158,145 +799,245 @@ if submitted:
         else:
             # Add output for computation
             with st.spinner("Computing... Please wait..."):
+                # Initialise Google Earth Engine on the first computation
+                with span("page.ee_initialize"):
+                    ee_initialize(force_use_service_account=True)
                 # Extract coordinates from drawn polygon
                 coords = output["all_drawings"][-1]["geometry"]["coordinates"][
                     0
                 ]
                 # Create geometry from coordinates
                 ee_geom_region = ee.Geometry.Polygon(coords)
-                # Crate flood raster and vector
-                (
-                    detected_flood_vector,
-                    detected_flood_raster,
-                    _,
-                    _,
-                ) = derive_flood_extents(
-                    aoi=ee_geom_region,
+                # Split large areas of interest into tiles
+                tile_size_km = (
+                    params["tile_size_km"]
+                    if bounds_side_km(coords) > params["max_untiled_side_km"]
+                    else None
+                )
+                # Runs over all pass directions and polarizations
+                multi_mode = MULTI_PASS_MODES.get(pass_direction)
+                # Parameters of the run, used to retrieve cached results
+                run_parameters = dict(
                     before_start_date=str(before_start),
                     before_end_date=str(before_end),
                     after_start_date=str(after_start),
                     after_end_date=str(after_end),
                     difference_threshold=add_slider,
-                    polarization="VH",
-                    pass_direction=pass_direction,
-                    export=False,
-                )
-                # Create output map
-                Map2 = geemap.Map(
-                    # basemap="HYBRID",
-                    plugin_Draw=False,
-                    Draw_export=False,
-                    locate_control=False,
-                    plugin_LatLngPopup=False,
+                    polarization="all" if multi_mode else "VH",
+                    pass_direction="all" if multi_mode else pass_direction,
+                    speckle_filter=speckle_filter,
                 )
-                try:
-                    # Add flood vector layer to map
-                    Map2.add_layer(
-                        ee_object=detected_flood_raster,
-                        name="Flood extent raster",
-                    )
-                    Map2.add_layer(
-                        ee_object=detected_flood_vector,
-                        name="Flood extent vector",
-                    )
-                    # Center map on flood raster
-                    Map2.centerObject(detected_flood_raster)
-                except ee.EEException:
-                    # If error contains the sentence below, it means that
-                    # an image could not be properly generated
+                # Check that Sentinel-1 scenes cover the area in both
+                # periods before running the pipeline
+                with span("page.preflight_check"):
+                    preflight = check_scene_coverage(coords, run_parameters)
+                if preflight is not None and not preflight["ok"]:
                     st.error(
-                        """
-                        No satellite image found for the selected
-                        dates.\n\n
-                        Try changing the pass direction.\n\n
-                        If this does not work, choose different
-                        dates: it is likely that the satellite did not
-                        cover the area of interest in the range of
-                        dates specified (either before or after the
-                        flooding event).
-                        """
+                        coverage_message(
+                            preflight, run_parameters["pass_direction"]
+                        )
                     )
                 else:
-                    # If computation was succesfull, save outputs for
-                    # output map
-                    st.success("Computation complete")
-                    st.session_state.output_created = True
-                    st.session_state.Map2 = Map2
-                    st.session_state.detected_flood_raster = (
-                        detected_flood_raster
-                    )
-                    st.session_state.detected_flood_vector = (
-                        detected_flood_vector
-                    )
-                    st.session_state.ee_geom_region = ee_geom_region
+                    try:
+                        # Crate flood raster and vector
+                        _, _, run_parameters = compute_flood_extents(
+                            ee_geom_region,
+                            run_parameters,
+                            multi_mode,
+                            tile_size_km,
+                        )
+                        # Request the layers of the output map, stored with
+                        # the result of the run
+                        cache_key = flood_extents_cache_key(
+                            ee_geom_region, **run_parameters
+                        )
+                        output_map_layers(cache_key, polygon_bounds(coords))
+                    except (ee.EEException, ValueError):
+                        increment("errors", stage="page.compute")
+                        # If error contains the sentence below, it means that
+                        # an image could not be properly generated
+                        st.error(
+                            """
+                            No satellite image found for the selected
+                            dates.\n\n
+                            Try changing the pass direction.\n\n
+                            If this does not work, choose different
+                            dates: it is likely that the satellite did not
+                            cover the area of interest in the range of
+                            dates specified (either before or after the
+                            flooding event).
+                            """
+                        )
+                    else:
+                        # If computation was succesfull, save outputs for
+                        # output map
+                        st.success("Computation complete")
+                        # Only the key of the result is kept in the
+                        # session: the result itself is in the cache, shared
+                        # by all sessions and bounded in size
+                        st.session_state.output_created = True
+                        st.session_state.cache_key = cache_key
+                        st.session_state.coords = coords
+                        st.session_state.region_bounds = polygon_bounds(coords)
+                        st.session_state.run_parameters = run_parameters
+                        st.session_state.tile_size_km = tile_size_km
 # If computation was successful, create output map in bottom panel
+if st.session_state.output_created:
+    try:
+        output_layers = output_map_layers(
+            st.session_state.cache_key, st.session_state.region_bounds
+        )
+    except ee.EEException:
+        increment("errors", stage="page.render_output_map")
+        callback()
+        row2.error(
+            "The output map could not be loaded: please compute the flood "
+            "extent again."
+        )
+    else:
+        if output_layers is None:
+            # The result was evicted from the cache
+            callback()
+            row2.warning(
+                "The result of this analysis has expired: please compute "
+                "the flood extent again."
+            )
 if st.session_state.output_created:
     with row2:
         # Add collapsable container for output map
         with st.expander("Output map", expanded=True):
-            # Export Map2 to streamlit
-            st.session_state.Map2.to_streamlit()
-            # Create button to export to file
+            # Rebuild the output map from the cached result
+            with span("page.render_output_map"):
+                create_output_map(
+                    output_layers, st.session_state.region_bounds
+                ).to_streamlit()
+            # Create selector of the format and button to export to file
+            download_name = st.selectbox(
+                "Format",
+                list(DOWNLOADS),
+                format_func=lambda name: DOWNLOADS[name][0],
+            )
             submitted2 = st.button("Export to file")
             # What happens if button is clicked on?
             if submitted2:
                 # Add output for computation
                 with st.spinner("Computing... Please wait..."):
-                    try:
-                        # Get download url for raster data
-                        raster = st.session_state.detected_flood_raster
-                        url_r = raster.getDownloadUrl(
-                            {
-                                "region": st.session_state.ee_geom_region,
-                                "scale": 30,
-                                "format": "GEO_TIFF",
-                            }
-                        )
-                    except Exception:
-                        st.error(
-                            """
-                            The image size is too big for the image to
-                            be exported to file. Select a smaller area
-                            of interest (side <~ 150km) and repeat the
-                            analysis.
-                            """
+                    # Imported here, as it is only needed for exports
+                    from src.utils_download import (
+                        MAX_GENERALISED_FEATURES,
+                        download_flood_extents,
+                    )
+
+                    ee_initialize(force_use_service_account=True)
+                    # Reuse the files downloaded for the same run, if any
+                    record = result_cache.get(st.session_state.cache_key)
+                    if record is None or "graph" not in record:
+                        # The result was evicted from the cache since the
+                        # output map was rendered
+                        callback()
+                        paths = None
+                        st.warning(
+                            "The result of this analysis has expired: please "
+                            "compute the flood extent again."
                         )
                     else:
-                        response_r = requests.get(url_r)
-                        # Get download url for raster data
-                        vector = st.session_state.detected_flood_vector
-                        url_v = vector.getDownloadUrl("GEOJSON")
-                        response_v = requests.get(url_v)
+                        (
+                            flood_vector,
+                            flood_raster,
+                            _,
+                            _,
+                        ) = deserialize_outputs(record["graph"])
+                        paths = record.get("download_paths")
+                        # Large downloads have no generalised vectors, see
+                        # download_flood_extents
+                        cached = paths is not None and all(
+                            os.path.exists(path) for path in paths.values()
+                        )
+                        increment(
+                            "cache_requests",
+                            cache="downloads",
+                            result="hit" if cached else "miss",
+                        )
+                        if not cached:
+                            try:
+                                paths = download_flood_extents(
+                                    flood_raster,
+                                    flood_vector,
+                                    st.session_state.region_bounds,
+                                    os.path.join(
+                                        params["download_dir"],
+                                        st.session_state.cache_key,
+                                    ),
+                                    session=get_http_session(),
+                                    max_workers=params["download_max_workers"],
+                                    level_of_detail=params[
+                                        "download_level_of_detail"
+                                    ],
+                                    topojson=True,
+                                )
+                            except Exception:
+                                increment("errors", stage="page.download")
+                                paths = None
+                                st.error(
+                                    """
+                                    The flood extent could not be exported to
+                                    file. Please try again, or select a smaller
+                                    area of interest and repeat the analysis.
+                                    """
+                                )
+                            else:
+                                result_cache.update(
+                                    st.session_state.cache_key,
+                                    download_paths=paths,
+                                )
+                    if paths is not None:
                         filename = "flood_extent"
                         timestamp = dt.datetime.now().strftime(
                             "%Y-%m-%d_%H-%M"
                         )
                         with row2:
-                            # Create download buttons for raster and vector
-                            # data
-                            with open("flood_extent.tif", "wb"):
-                                ste.download_button(
-                                    label="Download Raster Extent",
-                                    data=response_r.content,
-                                    file_name=(
-                                        f"{filename}"
-                                        "_raster_"
-                                        f"{timestamp}"
-                                        ".tif"
-                                    ),
-                                    mime="image/tif",
+                            # Create the download button of the selected
+                            # format
+                            label, part, mime = DOWNLOADS[download_name]
+                            if download_name not in paths:
+                                st.warning(
+                                    f"{label} is only available for up to "
+                                    f"{MAX_GENERALISED_FEATURES:,} polygons: "
+                                    "please select another format."
                                 )
-                            with open("flood_extent.geojson", "wb"):
-                                ste.download_button(
-                                    label="Download Vector Extent",
-                                    data=response_v.content,
-                                    file_name=(
-                                        f"{filename}"
-                                        "_vector_"
-                                        f"{timestamp}"
-                                        ".geojson"
-                                    ),
-                                    mime="text/json",
+                            else:
+                                download_file(
+                                    paths[download_name],
+                                    label,
+                                    f"{filename}_{part}_{timestamp}"
+                                    + os.path.splitext(download_name)[1],
+                                    mime,
+                                )
+                            if "generalisation.json" not in paths:
+                                st.caption(
+                                    "Vectors not simplified: more than "
+                                    f"{MAX_GENERALISED_FEATURES:,} polygons"
+                                )
+                            else:
+                                # Reduction of the vertices by the
+                                # simplification
+                                with open(paths["generalisation.json"]) as f:
+                                    report = json.load(f)
+                                level = report[
+                                    params["download_level_of_detail"]
+                                ]
+                                st.caption(
+                                    "Vectors simplified to "
+                                    f"{level['tolerance_m']:g} m: "
+                                    f"{report['input']['vertices']:,} to "
+                                    f"{level['vertices']:,} vertices "
+                                    f"(-{level['vertices_reduction']:.0%}), "
+                                    "GeoJSON "
+                                    f"-{level['geojson_reduction']:.0%}, "
+                                    "TopoJSON "
+                                    f"-{level['topojson_reduction']:.0%}"
                                 )
                         # Output for computation complete
                         st.success("Computation complete")
+
+page_span.finish()
@@ -0,0 +1,142 @@
+"""Report the import time of each module loaded when the app starts.
+
+Example:
+    python app/profile_startup.py --top 30
+    python app/profile_startup.py --deferred
+
+The import statements at the top of the pages are run in a fresh process, in
+order, as on the first run of a page on a new worker, and the time spent
+importing each module is reported. With --deferred, the modules that the
+pages import on the first computation or export are imported afterwards, to
+show the time the deferral saves.
+"""
+import argparse
+import ast
+import os
+import sys
+
+from src.utils_imports import ImportProfiler, format_import_report
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pages profiled by default, in the order a user opens them
+PAGES = (
+    os.path.join(APP_DIR, "Home.py"),
+    os.path.join(APP_DIR, "pages", "1_🌍_Flood_extent_analysis.py"),
+)
+
+# Modules imported by the pages on the first computation or export
+DEFERRED_MODULES = (
+    "ee",
+    "geemap.foliumap",
+    "google.oauth2.service_account",
+    "scipy.ndimage",
+    "scipy.signal",
+    "requests",
+    "rasterio",
+    "streamlit_ext",
+    "src.utils_download",
+)
+
+
+def top_level_imports(path):
+    """
+    Return the import statements at the top level of a script.
+
+    Inputs:
+        path (str): Path of the script.
+
+    Returns:
+        list: ast.Import and ast.ImportFrom nodes, in order.
+    """
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    return [
+        node
+        for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    ]
+
+
+def run_imports(statements, path):
+    """
+    Run import statements, reporting those that fail.
+
+    Inputs:
+        statements (list): ast.Import and ast.ImportFrom nodes.
+        path (str): Path of the script they come from.
+
+    Returns:
+        failed (list): Source of the statements that raised ImportError.
+    """
+    failed = []
+    for statement in statements:
+        code = compile(
+            ast.Module(body=[statement], type_ignores=[]), path, "exec"
+        )
+        try:
+            exec(code, {"__name__": "__profile__"})
+        except ImportError:
+            failed.append(ast.unparse(statement))
+    return failed
+
+
+def main(arguments=None):
+    """
+    Profile the imports of the pages from the command line.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        int: Exit code, 0.
+    """
+    parser = argparse.ArgumentParser(
+        description="Report the import time of the modules of the pages."
+    )
+    parser.add_argument(
+        "pages", nargs="*", default=PAGES, help="Scripts to profile"
+    )
+    parser.add_argument(
+        "--top", type=int, default=25, help="Number of modules to show"
+    )
+    parser.add_argument(
+        "--deferred",
+        action="store_true",
+        help="Also import the modules deferred to the first computation",
+    )
+    arguments = parser.parse_args(arguments)
+
+    profiler = ImportProfiler()
+    failed = []
+    with profiler:
+        for page in arguments.pages:
+            failed += run_imports(top_level_imports(page), page)
+    startup = sum(
+        record["seconds"] for record in profiler.records if not record["depth"]
+    )
+    deferred = 0
+    if arguments.deferred:
+        count = len(profiler.records)
+        with profiler:
+            statements = ast.parse(
+                "\n".join(f"import {name}" for name in DEFERRED_MODULES)
+            ).body
+            failed += run_imports(statements, "<deferred>")
+        deferred = sum(
+            record["seconds"]
+            for record in profiler.records[count:]
+            if not record["depth"]
+        )
+
+    print(format_import_report(profiler.report(arguments.top)))
+    print(f"\nImports of the pages: {startup:.3f}s")
+    if arguments.deferred:
+        print(f"Imports deferred to the first computation: {deferred:.3f}s")
+    for statement in failed:
+        print(f"Not installed: {statement}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -56,6 +56,47 @@ params = {
         "https://www.sciencedirect.com/science/article/abs/pii/"
         "S0924271620301702"
     ),
+    # Tiling of large areas of interest
+    "max_untiled_side_km": 100,
+    "tile_size_km": 50,
+    "tile_max_workers": 4,
+    # Cache of the results
+    "cache_dir": ".cache/flood_extents",
+    "cache_max_memory_mb": 256,
+    "cache_max_disk_mb": 4096,
+    # Results not used for this time are evicted; sessions only keep the
+    # key of their result, so a page left open longer must compute again
+    "cache_ttl_hours": 24,
+    # Earth Engine map ids of the output map are stored with the result and
+    # requested again after this time, as they expire
+    "map_id_max_age_hours": 4,
+    # Concurrent requests of the map ids of all thresholds of a run, on the
+    # first change of threshold
+    "map_id_max_workers": 8,
+    # Spool directory of the downloaded files
+    "download_dir": ".cache/downloads",
+    "download_max_workers": 4,
+    # Level of detail of the downloaded vectors, see
+    # utils_generalise.LEVELS_OF_DETAIL
+    "download_level_of_detail": "download",
+    # Files are embedded in the page by the download button, so they are
+    # loaded in memory; larger files are only offered as links to the local
+    # tile server, which streams them (with local_tiles)
+    "download_max_inline_mb": 100,
+    # Render the flood raster of the output map from a local download, on a
+    # local tile server, instead of Earth Engine (the browser must reach
+    # the server, e.g. when the app runs locally)
+    "local_tiles": False,
+    "tile_server_host": "127.0.0.1",
+    "tile_server_port": 8765,
+    "tile_cache_mb": 64,
+    # State of the flood monitors, see utils_monitoring
+    "monitoring_dir": ".cache/monitoring",
+    # Index of the Sentinel-1 scenes, used to check the coverage of the
+    # area of interest before a run
+    "scene_index_path": ".cache/s1_scenes.sqlite",
+    "scene_min_coverage": 0.99,
+    "scene_search_days": 30,
     # Layout and styles
     ## Sidebar
     "MA_logo_width": "60%",
@@ -0,0 +1,498 @@
+"""Functions to derive flood extents for many areas of interest at once.
+
+Jobs are read from a manifest (CSV, YAML or GeoJSON), run on a bounded pool
+of threads or processes with retries, and their state is saved after each
+job, so that an interrupted batch resumes where it stopped.
+"""
+import csv
+import functools
+import json
+import math
+import os
+import re
+import time
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+
+import ee
+from shapely.geometry import shape
+from src.utils_cache import ResultCache, canonical_hash
+from src.utils_download import create_session, download_flood_extents
+from src.utils_flood_analysis import (
+    derive_flood_extents,
+    export_flood_data,
+    flooded_area_km2,
+)
+from src.utils_tiling import METERS_PER_DEGREE, bounds_side_km, polygon_bounds
+
+DATE_FIELDS = (
+    "before_start_date",
+    "before_end_date",
+    "after_start_date",
+    "after_end_date",
+)
+
+# Optional parameters of derive_flood_extents that jobs can set
+PARAMETER_FIELDS = {
+    "difference_threshold": float,
+    "polarization": str,
+    "pass_direction": str,
+    "speckle_filter": str,
+}
+
+
+def bbox_geometry(bbox):
+    """
+    Return the GeoJSON polygon of a bounding box.
+
+    Inputs:
+        bbox (list or str): (west, south, east, north) in degrees, or the
+            same values separated by commas.
+
+    Returns:
+        dict: GeoJSON Polygon.
+    """
+    if isinstance(bbox, str):
+        bbox = bbox.split(",")
+    west, south, east, north = (float(value) for value in bbox)
+    return {
+        "type": "Polygon",
+        "coordinates": [
+            [
+                [west, south],
+                [east, south],
+                [east, north],
+                [west, north],
+                [west, south],
+            ]
+        ],
+    }
+
+
+def _normalise_job(raw, index, defaults=None):
+    """Return a job from a manifest entry, with validated fields."""
+    entry = dict(defaults or {})
+    entry.update({key: value for key, value in raw.items() if value != ""})
+    job = {"id": str(entry.get("id") or f"job_{index + 1}")}
+    geometry = entry.get("geometry")
+    if isinstance(geometry, str):
+        geometry = json.loads(geometry)
+    if geometry is None and "bbox" in entry:
+        geometry = bbox_geometry(entry["bbox"])
+    if geometry is None:
+        raise ValueError(f"Job {job['id']} has no geometry or bbox.")
+    job["geometry"] = geometry
+    for field in DATE_FIELDS:
+        if field not in entry:
+            raise ValueError(f"Job {job['id']} has no {field}.")
+        job[field] = str(entry[field])
+    for field, cast in PARAMETER_FIELDS.items():
+        if field in entry:
+            job[field] = cast(entry[field])
+    return job
+
+
+def read_manifest(path):
+    """
+    Read the jobs of a batch from a manifest file.
+
+    CSV manifests have one row per job, with the columns id, geometry (a
+    GeoJSON geometry) or bbox ("west,south,east,north"), the four dates
+    (before_start_date, ...) and optionally difference_threshold,
+    polarization, pass_direction and speckle_filter. YAML manifests have a
+    "jobs" list of the same fields, and optional "defaults" shared by all
+    jobs. GeoJSON manifests are FeatureCollections with one feature per job,
+    the fields being the feature properties.
+    Inputs:
+        path (str): Path of the manifest (.csv, .yaml, .yml, .geojson or
+            .json).
+
+    Returns:
+        jobs (list): One dictionary per job.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    defaults = {}
+    with open(path, newline="") as f:
+        if extension == ".csv":
+            entries = list(csv.DictReader(f))
+        elif extension in (".yaml", ".yml"):
+            # Imported here, as only YAML manifests need it
+            import yaml
+
+            manifest = yaml.safe_load(f)
+            defaults = manifest.get("defaults", {})
+            entries = manifest["jobs"]
+        elif extension in (".geojson", ".json"):
+            entries = [
+                dict(
+                    feature.get("properties") or {},
+                    geometry=feature["geometry"],
+                    id=(feature.get("properties") or {}).get("id")
+                    or feature.get("id"),
+                )
+                for feature in json.load(f)["features"]
+            ]
+        else:
+            raise ValueError(f"Unknown manifest format: {extension}")
+    jobs = [
+        _normalise_job(entry, index, defaults)
+        for index, entry in enumerate(entries)
+    ]
+    ids = [job["id"] for job in jobs]
+    if len(set(ids)) != len(ids):
+        raise ValueError("Job ids must be unique.")
+    return jobs
+
+
+def _geometry_coordinates(geometry):
+    """Return all the positions of a Polygon or MultiPolygon."""
+    if geometry["type"] == "Polygon":
+        return [point for ring in geometry["coordinates"] for point in ring]
+    return [
+        point
+        for polygon in geometry["coordinates"]
+        for ring in polygon
+        for point in ring
+    ]
+
+
+def aoi_area_km2(geometry):
+    """
+    Return the approximate area of a geometry in square kilometers.
+
+    Inputs:
+        geometry (dict): GeoJSON geometry in degrees.
+
+    Returns:
+        float: Area, scaled at the latitude of the centroid.
+    """
+    polygon = shape(geometry)
+    scale = METERS_PER_DEGREE / 1000
+    latitude = math.radians(polygon.centroid.y)
+    return polygon.area * scale * scale * math.cos(latitude)
+
+
+def initialize_ee(service_account_key=None):
+    """
+    Initialise Google Earth Engine outside of the Streamlit app.
+
+    Inputs:
+        service_account_key (str): Path of the JSON key of a service
+            account. If None, the credentials of the local user are used.
+
+    Returns:
+        None
+    """
+    if service_account_key:
+        with open(service_account_key) as f:
+            email = json.load(f)["client_email"]
+        ee.Initialize(
+            ee.ServiceAccountCredentials(email, key_file=service_account_key)
+        )
+    else:
+        ee.Initialize()
+
+
+@functools.lru_cache(maxsize=None)
+def _get_cache(cache_dir):
+    """Return the result cache of a directory, shared within a process."""
+    return ResultCache(cache_dir) if cache_dir else None
+
+
+@functools.lru_cache(maxsize=None)
+def _get_session(pool_size):
+    """Return the HTTP session shared within a process."""
+    return create_session(pool_size=pool_size)
+
+
+def run_job(
+    job,
+    output_dir,
+    output="download",
+    cache_dir=None,
+    max_untiled_side_km=100,
+    tile_size_km=50,
+    max_workers=4,
+):
+    """
+    Derive the flood extents of one job and write its outputs.
+
+    Inputs:
+        job (dict): Job read from a manifest, see read_manifest.
+        output_dir (str): Directory of the outputs; each job writes to a
+            subdirectory named after its id.
+        output (str): 'download' to download the raster and vectors,
+            'drive' to export them to Google Drive, or 'stats' to only
+            compute the flooded area.
+        cache_dir (str): Directory of the result cache, or None.
+        max_untiled_side_km (float): Areas of interest with a larger side
+            are processed in tiles.
+        tile_size_km (float): Side of the tiles in kilometers.
+        max_workers (int): Maximum number of concurrent tiles and downloads
+            within the job.
+
+    Returns:
+        outputs (dict): Paths of the downloaded files, states of the export
+            tasks, or flooded area in square kilometers.
+    """
+    geometry = job["geometry"]
+    coordinates = _geometry_coordinates(geometry)
+    aoi = ee.Geometry(geometry)
+    parameters = {
+        field: job[field]
+        for field in DATE_FIELDS + tuple(PARAMETER_FIELDS)
+        if field in job
+    }
+    (
+        flood_vectors,
+        flood_rasters,
+        before_filtered,
+        after_filtered,
+    ) = derive_flood_extents(
+        aoi=aoi,
+        tile_size_km=(
+            tile_size_km
+            if bounds_side_km(coordinates) > max_untiled_side_km
+            else None
+        ),
+        max_workers=max_workers,
+        cache=_get_cache(cache_dir),
+        **parameters,
+    )
+
+    if output == "download":
+        return download_flood_extents(
+            flood_rasters,
+            flood_vectors,
+            polygon_bounds(coordinates),
+            os.path.join(output_dir, re.sub(r"[^\w.-]", "_", job["id"])),
+            session=_get_session(max_workers),
+            max_workers=max_workers,
+        )
+    if output == "drive":
+        states = export_flood_data(
+            flooded_area_vector=flood_vectors,
+            flooded_area_raster=flood_rasters,
+            image_before_flood=before_filtered,
+            image_after_flood=after_filtered,
+            region=aoi,
+            filename=job["id"],
+        )
+        failed = [
+            status["error_message"]
+            for status in states.values()
+            if status["state"] != "COMPLETED"
+        ]
+        if failed:
+            raise RuntimeError(f"Export failed: {failed}")
+        return states
+    if output == "stats":
+        return {"flooded_area_km2": flooded_area_km2(flood_rasters, aoi)}
+    raise ValueError(f"Unknown output: {output}")
+
+
+def _run_with_retries(run, job, retries=2, backoff=5):
+    """
+    Run a job, retrying it on errors with an exponential backoff.
+
+    Invalid inputs (ValueError) are not retried. Returns the record of the
+    job, with its status, number of attempts, run time and outputs or last
+    error. Defined at module level so that it can be sent to a process pool.
+    """
+    start = time.perf_counter()
+    for attempt in range(1, retries + 2):
+        try:
+            outputs = run(job)
+        except Exception as error:
+            if attempt > retries or isinstance(error, ValueError):
+                status, outputs = "failed", None
+                message = f"{type(error).__name__}: {error}"
+                break
+            time.sleep(backoff * 2 ** (attempt - 1))
+        else:
+            status, message = "done", None
+            break
+    return {
+        "status": status,
+        "attempts": attempt,
+        "seconds": time.perf_counter() - start,
+        "outputs": outputs,
+        "error": message,
+    }
+
+
+def load_state(path):
+    """
+    Load the state of a batch, or return an empty state.
+
+    Inputs:
+        path (str): Path of the JSON state file.
+
+    Returns:
+        state (dict): Record of each job by id, under "jobs".
+    """
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"jobs": {}}
+
+
+def save_state(path, state):
+    """
+    Save the state of a batch atomically.
+
+    Inputs:
+        path (str): Path of the JSON state file.
+        state (dict): State of the batch, see load_state.
+
+    Returns:
+        None
+    """
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(state, f, indent=2, default=str)
+    os.replace(temporary_path, path)
+
+
+def run_batch(
+    jobs,
+    run,
+    state_path,
+    max_workers=4,
+    use_processes=False,
+    retries=2,
+    backoff=5,
+    initializer=None,
+    initargs=(),
+    force=False,
+    progress=print,
+):
+    """
+    Run jobs on a bounded pool, saving their state as they complete.
+
+    Jobs completed in a previous run with the same parameters are skipped,
+    unless force is True, so an interrupted batch can be resumed by running
+    it again.
+    Inputs:
+        jobs (list): Jobs read from a manifest, see read_manifest.
+        run (callable): Function running one job and returning its outputs,
+            e.g. a functools.partial of run_job. With processes, it must be
+            picklable.
+        state_path (str): Path of the JSON state file.
+        max_workers (int): Maximum number of jobs run concurrently.
+        use_processes (bool): If True, jobs run in a process pool instead of
+            a thread pool.
+        retries (int): Number of retries of a failed job.
+        backoff (float): Delay before the first retry, in seconds, doubled
+            at each retry.
+        initializer (callable): Function run when each process starts, e.g.
+            initialize_ee. Only used with processes.
+        initargs (tuple): Arguments of the initializer.
+        force (bool): If True, completed jobs are run again.
+        progress (callable): Function called with a message after each job.
+
+    Returns:
+        state (dict): Final state of the batch, see load_state, with the
+            wall time of this run under "wall_seconds" and the ids of the
+            jobs it ran under "ran".
+    """
+    state = load_state(state_path)
+    pending = []
+    for job in jobs:
+        record = state["jobs"].get(job["id"], {})
+        job_hash = canonical_hash(job)
+        if (
+            not force
+            and record.get("status") == "done"
+            and record.get("parameters_hash") == job_hash
+        ):
+            continue
+        pending.append((job, job_hash))
+    skipped = len(jobs) - len(pending)
+    if skipped:
+        progress(f"Skipping {skipped} completed job(s)")
+
+    start = time.perf_counter()
+    if use_processes:
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, initializer=initializer, initargs=initargs
+        )
+    else:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    with executor:
+        futures = {
+            executor.submit(
+                _run_with_retries, run, job, retries=retries, backoff=backoff
+            ): (job, job_hash)
+            for job, job_hash in pending
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            job, job_hash = futures[future]
+            record = future.result()
+            record["parameters_hash"] = job_hash
+            record["area_km2"] = aoi_area_km2(job["geometry"])
+            state["jobs"][job["id"]] = record
+            save_state(state_path, state)
+            progress(
+                f"[{done}/{len(pending)}] {job['id']}: {record['status']} "
+                f"in {record['seconds']:.1f} s "
+                f"({record['attempts']} attempt(s))"
+                + (f" - {record['error']}" if record["error"] else "")
+            )
+    state["wall_seconds"] = time.perf_counter() - start
+    state["ran"] = [job["id"] for job, _ in pending]
+    return state
+
+
+def format_summary(jobs, state):
+    """
+    Format the wall time and throughput of each job and of the batch.
+
+    Jobs completed by a previous run are listed as skipped and left out of
+    the totals.
+    Inputs:
+        jobs (list): Jobs of the batch.
+        state (dict): State returned by run_batch.
+
+    Returns:
+        str: Summary table.
+    """
+    lines = [
+        f"{'job':<24} {'status':<8} {'tries':>5} {'seconds':>9} "
+        f"{'km2':>10} {'km2/s':>8}"
+    ]
+    area = 0.0
+    counts = {}
+    ran = set(state.get("ran", []))
+    for job in jobs:
+        record = state["jobs"].get(job["id"], {})
+        status = record.get("status", "pending")
+        if job["id"] not in ran and status == "done":
+            status = "skipped"
+        counts[status] = counts.get(status, 0) + 1
+        seconds = record.get("seconds", 0.0)
+        job_area = record.get("area_km2", aoi_area_km2(job["geometry"]))
+        throughput = 0.0
+        if status == "done":
+            area += job_area
+            throughput = job_area / seconds if seconds else 0.0
+        lines.append(
+            f"{job['id'][:24]:<24} {status:<8} "
+            f"{record.get('attempts', 0):>5} {seconds:>9.1f} "
+            f"{job_area:>10.1f} {throughput:>8.1f}"
+        )
+    wall = state.get("wall_seconds", 0.0)
+    lines.append(
+        ", ".join(f"{count} {status}" for status, count in counts.items())
+        + f" - wall time {wall:.1f} s"
+        + (
+            f", {3600 * counts.get('done', 0) / wall:.1f} jobs/h, "
+            f"{area / wall:.1f} km2/s"
+            if wall
+            else ""
+        )
+    )
+    return "\n".join(lines)
@@ -0,0 +1,276 @@
+"""Content-addressed cache for the results of flood extent runs."""
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+def _round_coordinates(value, precision):
+    """Round all floats of a nested structure to a number of decimals."""
+    if isinstance(value, float):
+        return round(value, precision)
+    if isinstance(value, (list, tuple)):
+        return [_round_coordinates(item, precision) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: _round_coordinates(item, precision)
+            for key, item in value.items()
+        }
+    return value
+
+
+def canonical_hash(payload, precision=7):
+    """
+    Return a canonical SHA-256 hash of a JSON-serialisable payload.
+
+    Floats are rounded and keys sorted, so that equivalent payloads (e.g. the
+    same polygon drawn twice) give the same hash.
+    Inputs:
+        payload (dict): Values identifying a result.
+        precision (int): Number of decimals kept for floats, 7 decimals of a
+            degree being about 1 cm.
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    canonical = json.dumps(
+        _round_coordinates(payload, precision),
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache: an in-memory LRU tier in front of an on-disk tier.
+
+    Records are dictionaries of picklable values. Both tiers are bounded in
+    size; the least recently used records are evicted first. A record
+    evicted from memory stays available on disk. Records not used for
+    ttl_seconds, if set, are evicted from both tiers. Files kept next to a
+    record, e.g. downloads, can be removed with it by an on_evict callback.
+    """
+
+    def __init__(
+        self,
+        cache_dir=None,
+        max_memory_bytes=256 * 2**20,
+        max_disk_bytes=4 * 2**30,
+        ttl_seconds=None,
+        on_evict=None,
+    ):
+        """
+        Create the cache.
+
+        Inputs:
+            cache_dir (str): Directory of the on-disk tier. If None, only the
+                in-memory tier is used.
+            max_memory_bytes (int): Size limit of the in-memory tier.
+            max_disk_bytes (int): Size limit of the on-disk tier.
+            ttl_seconds (float): Time after which a record not used is
+                evicted; None to keep records until they are evicted for
+                size.
+            on_evict (callable): Called with the key of each record removed
+                from the cache, i.e. from its last tier, while the lock of
+                the cache is held.
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.on_evict = on_evict
+        self._memory = OrderedDict()
+        # Time of the last use of each record of the in-memory tier
+        self._used = {}
+        self._next_sweep = 0
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        """Return the path of a record in the on-disk tier."""
+        return os.path.join(self.cache_dir, key + ".pkl")
+
+    def _removed(self, key):
+        """Call on_evict for a record removed from its last tier."""
+        if self.on_evict is not None:
+            self.on_evict(key)
+
+    def _store_in_memory(self, key, data):
+        """Add a pickled record to the in-memory tier and evict if needed."""
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+            del self._used[key]
+        if len(data) > self.max_memory_bytes:
+            return
+        self._memory[key] = data
+        self._used[key] = time.monotonic()
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes:
+            evicted_key, evicted = self._memory.popitem(last=False)
+            del self._used[evicted_key]
+            self._memory_bytes -= len(evicted)
+            self.counters["evictions"] += 1
+            if self.cache_dir is None:
+                self._removed(evicted_key)
+
+    def _expire(self):
+        """Evict the records not used for ttl_seconds from both tiers."""
+        if self.ttl_seconds is None:
+            return
+        # The in-memory tier is in order of use, the oldest first
+        deadline = time.monotonic() - self.ttl_seconds
+        while self._memory:
+            key = next(iter(self._memory))
+            if self._used[key] > deadline:
+                break
+            self._memory_bytes -= len(self._memory.pop(key))
+            del self._used[key]
+            if self.cache_dir is None:
+                self.counters["expirations"] += 1
+                self._removed(key)
+        # The on-disk tier is listed at most once a minute
+        if self.cache_dir is None or time.monotonic() < self._next_sweep:
+            return
+        self._next_sweep = time.monotonic() + min(60, self.ttl_seconds)
+        deadline = time.time() - self.ttl_seconds
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".pkl") and os.stat(path).st_mtime <= deadline:
+                # Counted here, as a record expired in memory is on disk too
+                os.remove(path)
+                self.counters["expirations"] += 1
+                self._removed(os.path.splitext(name)[0])
+
+    def _evict_from_disk(self):
+        """Remove the least recently used files above the disk size limit."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".pkl"):
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.counters["evictions"] += 1
+            self._removed(os.path.splitext(os.path.basename(path))[0])
+
+    def get(self, key, count=True):
+        """
+        Return a record, or None if it is not cached.
+
+        Inputs:
+            key (str): Key of the record, see canonical_hash.
+            count (bool): If False, the hit and miss counters are left
+                unchanged, e.g. to read a record before updating it.
+
+        Returns:
+            dict: The cached record, or None.
+        """
+        with self._lock:
+            data = self._read(key, count)
+        return None if data is None else pickle.loads(data)
+
+    def _read(self, key, count):
+        """Return the pickled record of a key; the lock must be held."""
+        self._expire()
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self._used[key] = time.monotonic()
+            if count:
+                self.counters["memory_hits"] += 1
+            if self.cache_dir is not None and os.path.exists(self._path(key)):
+                # Keep the on-disk copy of a record used from memory
+                os.utime(self._path(key))
+            return self._memory[key]
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            # Refresh the modification time, used for LRU eviction
+            os.utime(self._path(key))
+            self._store_in_memory(key, data)
+            if count:
+                self.counters["disk_hits"] += 1
+            return data
+        if count:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key, record):
+        """
+        Store a record in both tiers.
+
+        Inputs:
+            key (str): Key of the record, see canonical_hash.
+            record (dict): Picklable values to store.
+
+        Returns:
+            None
+        """
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._write(key, data)
+
+    def _write(self, key, data):
+        """Store a pickled record in both tiers; the lock must be held."""
+        self._expire()
+        self._store_in_memory(key, data)
+        if self.cache_dir is not None:
+            temporary_path = self._path(key) + ".tmp"
+            with open(temporary_path, "wb") as f:
+                f.write(data)
+            os.replace(temporary_path, self._path(key))
+            self._evict_from_disk()
+
+    def update(self, key, **fields):
+        """
+        Add fields to a cached record, creating it if needed.
+
+        The record is read and written under one lock, so that concurrent
+        updates of the same record keep all their fields.
+        Inputs:
+            key (str): Key of the record.
+            fields: Values to add to the record.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            data = self._read(key, count=False)
+            record = {} if data is None else pickle.loads(data)
+            record.update(fields)
+            self._write(
+                key, pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+            )
+
+    def stats(self):
+        """
+        Return the counters and the size of the in-memory tier.
+
+        Returns:
+            dict: Hit, miss and eviction counters, hit rate and memory usage.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["memory_records"] = len(self._memory)
+        requests = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        stats["hit_rate"] = hits / requests if requests else 0.0
+        return stats
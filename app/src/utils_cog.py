@@ -0,0 +1,166 @@
+"""Writing of rasters as Cloud-Optimized GeoTIFFs.
+
+A Cloud-Optimized GeoTIFF (COG) is a tiled, compressed GeoTIFF with internal
+overviews, laid out so that a client can read a window or a zoom level with
+a few HTTP range requests instead of fetching the whole file. Files are
+written with the COG driver of GDAL from a temporary GeoTIFF, since the
+driver can only copy an existing dataset.
+"""
+import os
+import tempfile
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+
+# Creation options of the COG driver. Flood masks are uint8 with nearest
+# neighbour overviews, so that the overviews stay binary; radar images use
+# averaged overviews.
+COG_OPTIONS = {
+    "blocksize": 512,
+    "compress": "deflate",
+    "level": 6,
+    "bigtiff": "if_safer",
+    "overview_resampling": "nearest",
+}
+
+# Predictor of the compression, by data type: horizontal differencing for
+# integers, floating point predictor for floats
+PREDICTORS = {"i": 2, "u": 2, "f": 3}
+
+
+def cog_options(dtype, compress="deflate", resampling=None):
+    """
+    Return the creation options of the COG driver for a data type.
+
+    Inputs:
+        dtype (str): Data type of the raster, e.g. 'uint8' or 'float32'.
+        compress (str): 'deflate' or 'lzw'.
+        resampling (str): Resampling of the overviews; by default 'nearest'
+            for integers and 'average' for floats.
+
+    Returns:
+        dict: Creation options, see COG_OPTIONS.
+    """
+    kind = np.dtype(dtype).kind
+    options = dict(COG_OPTIONS, compress=compress)
+    if compress.lower() == "lzw":
+        del options["level"]
+    options["overview_resampling"] = resampling or (
+        "average" if kind == "f" else "nearest"
+    )
+    # The predictor does not help binary masks, which are mostly constant
+    if np.dtype(dtype).itemsize > 1:
+        options["predictor"] = PREDICTORS.get(kind, 1)
+    return options
+
+
+def convert_to_cog(
+    src_path, dst_path=None, compress="deflate", resampling=None
+):
+    """
+    Convert a GeoTIFF into a Cloud-Optimized GeoTIFF.
+
+    The overviews are computed by GDAL while copying, halving the size until
+    the raster fits one block.
+    Inputs:
+        src_path (str): Path of the GeoTIFF to convert.
+        dst_path (str): Path of the output; by default src_path is replaced.
+        compress (str): 'deflate' or 'lzw'.
+        resampling (str): Resampling of the overviews, see cog_options.
+
+    Returns:
+        dst_path (str): Path of the Cloud-Optimized GeoTIFF.
+    """
+    replace = dst_path is None or os.path.abspath(dst_path) == os.path.abspath(
+        src_path
+    )
+    if replace:
+        dst_path = src_path
+        descriptor, output = tempfile.mkstemp(
+            suffix=".tif", dir=os.path.dirname(os.path.abspath(src_path))
+        )
+        os.close(descriptor)
+    else:
+        output = dst_path
+    with rasterio.open(src_path) as src:
+        options = cog_options(
+            src.dtypes[0], compress=compress, resampling=resampling
+        )
+        rasterio.shutil.copy(src, output, driver="COG", **options)
+    if replace:
+        os.replace(output, dst_path)
+    return dst_path
+
+
+def write_cog(
+    path,
+    data,
+    transform,
+    crs="EPSG:4326",
+    nodata=None,
+    compress="deflate",
+    resampling=None,
+):
+    """
+    Write an array as a Cloud-Optimized GeoTIFF.
+
+    Boolean arrays, e.g. flood masks, are written as uint8.
+    Inputs:
+        path (str): Path of the output.
+        data (np.ndarray): Raster of shape (rows, cols), or (bands, rows,
+            cols).
+        transform (tuple): GDAL-style geotransform of the raster.
+        crs (str): Coordinate reference system of the raster.
+        nodata (float): Nodata value, if any.
+        compress (str): 'deflate' or 'lzw'.
+        resampling (str): Resampling of the overviews, see cog_options.
+
+    Returns:
+        path (str): Path of the Cloud-Optimized GeoTIFF.
+    """
+    data = np.asarray(data)
+    if data.dtype == bool:
+        data = data.astype("uint8")
+    if data.ndim == 2:
+        data = data[np.newaxis]
+    profile = {
+        "driver": "GTiff",
+        "count": data.shape[0],
+        "height": data.shape[1],
+        "width": data.shape[2],
+        "dtype": data.dtype.name,
+        "crs": crs,
+        "transform": rasterio.Affine.from_gdal(*transform),
+        "nodata": nodata,
+        "tiled": True,
+        "blockxsize": COG_OPTIONS["blocksize"],
+        "blockysize": COG_OPTIONS["blocksize"],
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(suffix=".tif", dir=directory) as tmp:
+        with rasterio.open(tmp.name, "w", **profile) as dst:
+            dst.write(data)
+        convert_to_cog(
+            tmp.name, path, compress=compress, resampling=resampling
+        )
+    return path
+
+
+def is_cog(path):
+    """
+    Check that a GeoTIFF has the layout of a Cloud-Optimized GeoTIFF.
+
+    Inputs:
+        path (str): Path of the GeoTIFF.
+
+    Returns:
+        bool: True if the file is tiled, has overviews when larger than a
+            block, and was written with the COG layout.
+    """
+    with rasterio.open(path) as src:
+        if src.tags(ns="IMAGE_STRUCTURE").get("LAYOUT") != "COG":
+            return False
+        block_height, block_width = src.block_shapes[0]
+        fits_one_block = max(src.width, src.height) <= block_width
+        return fits_one_block or bool(src.overviews(1))
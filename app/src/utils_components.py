@@ -0,0 +1,252 @@
+"""Connected-component labelling of binary rasters.
+
+Pixels are labelled with a two-pass algorithm on runs of pixels: the first
+pass finds the runs of each row and the overlapping runs of the next row,
+and the equivalences between runs are resolved with a union-find on the run
+graph. Component sizes are summed from the run lengths, so each pixel is
+read once and written once whatever the size of the components.
+
+Large rasters can be labelled tile by tile: each tile is labelled on its
+own, then the labels touching across the tile borders are merged.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def _union_find(n_nodes, first, second):
+    """
+    Return the component of each node of a graph given by its edges.
+
+    Inputs:
+        n_nodes (int): Number of nodes.
+        first (np.ndarray): First node of each edge.
+        second (np.ndarray): Second node of each edge.
+
+    Returns:
+        count (int): Number of components.
+        component (np.ndarray): Component of each node, from 0 to count - 1,
+            numbered in the order of their first node.
+    """
+    graph = coo_matrix(
+        (np.ones(first.size, dtype="int8"), (first, second)),
+        shape=(n_nodes, n_nodes),
+    )
+    return connected_components(graph, directed=False)
+
+
+def find_runs(mask):
+    """
+    Find the runs of consecutive True pixels in each row of a mask.
+
+    Inputs:
+        mask (np.ndarray): Binary mask.
+
+    Returns:
+        rows (np.ndarray): Row of each run.
+        starts (np.ndarray): First column of each run.
+        ends (np.ndarray): Column after the last column of each run.
+    """
+    padded = np.pad(np.asarray(mask, dtype="int8"), ((0, 0), (1, 1)))
+    # Starts and ends alternate along each row of the padded mask
+    changes = np.flatnonzero(np.diff(padded, axis=1))
+    rows, starts = np.divmod(changes[0::2], padded.shape[1] - 1)
+    ends = changes[1::2] - rows * (padded.shape[1] - 1)
+    return rows, starts, ends
+
+
+def _overlapping_runs(rows, starts, ends, n_cols, connectivity):
+    """
+    Return the pairs of runs of consecutive rows that touch each other.
+
+    Runs touch if they share a column (4-connectivity), or a column or a
+    corner (8-connectivity).
+    """
+    reach = 0 if connectivity == 4 else 1
+    width = n_cols + 2
+    start_keys = rows * width + starts
+    end_keys = rows * width + ends
+    # Runs of the previous row with end > start - reach and
+    # start < end + reach, found by binary search as runs are sorted
+    previous_row = (rows - 1) * width
+    low = np.searchsorted(end_keys, previous_row + starts - reach, "right")
+    high = np.searchsorted(start_keys, previous_row + ends + reach, "left")
+    counts = np.maximum(high - low, 0)
+    current = np.repeat(np.arange(rows.size), counts)
+    offsets = np.arange(current.size) - np.repeat(
+        np.cumsum(counts) - counts, counts
+    )
+    return current, np.repeat(low, counts) + offsets
+
+
+def label(mask, connectivity=8):
+    """
+    Label the connected groups of pixels of a binary mask.
+
+    Inputs:
+        mask (np.ndarray): Binary mask.
+        connectivity (int): 4 or 8.
+
+    Returns:
+        labels (np.ndarray): int32 label of each pixel, from 1, and 0 for the
+            background.
+        sizes (np.ndarray): Number of pixels of each label, with sizes[0] = 0.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    rows, starts, ends = find_runs(mask)
+    current, previous = _overlapping_runs(
+        rows, starts, ends, mask.shape[1], connectivity
+    )
+    count, run_labels = _union_find(rows.size, current, previous)
+    run_labels = run_labels + 1
+    sizes = np.bincount(
+        run_labels, weights=ends - starts, minlength=count + 1
+    ).astype("int64")
+    return _paint_runs(mask.shape, rows, starts, ends, run_labels), sizes
+
+
+def _paint_runs(shape, rows, starts, ends, values, dtype="int32"):
+    """Return an array with the given value on the pixels of each run."""
+    # Mark the value at the start of each run and remove it after its end,
+    # then fill the runs with a cumulative sum along the rows
+    step_type = "int8" if dtype == bool else dtype
+    steps = np.zeros((shape[0], shape[1] + 1), dtype=step_type)
+    values = np.asarray(values, dtype=step_type)
+    steps[rows, starts] = values
+    steps[rows, ends] -= values
+    return np.cumsum(steps[:, :-1], axis=1, dtype=step_type).astype(dtype)
+
+
+def remove_small_components(mask, min_size, connectivity=8):
+    """
+    Remove the groups of connected pixels smaller than a minimum size.
+
+    Only the runs are labelled; the output mask is painted from the runs of
+    the groups that are kept.
+    Inputs:
+        mask (np.ndarray): Binary mask.
+        min_size (int): Minimum number of pixels of a group.
+        connectivity (int): 4 or 8.
+
+    Returns:
+        np.ndarray: Binary mask without the small groups.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    rows, starts, ends = find_runs(mask)
+    current, previous = _overlapping_runs(
+        rows, starts, ends, mask.shape[1], connectivity
+    )
+    _, run_labels = _union_find(rows.size, current, previous)
+    sizes = np.bincount(run_labels, weights=ends - starts)
+    keep = sizes[run_labels] >= min_size
+    return _paint_runs(
+        mask.shape, rows[keep], starts[keep], ends[keep], keep[keep], bool
+    )
+
+
+def _border_pairs(before, after, connectivity):
+    """
+    Return the pairs of labels touching across a border.
+
+    Inputs:
+        before (np.ndarray): Labels of the last row (or column) before the
+            border.
+        after (np.ndarray): Labels of the first row (or column) after it.
+        connectivity (int): 4 or 8.
+    """
+    shifts = (0,) if connectivity == 4 else (-1, 0, 1)
+    pairs = []
+    for shift in shifts:
+        if shift < 0:
+            a, b = before[-shift:], after[:shift]
+        elif shift > 0:
+            a, b = before[:-shift], after[shift:]
+        else:
+            a, b = before, after
+        touching = (a > 0) & (b > 0)
+        pairs.append(np.stack((a[touching], b[touching])))
+    return np.concatenate(pairs, axis=1)
+
+
+def label_tiled(mask, tile_size=2048, connectivity=8, max_workers=4):
+    """
+    Label a mask tile by tile, merging the labels across the tile borders.
+
+    The tiles are labelled concurrently, so only one tile per worker is in
+    the working memory of the labelling. The mask can be any array that can
+    be sliced, e.g. a memory-mapped file.
+    Inputs:
+        mask (np.ndarray): Binary mask.
+        tile_size (int): Side of the tiles in pixels.
+        connectivity (int): 4 or 8.
+        max_workers (int): Maximum number of tiles labelled concurrently.
+
+    Returns:
+        labels (np.ndarray): int32 label of each pixel, from 1, and 0 for the
+            background; the same partition as label, up to numbering.
+        sizes (np.ndarray): Number of pixels of each label, with sizes[0] = 0.
+    """
+    n_rows, n_cols = mask.shape
+    windows = [
+        (
+            slice(row, min(row + tile_size, n_rows)),
+            slice(col, min(col + tile_size, n_cols)),
+        )
+        for row in range(0, n_rows, tile_size)
+        for col in range(0, n_cols, tile_size)
+    ]
+
+    def label_window(window):
+        return label(mask[window], connectivity)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(label_window, windows))
+
+    # Give each tile its own range of labels
+    labels = np.zeros((n_rows, n_cols), dtype="int32")
+    tile_sizes = [np.zeros(1, dtype="int64")]
+    offset = 0
+    for window, (tile_labels, sizes) in zip(windows, results):
+        labels[window] = np.where(tile_labels > 0, tile_labels + offset, 0)
+        tile_sizes.append(sizes[1:])
+        offset += sizes.size - 1
+    tile_sizes = np.concatenate(tile_sizes)
+
+    # Merge the labels touching across the borders between tiles
+    pairs = [np.zeros((2, 0), dtype="int32")]
+    for row in range(tile_size, n_rows, tile_size):
+        pairs.append(_border_pairs(labels[row - 1], labels[row], connectivity))
+    for col in range(tile_size, n_cols, tile_size):
+        pairs.append(
+            _border_pairs(labels[:, col - 1], labels[:, col], connectivity)
+        )
+    pairs = np.concatenate(pairs, axis=1)
+    count, merged = _union_find(offset + 1, pairs[0], pairs[1])
+    # Component 0 is the background, as label 0 is not linked to any label
+    sizes = np.bincount(merged, weights=tile_sizes, minlength=count)
+    return merged.astype("int32")[labels], sizes.astype("int64")
+
+
+def remove_small_components_tiled(
+    mask, min_size, connectivity=8, tile_size=2048, max_workers=4
+):
+    """
+    Remove the small groups of connected pixels of a mask, tile by tile.
+
+    See label_tiled. Groups spanning several tiles are measured whole.
+    Inputs:
+        mask (np.ndarray): Binary mask.
+        min_size (int): Minimum number of pixels of a group.
+        connectivity (int): 4 or 8.
+        tile_size (int): Side of the tiles in pixels.
+        max_workers (int): Maximum number of tiles labelled concurrently.
+
+    Returns:
+        np.ndarray: Binary mask without the small groups.
+    """
+    labels, sizes = label_tiled(mask, tile_size, connectivity, max_workers)
+    keep = sizes >= min_size
+    keep[0] = False
+    return keep[labels]
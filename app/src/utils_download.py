@@ -0,0 +1,446 @@
+"""Functions to download exported files from Google Earth Engine."""
+import hashlib
+import json
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import rasterio
+import requests
+from rasterio.windows import Window
+from requests.adapters import HTTPAdapter
+from src.utils_cog import COG_OPTIONS, convert_to_cog
+from src.utils_metrics import increment, timed
+from src.utils_tiling import METERS_PER_DEGREE
+from src.utils_vector_io import iter_features, write_vectors
+from urllib3.util.retry import Retry
+
+# Size of the chunks written to the spool files, in bytes
+CHUNK_SIZE = 2**20
+
+# Limits of a single getDownloadUrl request, with a safety margin on the
+# request size
+MAX_DOWNLOAD_BYTES = 32 * 2**20
+MAX_DOWNLOAD_DIMENSION = 10000
+
+# Generalisation loads the whole GeoJSON and its topology in memory, so it
+# is skipped for downloads with more polygons than this
+MAX_GENERALISED_FEATURES = 20000
+
+
+def create_session(pool_size=8, retries=5, backoff_factor=0.5):
+    """
+    Create an HTTP session with a connection pool and retries.
+
+    Inputs:
+        pool_size (int): Maximum number of connections kept per host.
+        retries (int): Number of retries on connection errors and on 429 and
+            5xx responses.
+        backoff_factor (float): Factor of the exponential delay between
+            retries, in seconds.
+
+    Returns:
+        session (requests.Session): The configured session.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def download_to_file(url, path, session=None, attempts=5, timeout=60):
+    """
+    Stream a download to a file in chunks, resuming it if interrupted.
+
+    The download is written to a partial file named after the hash of the
+    URL, which is resumed with an HTTP Range request if it exists, and then
+    renamed to the output path in one step. An existing output file is
+    replaced, never appended to. Servers that ignore the range answer with
+    the full body, in which case the partial file is rewritten from the
+    start.
+    Inputs:
+        url (str): URL of the file.
+        path (str): Path of the output file.
+        session (requests.Session): Session used for the requests.
+        attempts (int): Number of times an interrupted transfer is resumed.
+        timeout (float): Timeout of the connection and of each read, in
+            seconds.
+
+    Returns:
+        path (str): Path of the output file.
+    """
+    session = session or create_session()
+    url_hash = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+    part_path = f"{path}.{url_hash}.part"
+    for attempt in range(attempts):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with session.get(
+                url, headers=headers, stream=True, timeout=timeout
+            ) as response:
+                # 416: the partial file was already complete
+                if response.status_code != 416:
+                    response.raise_for_status()
+                    mode = "ab" if response.status_code == 206 else "wb"
+                    with open(part_path, mode) as f:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            f.write(chunk)
+                            increment("bytes_downloaded", len(chunk))
+            break
+        except (
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+        ):
+            if attempt == attempts - 1:
+                raise
+    os.replace(part_path, path)
+    return path
+
+
+def download_files(urls, directory=None, session=None, max_workers=4):
+    """
+    Download several files concurrently to a spool directory.
+
+    Inputs:
+        urls (dict): Name of each file to its URL.
+        directory (str): Directory of the spool files. If None, a new
+            temporary directory is created.
+        session (requests.Session): Session shared by the downloads.
+        max_workers (int): Maximum number of concurrent downloads.
+
+    Returns:
+        paths (dict): Name of each file to the path of its spool file.
+    """
+    directory = directory or tempfile.mkdtemp(prefix="flood_extent_")
+    os.makedirs(directory, exist_ok=True)
+    session = session or create_session(pool_size=max_workers)
+
+    def download(item):
+        name, url = item
+        return name, download_to_file(
+            url, os.path.join(directory, name), session=session
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(executor.map(download, urls.items()))
+
+
+def plan_image_download(
+    bounds, scale, bytes_per_pixel=1, max_bytes=MAX_DOWNLOAD_BYTES
+):
+    """
+    Split a raster download into requests that fit the Earth Engine limits.
+
+    All requests share one EPSG:4326 pixel grid, so that their results can be
+    mosaicked without resampling.
+    Inputs:
+        bounds (tuple): (west, south, east, north) of the region in degrees.
+        scale (float): Pixel size in meters.
+        bytes_per_pixel (int): Size of a pixel of the image, for all bands.
+        max_bytes (int): Maximum size of a single request.
+
+    Returns:
+        grid (dict): "transform" (GDAL-style geotransform), "width" and
+            "height" of the whole raster.
+        windows (list): rasterio Windows of the sub-requests on the grid.
+    """
+    west, south, east, north = bounds
+    pixel_size = scale / METERS_PER_DEGREE
+    width = max(int(math.ceil((east - west) / pixel_size)), 1)
+    height = max(int(math.ceil((north - south) / pixel_size)), 1)
+    side = min(
+        int(math.sqrt(max_bytes / bytes_per_pixel)), MAX_DOWNLOAD_DIMENSION
+    )
+    windows = [
+        Window(col, row, min(side, width - col), min(side, height - row))
+        for row in range(0, height, side)
+        for col in range(0, width, side)
+    ]
+    grid = {
+        "transform": (west, pixel_size, 0, north, 0, -pixel_size),
+        "width": width,
+        "height": height,
+    }
+    return grid, windows
+
+
+def image_download_urls(
+    image, bounds, scale=30, bytes_per_pixel=1, max_workers=4
+):
+    """
+    Get the download URLs of an image, split to fit the size limit.
+
+    The number of pixels is estimated client-side from the bounds, and one
+    URL is requested for each part of the grid.
+    Inputs:
+        image (ee.Image): Image to download, clipped to the region of
+            interest.
+        bounds (tuple): (west, south, east, north) of the region in degrees.
+        scale (float): Pixel size in meters.
+        bytes_per_pixel (int): Size of a pixel of the image, for all bands.
+        max_workers (int): Maximum number of concurrent URL requests.
+
+    Returns:
+        grid (dict): Grid of the whole raster, see plan_image_download.
+        tiles (list): One (url, window) pair per sub-request.
+    """
+    grid, windows = plan_image_download(bounds, scale, bytes_per_pixel)
+    west, pixel_size, _, north, _, _ = grid["transform"]
+
+    def get_url(window):
+        increment("ee_requests", kind="getDownloadUrl")
+        return image.getDownloadUrl(
+            {
+                "crs": "EPSG:4326",
+                "crs_transform": [
+                    pixel_size,
+                    0,
+                    west + window.col_off * pixel_size,
+                    0,
+                    -pixel_size,
+                    north - window.row_off * pixel_size,
+                ],
+                "dimensions": f"{window.width}x{window.height}",
+                "format": "GEO_TIFF",
+            }
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        urls = list(executor.map(get_url, windows))
+    return grid, list(zip(urls, windows))
+
+
+def mosaic_tiles(tiles, grid, path):
+    """
+    Mosaic downloaded GeoTIFF tiles into one Cloud-Optimized GeoTIFF.
+
+    The tiles are written one at a time into a tiled GeoTIFF, which is then
+    converted to a Cloud-Optimized GeoTIFF with overviews (see utils_cog).
+    Inputs:
+        tiles (list): One (path, window) pair per downloaded tile.
+        grid (dict): Grid of the whole raster, see plan_image_download.
+        path (str): Path of the output GeoTIFF.
+
+    Returns:
+        path (str): Path of the output GeoTIFF.
+    """
+    with rasterio.open(tiles[0][0]) as first:
+        profile = first.profile
+    profile.update(
+        driver="GTiff",
+        width=grid["width"],
+        height=grid["height"],
+        transform=rasterio.Affine.from_gdal(*grid["transform"]),
+        tiled=True,
+        blockxsize=COG_OPTIONS["blocksize"],
+        blockysize=COG_OPTIONS["blocksize"],
+        compress="deflate",
+    )
+    mosaic_path = path + ".mosaic.tif"
+    with rasterio.open(mosaic_path, "w", **profile) as dst:
+        for tile_path, window in tiles:
+            with rasterio.open(tile_path) as src:
+                dst.write(src.read(), window=window)
+    convert_to_cog(mosaic_path, path)
+    os.remove(mosaic_path)
+    return path
+
+
+@timed()
+def generalise_download(path, level_of_detail, topojson=False):
+    """
+    Simplify and quantise downloaded GeoJSON vectors in place.
+
+    The vectors and their topology are loaded in memory, see
+    download_flood_extents for the limit on their number.
+    Inputs:
+        path (str): Path of a GeoJSON FeatureCollection.
+        level_of_detail (str): Level of detail, see
+            utils_generalise.LEVELS_OF_DETAIL.
+        topojson (bool): If True, the vectors are also written as TopoJSON
+            next to the GeoJSON file.
+
+    Returns:
+        paths (dict): Paths of "generalisation.json", the report of
+            utils_generalise.generalise, and of "vector.topojson" if
+            requested.
+    """
+    # Imported here, as only generalised downloads need it
+    from src.utils_generalise import LEVELS_OF_DETAIL, generalise
+
+    with open(path) as f:
+        flood_vectors = json.load(f)
+    outputs, report = generalise(
+        flood_vectors,
+        levels={level_of_detail: LEVELS_OF_DETAIL[level_of_detail]},
+        topojson=topojson,
+    )
+    directory = os.path.dirname(path)
+    paths = {
+        "generalisation.json": os.path.join(directory, "generalisation.json")
+    }
+    with open(path, "w") as f:
+        json.dump(
+            outputs[level_of_detail]["geojson"], f, separators=(",", ":")
+        )
+    if topojson:
+        paths["vector.topojson"] = os.path.join(directory, "vector.topojson")
+        with open(paths["vector.topojson"], "w") as f:
+            json.dump(
+                outputs[level_of_detail]["topojson"], f, separators=(",", ":")
+            )
+    with open(paths["generalisation.json"], "w") as f:
+        json.dump(report, f, indent=2)
+    return paths
+
+
+def _mosaic_spooled(spooled, raster_tiles, grid, path):
+    """Mosaic the downloaded parts of a raster and remove them."""
+    path = mosaic_tiles(
+        [
+            (spooled[f"raster_{i}.tif"], window)
+            for i, (_, window) in enumerate(raster_tiles)
+        ],
+        grid,
+        path,
+    )
+    for i in range(len(raster_tiles)):
+        os.remove(spooled[f"raster_{i}.tif"])
+    return path
+
+
+@timed()
+def download_image(image, bounds, path, session=None, scale=30, max_workers=4):
+    """
+    Download a single-band byte image to a Cloud-Optimized GeoTIFF.
+
+    As the raster of download_flood_extents, in parts that fit the size
+    limit.
+    Inputs:
+        image (ee.Image): Image to download, clipped to the region of
+            interest.
+        bounds (tuple): (west, south, east, north) of the region in degrees.
+        path (str): Path of the output GeoTIFF.
+        session (requests.Session): Session shared by the downloads.
+        scale (float): Pixel size in meters.
+        max_workers (int): Maximum number of concurrent requests.
+
+    Returns:
+        path (str): Path of the output GeoTIFF.
+    """
+    grid, raster_tiles = image_download_urls(
+        image.toByte(), bounds, scale=scale, max_workers=max_workers
+    )
+    spooled = download_files(
+        {f"raster_{i}.tif": url for i, (url, _) in enumerate(raster_tiles)},
+        directory=os.path.dirname(path) or None,
+        session=session,
+        max_workers=max_workers,
+    )
+    return _mosaic_spooled(spooled, raster_tiles, grid, path)
+
+
+@timed()
+def download_flood_extents(
+    flood_rasters,
+    flood_vectors,
+    bounds,
+    directory,
+    session=None,
+    scale=30,
+    max_workers=4,
+    vector_formats=(".fgb", ".parquet"),
+    level_of_detail=None,
+    topojson=False,
+    max_generalised_features=MAX_GENERALISED_FEATURES,
+):
+    """
+    Download the flood raster and vectors of a run to local files.
+
+    The raster is requested in parts that fit the size limit, and all parts
+    and the vectors are streamed concurrently, then the raster parts are
+    mosaicked into one Cloud-Optimized GeoTIFF of bytes. The vectors are
+    streamed feature by feature from the download into the formats with a
+    spatial index (see utils_vector_io), at full detail, so memory does not
+    grow with the number of polygons. If a level of detail is given, the
+    GeoJSON vectors are then simplified in a separate step (see
+    utils_generalise), which loads them in memory and is therefore skipped
+    above max_generalised_features polygons.
+    Inputs:
+        flood_rasters (ee.Image): Detected flood extents as a binary raster.
+        flood_vectors (ee.FeatureCollection): Detected flood extents as
+            vector geometries.
+        bounds (tuple): (west, south, east, north) of the region in degrees.
+        directory (str): Output directory.
+        session (requests.Session): Session shared by the downloads.
+        scale (float): Pixel size of the raster in meters.
+        max_workers (int): Maximum number of concurrent requests.
+        vector_formats (list): Extensions of the vector formats to convert
+            the GeoJSON vectors to, '.fgb' and/or '.parquet'.
+        level_of_detail (str): Level of detail of the vectors, see
+            utils_generalise.LEVELS_OF_DETAIL, or None to keep the vectors
+            as downloaded.
+        topojson (bool): If True and a level of detail is given, the
+            vectors are also written as TopoJSON.
+        max_generalised_features (int): Maximum number of polygons of a
+            generalised download.
+
+    Returns:
+        paths (dict): Paths of "raster.tif", "vector.geojson" and of the
+            converted vectors, e.g. "vector.fgb"; with a level of detail and
+            up to max_generalised_features polygons, also of
+            "generalisation.json", the reduction of the vertices and payload
+            (see utils_generalise.generalise), and "vector.topojson" if
+            requested.
+    """
+    # Get download urls for raster data, split into requests that fit the
+    # size limit, and for vector data
+    grid, raster_tiles = image_download_urls(
+        flood_rasters.toByte(), bounds, scale=scale, max_workers=max_workers
+    )
+    urls = {f"raster_{i}.tif": url for i, (url, _) in enumerate(raster_tiles)}
+    increment("ee_requests", kind="getDownloadUrl")
+    urls["vector.geojson"] = flood_vectors.getDownloadUrl("GEOJSON")
+
+    # Stream all files concurrently to spool files
+    spooled = download_files(
+        urls, directory=directory, session=session, max_workers=max_workers
+    )
+    # Mosaic the raster tiles into one GeoTIFF
+    raster_path = _mosaic_spooled(
+        spooled, raster_tiles, grid, os.path.join(directory, "raster.tif")
+    )
+    paths = {
+        "raster.tif": raster_path,
+        "vector.geojson": spooled["vector.geojson"],
+    }
+    features = None
+    for extension in vector_formats:
+        path = os.path.join(directory, f"vector{extension}")
+        features = write_vectors(
+            iter_features(spooled["vector.geojson"]), path
+        )
+        paths[f"vector{extension}"] = path
+    if level_of_detail is None:
+        return paths
+    if features is None:
+        features = sum(1 for _ in iter_features(spooled["vector.geojson"]))
+    if features <= max_generalised_features:
+        paths.update(
+            generalise_download(
+                spooled["vector.geojson"], level_of_detail, topojson=topojson
+            )
+        )
+    return paths
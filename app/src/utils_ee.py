@@ -1,9 +1,10 @@
 """Module for ee-related functionalities."""
-import ee
 import streamlit as st
-from ee import oauth
-from google.oauth2 import service_account
 from src.utils import is_app_on_streamlit
+from src.utils_imports import lazy_import
+
+# Imported when Earth Engine is initialised, before the first computation
+ee = lazy_import("ee")
 
 
 @st.experimental_memo
@@ -27,6 +28,10 @@ def ee_initialize(force_use_service_account: bool = False):
         None
     """
     if force_use_service_account or is_app_on_streamlit():
+        # Imported here, as only service accounts need them
+        from ee import oauth
+        from google.oauth2 import service_account
+
         service_account_keys = st.secrets["ee_keys"]
         credentials = service_account.Credentials.from_service_account_info(
             service_account_keys, scopes=oauth.SCOPES
@@ -1,66 +1,192 @@
 """Functions to derive flood extent using Google Earth Engine."""
+import asyncio
+import functools
+import math
+import os
+import random
 import time
 
-import ee
+from src.utils_cache import canonical_hash
+from src.utils_imports import lazy_import
+from src.utils_metrics import increment, timed
+from src.utils_speckle import get_speckle_filter
+from src.utils_static_masks import (
+    FLAT_BIT,
+    LAND_BIT,
+    cell_bounds,
+    cells_covering,
+)
+from src.utils_tiling import (
+    polygon_bounds,
+    seam_lines,
+    split_bounds,
+    tile_overlap,
+)
 
+# Imported on the first Earth Engine call, so that pages importing this
+# module render without loading the Earth Engine client
+ee = lazy_import("ee")
 
-def _check_task_completed(task_id, verbose=False):
+# Version of the flood detection algorithm, part of the cache keys. Increase
+# it whenever a change to the pipeline alters its results.
+ALGORITHM_VERSION = "1"
+
+# Thresholds of the ratio image offered in the app, in ascending order, whose
+# flood rasters are derived together, see threshold_levels
+THRESHOLDS = tuple(step * 0.25 for step in range(21))
+
+# Image collection of precomputed static masks, see export_static_mask
+STATIC_MASK_ASSET = os.environ.get("FLOOD_STATIC_MASK_ASSET")
+
+
+# Task states after which a task will not change anymore, as the values of
+# ee.batch.Task.State. Earth Engine reports unknown task ids as "UNKNOWN",
+# which will not change either.
+FINAL_TASK_STATES = ("COMPLETED", "CANCELLED", "FAILED", "UNKNOWN")
+
+
+def _poll_delays(initial_delay=1, max_delay=30, factor=2):
     """
-    Return True if a task export completes successfully, else returns false.
+    Yield delays between polls, growing exponentially with jitter.
 
+    Half of each delay is fixed and half is random ("equal jitter"), so that
+    many clients started together do not poll in lockstep.
     Inputs:
-        task_id (str): Google Earth Engine task id
+        initial_delay (float): First delay in seconds.
+        max_delay (float): Largest delay in seconds.
+        factor (float): Growth factor of the delay.
 
-    Returns:
-        boolean
+    Yields:
+        float: Delay in seconds.
+    """
+    delay = initial_delay
+    while True:
+        yield delay / 2 + random.uniform(0, delay / 2)
+        delay = min(delay * factor, max_delay)
 
+
+def _update_task_states(states, statuses):
     """
-    status = ee.data.getTaskStatus(task_id)[0]
-    if status["state"] in (
-        ee.batch.Task.State.CANCELLED,
-        ee.batch.Task.State.FAILED,
-    ):
-        if "error_message" in status:
-            if verbose:
-                print(status["error_message"])
-        return True
-    elif status["state"] == ee.batch.Task.State.COMPLETED:
-        return True
-    return False
+    Update the task states with the statuses returned by Earth Engine.
+
+    Inputs:
+        states (dict): Task id to {"state", "error_message"}, updated in
+            place.
+        statuses (list): Statuses returned by ee.data.getTaskStatus.
+
+    Returns:
+        list: Ids of the tasks that have not finished yet.
+    """
+    for status in statuses:
+        states[status["id"]] = {
+            "state": status["state"],
+            "error_message": status.get("error_message"),
+        }
+    return [
+        task_id
+        for task_id, task_state in states.items()
+        if task_state["state"] not in FINAL_TASK_STATES
+    ]
+
+
+def _report_task_states(states, elapsed, verbose):
+    """Print the final states of the tasks if verbose."""
+    if verbose:
+        for task_id, task_state in states.items():
+            message = task_state["error_message"] or ""
+            print(f"Task {task_id}: {task_state['state']} {message}")
+        print(f"Stopped waiting for {len(states)} tasks after {elapsed:.0f}s")
 
 
-def wait_for_tasks(task_ids, timeout=3600, verbose=False):
+def wait_for_tasks(
+    task_ids, timeout=3600, verbose=False, initial_delay=1, max_delay=30
+):
     """
     Wait for tasks to complete, fail, or timeout.
 
-    Wait for all active tasks if task_ids is not provided.
+    The status of all unfinished tasks is requested in a single batched call
+    per poll, and the delay between polls grows exponentially with jitter.
     Note: Tasks will not be canceled after timeout, and
     may continue to run.
     Inputs:
-        task_ids (list):
-        timeout (int):
+        task_ids (list): Google Earth Engine task ids.
+        timeout (int): Maximum waiting time in seconds, 0 for no limit.
+        initial_delay (float): First delay between polls in seconds.
+        max_delay (float): Largest delay between polls in seconds.
 
     Returns:
-        None
+        states (dict): Task id to a dictionary with the last known "state"
+            and "error_message" (None unless the task failed).
     """
     start = time.time()
-    elapsed = 0
-    while elapsed < timeout or timeout == 0:
+    states = {
+        task_id: {
+            "state": ee.batch.Task.State.UNSUBMITTED,
+            "error_message": None,
+        }
+        for task_id in task_ids
+    }
+    pending = list(task_ids)
+    delays = _poll_delays(initial_delay, max_delay)
+    while pending:
+        increment("ee_requests", kind="getTaskStatus")
+        pending = _update_task_states(states, ee.data.getTaskStatus(pending))
         elapsed = time.time() - start
-        finished = [_check_task_completed(task) for task in task_ids]
-        if all(finished):
-            if verbose:
-                print(f"Tasks {task_ids} completed after {elapsed}s")
-            return True
-        time.sleep(5)
-    if verbose:
-        print(
-            f"Stopped waiting for {len(task_ids)} tasks \
-            after {timeout} seconds"
-        )
-    return False
+        if not pending or (timeout and elapsed >= timeout):
+            break
+        delay = next(delays)
+        if timeout:
+            delay = min(delay, timeout - elapsed)
+        time.sleep(delay)
+    _report_task_states(states, time.time() - start, verbose)
+    return states
+
+
+async def wait_for_tasks_async(
+    task_ids, timeout=3600, verbose=False, initial_delay=1, max_delay=30
+):
+    """
+    Wait for tasks to complete, fail, or timeout, without blocking.
+
+    Asynchronous version of wait_for_tasks: status requests run in a worker
+    thread, so that many exports can be awaited together, e.g. with
+    asyncio.gather.
+    Inputs:
+        task_ids (list): Google Earth Engine task ids.
+        timeout (int): Maximum waiting time in seconds, 0 for no limit.
+        initial_delay (float): First delay between polls in seconds.
+        max_delay (float): Largest delay between polls in seconds.
+
+    Returns:
+        states (dict): Task id to a dictionary with the last known "state"
+            and "error_message" (None unless the task failed).
+    """
+    start = time.time()
+    states = {
+        task_id: {
+            "state": ee.batch.Task.State.UNSUBMITTED,
+            "error_message": None,
+        }
+        for task_id in task_ids
+    }
+    pending = list(task_ids)
+    delays = _poll_delays(initial_delay, max_delay)
+    while pending:
+        increment("ee_requests", kind="getTaskStatus")
+        statuses = await asyncio.to_thread(ee.data.getTaskStatus, pending)
+        pending = _update_task_states(states, statuses)
+        elapsed = time.time() - start
+        if not pending or (timeout and elapsed >= timeout):
+            break
+        delay = next(delays)
+        if timeout:
+            delay = min(delay, timeout - elapsed)
+        await asyncio.sleep(delay)
+    _report_task_states(states, time.time() - start, verbose)
+    return states
 
 
+@timed()
 def export_flood_data(
     flooded_area_vector,
     flooded_area_raster,
@@ -73,6 +199,8 @@ def export_flood_data(
     """
     Export the results of derive_flood_extents function to Google Drive.
 
+    Rasters are written as Cloud-Optimized GeoTIFFs, the flood raster as
+    bytes.
     Inputs:
         flooded_area_vector (ee.FeatureCollection): Detected flood extents as
             vector geometries.
@@ -85,7 +213,7 @@ def export_flood_data(
         filename (str): Desired filename prefix for exported files
 
     Returns:
-        None
+        states (dict): Final state of each export task, see wait_for_tasks.
     """
     if verbose:
         print(
@@ -100,6 +228,7 @@ def export_flood_data(
         fileNamePrefix=filename + "_s1_before",
         crs="EPSG:4326",
         fileFormat="GeoTIFF",
+        formatOptions={"cloudOptimized": True},
     )
 
     s1_after_task = ee.batch.Export.image.toDrive(
@@ -110,16 +239,18 @@ def export_flood_data(
         fileNamePrefix=filename + "_s1_after",
         crs="EPSG:4326",
         fileFormat="GeoTIFF",
+        formatOptions={"cloudOptimized": True},
     )
 
     raster_task = ee.batch.Export.image.toDrive(
-        image=flooded_area_raster,
+        image=flooded_area_raster.toByte(),
         description="export_flood_extents_raster",
         scale=30,
         region=region,
         fileNamePrefix=filename + "_raster",
         crs="EPSG:4326",
         fileFormat="GeoTIFF",
+        formatOptions={"cloudOptimized": True},
     )
 
     vector_task = ee.batch.Export.table.toDrive(
@@ -133,6 +264,7 @@ def export_flood_data(
     s1_after_task.start()
     raster_task.start()
     vector_task.start()
+    increment("ee_requests", 4, kind="startProcessing")
 
     if verbose:
         print("Exporting before Sentinel-1 scene: Task id ", s1_before_task.id)
@@ -140,8 +272,49 @@ def export_flood_data(
         print("Exporting flood extent geotiff: Task id ", raster_task.id)
         print("Exporting flood extent shapefile:  Task id ", vector_task.id)
 
-    wait_for_tasks(
-        [s1_before_task.id, s1_after_task.id, raster_task.id, vector_task.id]
+    states = wait_for_tasks(
+        [s1_before_task.id, s1_after_task.id, raster_task.id, vector_task.id],
+        verbose=verbose,
+    )
+    failed = [
+        task_id
+        for task_id, task_state in states.items()
+        if task_state["state"] != ee.batch.Task.State.COMPLETED
+    ]
+    if failed:
+        increment("errors", len(failed), stage="export_flood_data")
+    return states
+
+
+@functools.lru_cache(maxsize=None)
+def sentinel1_collection(polarization="VH", pass_direction="Ascending"):
+    """
+    Return the Sentinel-1 collection filtered on the acquisition parameters.
+
+    The filters do not depend on the area or the dates, so the expression is
+    built once per process and shared by all runs, which only add their own
+    filterBounds and filterDate on top of it.
+    Inputs:
+        polarization (str): Synthetic aperture radar polarization mode, e.g.,
+            'VH' or 'VV'.
+        pass_direction (str): Synthetic aperture radar pass direction, either
+            'Ascending' or 'Descending'.
+
+    Returns:
+        collection (ee.ImageCollection): Sentinel-1 IW images at 10 m, with
+            the band of the polarization selected.
+    """
+    return (
+        ee.ImageCollection("COPERNICUS/S1_GRD")
+        .filter(ee.Filter.eq("instrumentMode", "IW"))
+        .filter(
+            ee.Filter.listContains(
+                "transmitterReceiverPolarisation", polarization
+            )
+        )
+        .filter(ee.Filter.eq("orbitProperties_pass", pass_direction.upper()))
+        .filter(ee.Filter.eq("resolution_meters", 10))
+        .select(polarization)
     )
 
 
@@ -170,44 +343,131 @@ def retrieve_image_collection(
         criteria.
     """
     collection = (
-        ee.ImageCollection("COPERNICUS/S1_GRD")
-        .filter(ee.Filter.eq("instrumentMode", "IW"))
-        .filter(
-            ee.Filter.listContains(
-                "transmitterReceiverPolarisation", polarization
-            )
-        )
-        .filter(ee.Filter.eq("orbitProperties_pass", pass_direction.upper()))
-        .filter(ee.Filter.eq("resolution_meters", 10))
-        .filterDate(start_date, end_date)
+        sentinel1_collection(polarization, pass_direction)
         .filterBounds(search_region)
-        .select(polarization)
+        .filterDate(start_date, end_date)
     )
 
     return collection
 
 
-def smooth(image, smoothing_radius=50):
+def smooth(image, smoothing_radius=50, speckle_filter="focal_mean"):
     """
     Reduce the radar speckle by smoothing.
 
     Inputs:
         image (ee.Image): Input image.
-        smoothing_radius (int): The radius of the kernel to use for focal mean
-            smoothing.
+        smoothing_radius (int): The radius of the kernel to use for
+            smoothing, in meters.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS. Defaults to a circular focal mean.
 
     Returns:
         smoothed_image (ee.Image): The resulting image after smoothing is
             applied.
     """
-    smoothed_image = image.focal_mean(
-        radius=smoothing_radius, kernelType="circle", units="meters"
+    smoothed_image = get_speckle_filter(speckle_filter, "ee")(
+        image, smoothing_radius
     )
 
     return smoothed_image
 
 
-def mask_permanent_water(image):
+@functools.lru_cache(maxsize=None)
+def get_static_mask(asset_id=STATIC_MASK_ASSET):
+    """
+    Return the static mask of permanent water and steep slopes.
+
+    The mask combines LAND_BIT (not a perennial water body) and FLAT_BIT
+    (slope under 5 degrees) flags in one band, see utils_static_masks. If an
+    asset id is given, the precomputed mask exported with export_static_mask
+    is used, and the mask derived from the JRC and HydroSHEDS datasets
+    outside the exported cells, where a masked static mask would mask every
+    pixel and give an empty flood extent; otherwise the mask is derived. The
+    expression is built once per process and shared by all runs.
+    Inputs:
+        asset_id (str): Id of the image collection of precomputed masks.
+            Defaults to the FLOOD_STATIC_MASK_ASSET environment variable.
+
+    Returns:
+        static_mask (ee.Image): uint8 image of bit flags.
+    """
+    if asset_id:
+        return (
+            ee.ImageCollection(asset_id)
+            .mosaic()
+            .unmask(get_static_mask(asset_id=None))
+            .rename("static_mask")
+        )
+    surface_water = ee.Image("JRC/GSW1_4/GlobalSurfaceWater").select(
+        "seasonality"
+    )
+    # Pixels without surface water data are not masked, as in
+    # mask_permanent_water
+    land = surface_water.gte(10).unmask(0).Not()
+    dem = ee.Image("WWF/HydroSHEDS/03VFDEM")
+    slope = ee.Algorithms.Terrain(dem).select("slope")
+    flat = slope.lt(5).unmask(0)
+    return (
+        land.multiply(LAND_BIT)
+        .add(flat.multiply(FLAT_BIT))
+        .toByte()
+        .rename("static_mask")
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def get_mask_layers(static_mask):
+    """
+    Return the permanent water and flat terrain layers of a static mask.
+
+    The layers are built once per static mask, so that every run masks its
+    flood raster with the same expressions instead of new copies of them.
+    Inputs:
+        static_mask (ee.Image): Static mask, see get_static_mask.
+
+    Returns:
+        surface_water_mask (ee.Image): 1 where perennial water bodies are.
+        flat_mask (ee.Image): 1 where the slope is under 5 degrees.
+    """
+    return (
+        static_mask.bitwiseAnd(LAND_BIT).eq(0),
+        static_mask.bitwiseAnd(FLAT_BIT).neq(0),
+    )
+
+
+def export_static_mask(bounds, asset_id, scale=30):
+    """
+    Export the static mask to an asset, one image per grid cell.
+
+    Inputs:
+        bounds (tuple): (west, south, east, north) of the area in degrees.
+        asset_id (str): Id of an existing image collection asset.
+        scale (int): Pixel size of the exported mask in meters.
+
+    Returns:
+        task_ids (list): Ids of the export tasks, see wait_for_tasks.
+    """
+    static_mask = get_static_mask(asset_id=None)
+    task_ids = []
+    for cell in cells_covering(bounds):
+        task = ee.batch.Export.image.toAsset(
+            image=static_mask,
+            description="export_static_mask_" + cell,
+            assetId=f"{asset_id}/{cell}",
+            region=ee.Geometry.Rectangle(
+                list(cell_bounds(cell)), geodesic=False
+            ),
+            scale=scale,
+            crs="EPSG:4326",
+            maxPixels=1e13,
+        )
+        task.start()
+        task_ids.append(task.id)
+    return task_ids
+
+
+def mask_permanent_water(image, static_mask=None):
     """
     Query the JRC Global Surface Water Mapping Layers, v1.3.
 
@@ -215,17 +475,22 @@ def mask_permanent_water(image):
     months/yr), and mask these areas.
     Inputs:
         image (ee.Image): Input image.
+        static_mask (ee.Image): If set, the LAND_BIT flag of this
+            precomputed mask is used instead of the JRC dataset.
 
     Returns:
         masked_image (ee.Image): The resulting image after surface water
         masking is applied.
     """
-    surface_water = ee.Image("JRC/GSW1_4/GlobalSurfaceWater").select(
-        "seasonality"
-    )
-    surface_water_mask = surface_water.gte(10).updateMask(
-        surface_water.gte(10)
-    )
+    if static_mask is not None:
+        surface_water_mask = get_mask_layers(static_mask)[0]
+    else:
+        surface_water = ee.Image("JRC/GSW1_4/GlobalSurfaceWater").select(
+            "seasonality"
+        )
+        surface_water_mask = surface_water.gte(10).updateMask(
+            surface_water.gte(10)
+        )
 
     # Flooded layer where perennial water bodies(water > 10 mo / yr) is
     # assigned a 0 value
@@ -236,35 +501,46 @@ def mask_permanent_water(image):
     return masked_image
 
 
-def reduce_noise(image):
+def reduce_noise(image, min_connected_pixels=8):
     """
     Reduce noise in the image.
 
-    Compute connectivity of pixels to eliminate those connected to 8 or fewer
-    neighbours.
+    Compute connectivity of pixels to eliminate those connected to fewer than
+    min_connected_pixels pixels. Counting stops at min_connected_pixels, so
+    large groups of pixels are not counted again up to the default maximum
+    size for each of their pixels.
     Inputs:
         image (ee.Image): A binary image.
+        min_connected_pixels (int): Minimum size of a group of pixels.
 
     Returns:
         reduced_noise_image (ee.Image): The resulting image after noise
             reduction is applied.
     """
-    connections = image.connectedPixelCount()
-    reduced_noise_image = image.updateMask(connections.gte(8))
+    connections = image.connectedPixelCount(
+        maxSize=min_connected_pixels, eightConnected=True
+    )
+    reduced_noise_image = image.updateMask(
+        connections.gte(min_connected_pixels)
+    )
 
     return reduced_noise_image
 
 
-def mask_slopes(image):
+def mask_slopes(image, static_mask=None):
     """
     Mask out areas with more than 5 % slope with a Digital Elevation Model.
 
     Inputs:
         image (ee.Image): Input image.
+        static_mask (ee.Image): If set, the FLAT_BIT flag of this
+            precomputed mask is used instead of the DEM.
     Returns:
          slopes_masked (ee.Image): The resulting image after slope masking is
             applied.
     """
+    if static_mask is not None:
+        return image.updateMask(get_mask_layers(static_mask)[1])
     dem = ee.Image("WWF/HydroSHEDS/03VFDEM")
     terrain = ee.Algorithms.Terrain(dem)
     slope = terrain.select("slope")
@@ -273,22 +549,214 @@ def mask_slopes(image):
     return slopes_masked
 
 
-def derive_flood_extents(
+def clear_graph_caches():
+    """Drop the Earth Engine expressions shared between runs."""
+    for cached in (
+        sentinel1_collection,
+        get_static_mask,
+        get_mask_layers,
+        _cached_flood_ratio,
+        tile_regions,
+    ):
+        cached.cache_clear()
+
+
+def _build_flood_ratio(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    polarization,
+    pass_direction,
+    speckle_filter,
+):
+    """Build the graph of derive_flood_ratio."""
+    # The 'before' and 'after' collections share everything but their dates
+    search_collection = sentinel1_collection(
+        polarization, pass_direction
+    ).filterBounds(aoi)
+    before_flood_img_col = search_collection.filterDate(
+        before_start_date, before_end_date
+    )
+    after_flood_img_col = search_collection.filterDate(
+        after_start_date, after_end_date
+    )
+
+    # Create a mosaic of selected tiles and clip to study area
+    before_mosaic = before_flood_img_col.mosaic().clip(aoi)
+    after_mosaic = after_flood_img_col.mosaic().clip(aoi)
+
+    before_filtered = smooth(before_mosaic, speckle_filter=speckle_filter)
+    after_filtered = smooth(after_mosaic, speckle_filter=speckle_filter)
+
+    # Calculate the difference between the before and after images
+    difference = after_filtered.divide(before_filtered)
+
+    return difference, before_filtered, after_filtered
+
+
+_cached_flood_ratio = functools.lru_cache(maxsize=64)(_build_flood_ratio)
+
+
+def derive_flood_ratio(
     aoi,
     before_start_date,
     before_end_date,
     after_start_date,
     after_end_date,
-    difference_threshold=1.25,
     polarization="VH",
     pass_direction="Ascending",
-    export=False,
-    export_filename="flood_extents",
+    speckle_filter="focal_mean",
 ):
     """
-    Set start and end dates of a period BEFORE and AFTER a flood.
+    Derive the ratio of the filtered 'after' and 'before' images.
+
+    The ratio does not depend on the threshold, so it can be computed once
+    per area and set of dates, and thresholded with classify_flood_ratio.
+    The graph is built once per set of parameters and shared by all runs
+    with the same area and dates, since Earth Engine objects compare and
+    hash by value; the 'before' and 'after' branches share their search
+    collection, so it is serialized once.
+    Inputs:
+        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        polarization (str): Synthetic aperture radar polarization mode.
+        pass_direction (str): Synthetic aperture radar pass direction.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+
+    Returns:
+        difference (ee.Image): Ratio of the 'after' and 'before' images.
+        before_filtered (ee.Image): The 'before' Sentinel-1 image.
+        after_filtered (ee.Image): The 'after' Sentinel-1 image containing view
+            of the flood waters.
+    """
+    arguments = (
+        aoi,
+        before_start_date,
+        before_end_date,
+        after_start_date,
+        after_end_date,
+        polarization,
+        pass_direction,
+        speckle_filter,
+    )
+    try:
+        hash(arguments)
+    except TypeError:
+        # e.g. dates given as unhashable objects
+        return _build_flood_ratio(*arguments)
+    return _cached_flood_ratio(*arguments)
+
+
+def classify_flood_ratio(difference, difference_threshold=1.25):
+    """
+    Threshold the ratio image and create the flood extent mask.
+
+    Permanent water and steep slopes are masked with the static mask of
+    get_static_mask, built once per process.
+    Inputs:
+        difference (ee.Image): Ratio of the 'after' and 'before' images, see
+            derive_flood_ratio.
+        difference_threshold (float): Threshold to be applied on the
+            differenced image (after flood - before flood).
+
+    Returns:
+        flood_rasters (ee.Image): Detected flood extents as a binary raster.
+    """
+    static_mask = get_static_mask()
+    difference_binary = difference.gt(difference_threshold)
+    difference_binary_masked = mask_permanent_water(
+        difference_binary, static_mask
+    )
+    difference_binary_masked_reduced_noise = reduce_noise(
+        difference_binary_masked
+    )
+    return mask_slopes(difference_binary_masked_reduced_noise, static_mask)
+
+
+def threshold_levels(difference, thresholds=THRESHOLDS):
+    """
+    Classify the ratio image for several thresholds at once, in one band.
+
+    A pixel flooded at a threshold is flooded at all lower thresholds, as
+    its group of pixels only grows when the threshold decreases. The number
+    of thresholds at which each pixel is flooded thus holds the flood
+    rasters of all of them, see flood_rasters_at_threshold.
+    Inputs:
+        difference (ee.Image): Ratio of the 'after' and 'before' images, see
+            derive_flood_ratio.
+        thresholds (list): Thresholds in ascending order.
+
+    Returns:
+        levels (ee.Image): uint8 band "levels", 0 where not flooded at any
+            threshold.
+    """
+    return (
+        ee.Image.cat(
+            [
+                classify_flood_ratio(difference, threshold).unmask(0)
+                for threshold in thresholds
+            ]
+        )
+        .reduce(ee.Reducer.sum())
+        .toByte()
+        .rename("levels")
+    )
+
+
+def threshold_index(difference_threshold, thresholds=THRESHOLDS):
+    """
+    Return the index of a threshold in the thresholds of the levels.
+
+    Inputs:
+        difference_threshold (float): Threshold, one of thresholds.
+        thresholds (list): Thresholds of the levels, see threshold_levels.
+
+    Returns:
+        int: Index of the threshold.
+    """
+    for index, threshold in enumerate(thresholds):
+        if math.isclose(threshold, difference_threshold, abs_tol=1e-9):
+            return index
+    raise ValueError(f"Threshold not in the levels: {difference_threshold}")
+
+
+def flood_rasters_at_threshold(levels, difference_threshold, thresholds):
+    """
+    Return the flood raster of one threshold from the threshold levels.
+
+    Inputs:
+        levels (ee.Image): Threshold levels, see threshold_levels.
+        difference_threshold (float): Threshold, one of thresholds.
+        thresholds (list): Thresholds of the levels.
+
+    Returns:
+        flood_rasters (ee.Image): Detected flood extents as a binary raster,
+            masked where not flooded, as classify_flood_ratio.
+    """
+    index = threshold_index(difference_threshold, thresholds)
+    return levels.gt(index).selfMask()
 
-    These periods need to be long enough for Sentinel-1 to acquire an image.
+
+@timed()
+def derive_flood_rasters(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    difference_threshold=1.25,
+    polarization="VH",
+    pass_direction="Ascending",
+    speckle_filter="focal_mean",
+):
+    """
+    Derive the binary flood raster and the filtered Sentinel-1 images.
 
     Inputs:
         aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
@@ -297,73 +765,978 @@ def derive_flood_extents(
         after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
         after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
         difference_threshold (float): Threshold to be applied on the
-            differenced image (after flood - before flood). It has been chosen
-            by trial and error. In case your flood extent result shows many
-            false-positive or negative signals, consider changing it.
-        export (bool): Flag to export derived flood extents to Google Drive
-        export_filename (str): Desired filename prefix for exported files. Only
-            used if export=True.
+            differenced image (after flood - before flood).
+        polarization (str): Synthetic aperture radar polarization mode.
+        pass_direction (str): Synthetic aperture radar pass direction.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
 
     Returns:
-        flood_vectors (ee.FeatureCollection): Detected flood extents as vector
-            geometries.
         flood_rasters (ee.Image): Detected flood extents as a binary raster.
         before_filtered (ee.Image): The 'before' Sentinel-1 image.
         after_filtered (ee.Image): The 'after' Sentinel-1 image containing view
             of the flood waters.
     """
-    before_flood_img_col = retrieve_image_collection(
-        search_region=aoi,
-        start_date=before_start_date,
-        end_date=before_end_date,
-        polarization=polarization,
-        pass_direction=pass_direction,
-    )
-    after_flood_img_col = retrieve_image_collection(
-        search_region=aoi,
-        start_date=after_start_date,
-        end_date=after_end_date,
+    difference, before_filtered, after_filtered = derive_flood_ratio(
+        aoi=aoi,
+        before_start_date=before_start_date,
+        before_end_date=before_end_date,
+        after_start_date=after_start_date,
+        after_end_date=after_end_date,
         polarization=polarization,
         pass_direction=pass_direction,
+        speckle_filter=speckle_filter,
     )
+    flood_rasters = classify_flood_ratio(difference, difference_threshold)
 
-    # Create a mosaic of selected tiles and clip to study area
-    before_mosaic = before_flood_img_col.mosaic().clip(aoi)
-    after_mosaic = after_flood_img_col.mosaic().clip(aoi)
+    return flood_rasters, before_filtered, after_filtered
 
-    before_filtered = smooth(before_mosaic)
-    after_filtered = smooth(after_mosaic)
 
-    # Calculate the difference between the before and after images
-    difference = after_filtered.divide(before_filtered)
+def vectorise_flood_rasters(flood_rasters, region, best_effort=True):
+    """
+    Convert the binary flood raster into polygons.
 
-    # Apply the predefined difference - threshold and create the flood extent
-    # mask
-    difference_binary = difference.gt(difference_threshold)
-    difference_binary_masked = mask_permanent_water(difference_binary)
-    difference_binary_masked_reduced_noise = reduce_noise(
-        difference_binary_masked
-    )
-    flood_rasters = mask_slopes(difference_binary_masked_reduced_noise)
+    Inputs:
+        flood_rasters (ee.Image): Detected flood extents as a binary raster.
+        region (ee.Geometry.Polygon): Region to vectorise.
+        best_effort (bool): If True, Earth Engine may use a coarser scale
+            when the region has too many pixels. Tiled runs set it to False,
+            so that the 10 m resolution is always kept.
 
-    # Export the extent of detected flood in vector format
-    flood_vectors = flood_rasters.reduceToVectors(
+    Returns:
+        flood_vectors (ee.FeatureCollection): Detected flood extents as vector
+            geometries.
+    """
+    options = {} if best_effort else {"maxPixels": 1e13}
+    return flood_rasters.reduceToVectors(
         scale=10,
         geometryType="polygon",
-        geometry=aoi,
+        geometry=region,
         eightConnected=False,
-        bestEffort=True,
+        bestEffort=best_effort,
         tileScale=2,
+        **options,
     )
 
-    if export:
-        export_flood_data(
-            flooded_area_vector=flood_vectors,
-            flooded_area_raster=flood_rasters,
-            image_before_flood=before_filtered,
-            image_after_flood=after_filtered,
-            region=aoi,
-            filename=export_filename,
+
+def flooded_area_km2(flood_rasters, region, scale=30):
+    """
+    Return the flooded area of a flood raster, sending one request.
+
+    Inputs:
+        flood_rasters (ee.Image): Detected flood extents as a binary raster.
+        region (ee.Geometry.Polygon): Region over which the area is summed.
+        scale (int): Pixel size in meters of the computation.
+
+    Returns:
+        float: Flooded area in square kilometers.
+    """
+    increment("ee_requests", kind="getInfo")
+    area = (
+        flood_rasters.unmask(0)
+        .multiply(ee.Image.pixelArea())
+        .reduceRegion(
+            reducer=ee.Reducer.sum(),
+            geometry=region,
+            scale=scale,
+            maxPixels=1e13,
+            tileScale=4,
         )
+        .values()
+        .get(0)
+        .getInfo()
+    )
+    return area / 1e6
 
-    return flood_vectors, flood_rasters, before_filtered, after_filtered
+
+def stitch_flood_vectors(collections, seams, max_error=1):
+    """
+    Merge the polygons of several tiles on Earth Engine.
+
+    Polygons touching a seam are dissolved with their neighbours across the
+    seam, and the dissolved geometry is split back into polygons; all other
+    polygons are kept unchanged.
+    Inputs:
+        collections (list): One ee.FeatureCollection of polygons per tile.
+        seams (list): Seam lines as returned by utils_tiling.seam_lines.
+        max_error (float): Error tolerated by the intersection and union, in
+            meters.
+
+    Returns:
+        flood_vectors (ee.FeatureCollection): Merged polygons.
+    """
+    flood_vectors = ee.FeatureCollection(collections).flatten()
+    if not seams:
+        return flood_vectors
+    seam = ee.Geometry.MultiLineString(
+        [list(line.coords) for line in seams], geodesic=False
+    )
+    touching = ee.Filter.intersects(
+        leftField=".geo", rightValue=seam, maxError=max_error
+    )
+    dissolved = (
+        flood_vectors.filter(touching).union(max_error).geometry(max_error)
+    )
+    parts = dissolved.geometries().map(
+        lambda polygon: ee.Feature(ee.Geometry(polygon), {"label": 1})
+    )
+    return flood_vectors.filter(touching.Not()).merge(
+        ee.FeatureCollection(parts)
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def tile_regions(aoi, tile_size_km):
+    """
+    Split an area of interest into overlapping tiles.
+
+    The bounds of the area are requested once per area and tile size, and
+    shared by the tiled runs and the threshold levels of the area.
+    Inputs:
+        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
+        tile_size_km (float): Side of the tiles in kilometers.
+
+    Returns:
+        tiles (list): Tiles as returned by utils_tiling.split_bounds.
+        regions (list): (core, tile) regions of each tile, intersected with
+            the area of interest.
+    """
+    increment("ee_requests", kind="getInfo")
+    bounds = polygon_bounds(aoi.bounds().getInfo()["coordinates"][0])
+    tiles = split_bounds(bounds, tile_size_km, tile_overlap())
+    # Planar rectangles, so that the tiles follow the pixel grid
+    regions = [
+        tuple(
+            ee.Geometry.Rectangle(
+                list(rectangle), geodesic=False
+            ).intersection(aoi, 1)
+            for rectangle in tile
+        )
+        for tile in tiles
+    ]
+    return tiles, regions
+
+
+@timed()
+def derive_flood_extents_tiled(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    difference_threshold=1.25,
+    polarization="VH",
+    pass_direction="Ascending",
+    tile_size_km=50,
+    speckle_filter="focal_mean",
+):
+    """
+    Derive flood extents tile by tile, for large areas of interest.
+
+    The area is split into a grid of tiles overlapping by tile_overlap(), so
+    that smoothing and noise reduction give no seams. The polygons of the
+    tiles are computed at full resolution and stitched together across the
+    seams on Earth Engine (see stitch_flood_vectors), so that no tile is
+    downloaded; the rasters are cropped to the tile cores and mosaicked.
+    Inputs:
+        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        difference_threshold (float): Threshold to be applied on the
+            differenced image (after flood - before flood).
+        polarization (str): Synthetic aperture radar polarization mode.
+        pass_direction (str): Synthetic aperture radar pass direction.
+        tile_size_km (float): Side of the tiles in kilometers.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+
+    Returns:
+        flood_vectors (ee.FeatureCollection): Detected flood extents as vector
+            geometries.
+        flood_rasters (ee.Image): Detected flood extents as a binary raster.
+        before_filtered (ee.Image): The 'before' Sentinel-1 image.
+        after_filtered (ee.Image): The 'after' Sentinel-1 image containing view
+            of the flood waters.
+    """
+    tiles, regions = tile_regions(aoi, tile_size_km)
+
+    def compute_tile(regions):
+        core_region, tile_region = regions
+        outputs = derive_flood_rasters(
+            aoi=tile_region,
+            before_start_date=before_start_date,
+            before_end_date=before_end_date,
+            after_start_date=after_start_date,
+            after_end_date=after_end_date,
+            difference_threshold=difference_threshold,
+            polarization=polarization,
+            pass_direction=pass_direction,
+            speckle_filter=speckle_filter,
+        )
+        outputs = [image.clip(core_region) for image in outputs]
+        flood_vectors = vectorise_flood_rasters(
+            outputs[0], core_region, best_effort=False
+        )
+        return flood_vectors, outputs
+
+    results = [compute_tile(tile) for tile in regions]
+    flood_vectors = stitch_flood_vectors(
+        [flood_vectors for flood_vectors, _ in results], seam_lines(tiles)
+    )
+    flood_rasters, before_filtered, after_filtered = (
+        ee.ImageCollection([outputs[i] for _, outputs in results]).mosaic()
+        for i in range(3)
+    )
+
+    return flood_vectors, flood_rasters, before_filtered, after_filtered
+
+
+def flood_extents_cache_key(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    difference_threshold=1.25,
+    polarization="VH",
+    pass_direction="Ascending",
+    speckle_filter="focal_mean",
+    combinations=None,
+):
+    """
+    Return the cache key of a flood extent run.
+
+    The key is computed client-side from the parameters of the run and the
+    source of the static mask (see get_static_mask), so no request is sent
+    to Google Earth Engine.
+    Inputs:
+        aoi (ee.Geometry.Polygon or dict): Geographic extent of analysis
+            area, as an Earth Engine geometry or a GeoJSON geometry.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        difference_threshold (float): Threshold applied on the differenced
+            image.
+        polarization (str): Synthetic aperture radar polarization mode.
+        pass_direction (str): Synthetic aperture radar pass direction.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+        combinations (list): With polarization 'all', the (pass_direction,
+            polarization) pairs run, by default COMBINATIONS.
+
+    Returns:
+        str: Hexadecimal cache key.
+    """
+    payload = _run_payload(
+        aoi,
+        [before_start_date, before_end_date, after_start_date, after_end_date],
+        polarization,
+        pass_direction,
+        speckle_filter,
+        combinations,
+    )
+    payload["difference_threshold"] = float(difference_threshold)
+    return canonical_hash(payload)
+
+
+def flood_levels_cache_key(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    polarization="VH",
+    pass_direction="Ascending",
+    speckle_filter="focal_mean",
+    thresholds=THRESHOLDS,
+):
+    """
+    Return the cache key of the threshold levels of an area and dates.
+
+    As flood_extents_cache_key, with the thresholds of the levels (see
+    threshold_levels) instead of one threshold.
+    Inputs:
+        aoi (ee.Geometry.Polygon or dict): Geographic extent of analysis
+            area, as an Earth Engine geometry or a GeoJSON geometry.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        polarization (str): Synthetic aperture radar polarization mode, or
+            'all' for all combinations.
+        pass_direction (str): Synthetic aperture radar pass direction, or
+            'all' for all combinations.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+        thresholds (list): Thresholds of the levels.
+
+    Returns:
+        str: Hexadecimal cache key.
+    """
+    payload = _run_payload(
+        aoi,
+        [before_start_date, before_end_date, after_start_date, after_end_date],
+        polarization,
+        pass_direction,
+        speckle_filter,
+        COMBINATIONS,
+    )
+    payload["thresholds"] = [float(threshold) for threshold in thresholds]
+    return canonical_hash(payload)
+
+
+def _run_payload(
+    aoi, dates, polarization, pass_direction, speckle_filter, combinations=None
+):
+    """Return the parameters identifying a run, see canonical_hash."""
+    geometry = aoi if isinstance(aoi, dict) else aoi.toGeoJSON()
+    payload = {
+        "aoi": {
+            "type": geometry["type"],
+            "coordinates": geometry["coordinates"],
+        },
+        "dates": [str(date) for date in dates],
+        "polarization": polarization,
+        "pass_direction": pass_direction,
+        "speckle_filter": speckle_filter,
+        # The derived mask gives the results of the separate JRC and DEM
+        # masks, but masks exported at another scale are resampled
+        "static_mask": STATIC_MASK_ASSET or "derived",
+        "algorithm_version": ALGORITHM_VERSION,
+    }
+    if polarization == "all":
+        # Runs of other sets of combinations give other results
+        payload["combinations"] = sorted(
+            list(combination) for combination in combinations or COMBINATIONS
+        )
+    return payload
+
+
+def serialize_outputs(outputs):
+    """
+    Serialize the Earth Engine outputs of a flood extent run as one graph.
+
+    The outputs share most of their graph (the filtered images feed the
+    flood raster, which feeds the polygons), so serializing them together
+    stores each sub-expression once.
+    Inputs:
+        outputs (tuple): flood_vectors, flood_rasters, before_filtered and
+            after_filtered, see derive_flood_extents.
+
+    Returns:
+        str: JSON graph, see ee.serializer.toJSON.
+    """
+    return ee.serializer.toJSON(list(outputs))
+
+
+def deserialize_outputs(graph):
+    """
+    Rebuild the Earth Engine outputs of a flood extent run from its graph.
+
+    Inputs:
+        graph (str): JSON graph, see serialize_outputs.
+
+    Returns:
+        outputs (tuple): flood_vectors, flood_rasters, before_filtered and
+            after_filtered, see derive_flood_extents.
+    """
+    (
+        flood_vectors,
+        flood_rasters,
+        before_filtered,
+        after_filtered,
+    ) = ee.deserializer.fromJSON(graph)
+    return (
+        ee.FeatureCollection(flood_vectors),
+        ee.Image(flood_rasters),
+        ee.Image(before_filtered),
+        ee.Image(after_filtered),
+    )
+
+
+@timed()
+def derive_flood_extents(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    difference_threshold=1.25,
+    polarization="VH",
+    pass_direction="Ascending",
+    export=False,
+    export_filename="flood_extents",
+    backend="ee",
+    local_inputs=None,
+    tile_size_km=None,
+    max_workers=4,
+    cache=None,
+    speckle_filter="focal_mean",
+):
+    """
+    Set start and end dates of a period BEFORE and AFTER a flood.
+
+    These periods need to be long enough for Sentinel-1 to acquire an image.
+    With backend="numpy", the same stages run locally on the scenes given in
+    local_inputs (see utils_flood_analysis_local) and the outputs are NumPy
+    arrays and a GeoJSON dictionary instead of Earth Engine objects.
+    Inputs:
+        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        difference_threshold (float): Threshold to be applied on the
+            differenced image (after flood - before flood). It has been chosen
+            by trial and error. In case your flood extent result shows many
+            false-positive or negative signals, consider changing it.
+        export (bool): Flag to export derived flood extents to Google Drive
+        export_filename (str): Desired filename prefix for exported files. Only
+            used if export=True.
+        backend (str): Execution backend, either 'ee' (Google Earth Engine)
+            or 'numpy' (local arrays).
+        local_inputs (dict): Local scenes and auxiliary rasters. Only used if
+            backend='numpy'.
+        tile_size_km (float): If set, the area of interest is split into
+            tiles of this size (see derive_flood_extents_tiled). With
+            backend='numpy', the tile size is converted to pixels.
+        max_workers (int): Maximum number of tiles processed concurrently
+            with backend='numpy'; Earth Engine tiles are one graph.
+        cache (ResultCache): If set, the outputs are stored in this cache
+            under flood_extents_cache_key, and a repeated run returns them
+            without building or sending any Earth Engine request. Only used
+            if backend='ee'.
+        speckle_filter (str): Name of the speckle filter used to smooth the
+            Sentinel-1 images, see utils_speckle.SPECKLE_FILTERS.
+
+    Returns:
+        flood_vectors (ee.FeatureCollection): Detected flood extents as vector
+            geometries.
+        flood_rasters (ee.Image): Detected flood extents as a binary raster.
+        before_filtered (ee.Image): The 'before' Sentinel-1 image.
+        after_filtered (ee.Image): The 'after' Sentinel-1 image containing view
+            of the flood waters.
+    """
+    if backend == "numpy":
+        # Imported here, so that the Earth Engine path does not need the
+        # local raster stack
+        from src.utils_flood_analysis_local import derive_flood_extents_local
+
+        return derive_flood_extents_local(
+            aoi=aoi,
+            before_start_date=before_start_date,
+            before_end_date=before_end_date,
+            after_start_date=after_start_date,
+            after_end_date=after_end_date,
+            local_inputs=local_inputs,
+            difference_threshold=difference_threshold,
+            polarization=polarization,
+            pass_direction=pass_direction,
+            tile_size_km=tile_size_km,
+            max_workers=max_workers,
+            speckle_filter=speckle_filter,
+        )
+    if backend != "ee":
+        raise ValueError(f"Unknown backend: {backend}")
+
+    record = {}
+    if cache is not None:
+        cache_key = flood_extents_cache_key(
+            aoi,
+            before_start_date,
+            before_end_date,
+            after_start_date,
+            after_end_date,
+            difference_threshold=difference_threshold,
+            polarization=polarization,
+            pass_direction=pass_direction,
+            speckle_filter=speckle_filter,
+        )
+        record = cache.get(cache_key) or {}
+        increment(
+            "cache_requests",
+            cache="results",
+            result="hit" if "graph" in record else "miss",
+        )
+
+    if "graph" in record:
+        (
+            flood_vectors,
+            flood_rasters,
+            before_filtered,
+            after_filtered,
+        ) = deserialize_outputs(record["graph"])
+    elif tile_size_km:
+        (
+            flood_vectors,
+            flood_rasters,
+            before_filtered,
+            after_filtered,
+        ) = derive_flood_extents_tiled(
+            aoi=aoi,
+            before_start_date=before_start_date,
+            before_end_date=before_end_date,
+            after_start_date=after_start_date,
+            after_end_date=after_end_date,
+            difference_threshold=difference_threshold,
+            polarization=polarization,
+            pass_direction=pass_direction,
+            tile_size_km=tile_size_km,
+            speckle_filter=speckle_filter,
+        )
+    else:
+        flood_rasters, before_filtered, after_filtered = derive_flood_rasters(
+            aoi=aoi,
+            before_start_date=before_start_date,
+            before_end_date=before_end_date,
+            after_start_date=after_start_date,
+            after_end_date=after_end_date,
+            difference_threshold=difference_threshold,
+            polarization=polarization,
+            pass_direction=pass_direction,
+            speckle_filter=speckle_filter,
+        )
+        # Export the extent of detected flood in vector format
+        flood_vectors = vectorise_flood_rasters(flood_rasters, aoi)
+
+    if cache is not None and "graph" not in record:
+        cache.update(
+            cache_key,
+            graph=serialize_outputs(
+                (flood_vectors, flood_rasters, before_filtered, after_filtered)
+            ),
+        )
+
+    if export:
+        export_flood_data(
+            flooded_area_vector=flood_vectors,
+            flooded_area_raster=flood_rasters,
+            image_before_flood=before_filtered,
+            image_after_flood=after_filtered,
+            region=aoi,
+            filename=export_filename,
+        )
+
+    return flood_vectors, flood_rasters, before_filtered, after_filtered
+
+
+# Pass directions and polarizations run by derive_flood_extents_multi, in
+# order of preference when they cover the area equally
+COMBINATIONS = (
+    ("Ascending", "VH"),
+    ("Descending", "VH"),
+    ("Ascending", "VV"),
+    ("Descending", "VV"),
+)
+
+
+def _combination_band(pass_direction, polarization, name):
+    """Return the band name of a statistic of a combination."""
+    return f"{pass_direction.lower()}_{polarization.lower()}_{name}"
+
+
+@timed()
+def coverage_report(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    difference_threshold=1.25,
+    combinations=COMBINATIONS,
+    speckle_filter="focal_mean",
+    scale=30,
+):
+    """
+    Measure the coverage and flooded area of several combinations at once.
+
+    The valid pixels (covered by both a 'before' and an 'after' scene) and
+    the flooded pixels of every pass direction and polarization are stacked
+    as bands of one image and summed in a single reduceRegion, so that all
+    combinations cost one request.
+    Inputs:
+        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        difference_threshold (float): Threshold to be applied on the
+            differenced image (after flood - before flood).
+        combinations (list): (pass_direction, polarization) pairs to run.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+        scale (int): Pixel size in meters of the computation.
+
+    Returns:
+        report (list): One dictionary per combination, in order, with
+            "pass_direction", "polarization", "coverage" (fraction of the
+            area covered in both periods) and "flooded_km2".
+    """
+    bands = [ee.Image.pixelArea().rename("aoi")]
+    for pass_direction, polarization in combinations:
+        difference, before_filtered, after_filtered = derive_flood_ratio(
+            aoi=aoi,
+            before_start_date=before_start_date,
+            before_end_date=before_end_date,
+            after_start_date=after_start_date,
+            after_end_date=after_end_date,
+            polarization=polarization,
+            pass_direction=pass_direction,
+            speckle_filter=speckle_filter,
+        )
+        valid = before_filtered.mask().And(after_filtered.mask()).unmask(0)
+        flooded = classify_flood_ratio(difference, difference_threshold)
+        bands.append(
+            valid.multiply(ee.Image.pixelArea()).rename(
+                _combination_band(pass_direction, polarization, "covered")
+            )
+        )
+        bands.append(
+            flooded.unmask(0)
+            .multiply(ee.Image.pixelArea())
+            .rename(_combination_band(pass_direction, polarization, "flooded"))
+        )
+    increment("ee_requests", kind="getInfo")
+    areas = (
+        ee.Image.cat(bands)
+        .reduceRegion(
+            reducer=ee.Reducer.sum(),
+            geometry=aoi,
+            scale=scale,
+            maxPixels=1e13,
+            tileScale=4,
+        )
+        .getInfo()
+    )
+    aoi_area = areas.get("aoi") or 0
+    report = []
+    for pass_direction, polarization in combinations:
+        covered = areas.get(
+            _combination_band(pass_direction, polarization, "covered")
+        )
+        flooded = areas.get(
+            _combination_band(pass_direction, polarization, "flooded")
+        )
+        report.append(
+            {
+                "pass_direction": pass_direction,
+                "polarization": polarization,
+                "coverage": min((covered or 0) / aoi_area, 1.0)
+                if aoi_area
+                else 0.0,
+                "flooded_km2": (flooded or 0) / 1e6,
+            }
+        )
+    return report
+
+
+def combine_flood_rasters(flood_rasters):
+    """
+    Merge flood rasters, a pixel being flooded if it is in any of them.
+
+    Inputs:
+        flood_rasters (list): Binary flood rasters (ee.Image).
+
+    Returns:
+        ee.Image: Binary flood raster, masked where not flooded.
+    """
+    return (
+        ee.ImageCollection([image.unmask(0) for image in flood_rasters])
+        .max()
+        .selfMask()
+    )
+
+
+@timed()
+def derive_flood_extents_multi(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    difference_threshold=1.25,
+    mode="best",
+    combinations=COMBINATIONS,
+    tile_size_km=None,
+    max_workers=4,
+    cache=None,
+    speckle_filter="focal_mean",
+):
+    """
+    Derive flood extents with every pass direction and polarization.
+
+    The coverage of all combinations is measured in one request (see
+    coverage_report). With mode='best', the flood extent of the combination
+    covering most of the area is derived, as derive_flood_extents would
+    with that pass direction and polarization; with mode='combined', the
+    flood rasters of all the combinations covering part of the area are
+    merged, so that each one fills the gaps of the others.
+    Inputs:
+        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        difference_threshold (float): Threshold to be applied on the
+            differenced image (after flood - before flood).
+        mode (str): 'best' or 'combined'.
+        combinations (list): (pass_direction, polarization) pairs to run,
+            in order of preference.
+        tile_size_km (float): If set, the best combination is derived tile
+            by tile, see derive_flood_extents_tiled. Combined rasters are
+            not tiled.
+        max_workers (int): Maximum number of tiles computed concurrently,
+            see derive_flood_extents.
+        cache (ResultCache): If set, the coverage report and the outputs are
+            cached, see derive_flood_extents.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+
+    Returns:
+        flood_vectors (ee.FeatureCollection): Detected flood extents as vector
+            geometries.
+        flood_rasters (ee.Image): Detected flood extents as a binary raster.
+        before_filtered (ee.Image): The 'before' image of the best
+            combination.
+        after_filtered (ee.Image): The 'after' image of the best combination.
+        report (dict): "combinations" (see coverage_report), and the
+            "pass_direction" and "polarization" of the result, both 'all'
+            with mode='combined'.
+    """
+    if mode not in ("best", "combined"):
+        raise ValueError(f"Unknown mode: {mode}")
+    dates = dict(
+        before_start_date=before_start_date,
+        before_end_date=before_end_date,
+        after_start_date=after_start_date,
+        after_end_date=after_end_date,
+    )
+    record, report_key = {}, None
+    if cache is not None:
+        report_key = flood_extents_cache_key(
+            aoi,
+            difference_threshold=difference_threshold,
+            polarization="all",
+            pass_direction="all",
+            speckle_filter=speckle_filter,
+            combinations=combinations,
+            **dates,
+        )
+        record = cache.get(report_key) or {}
+        increment(
+            "cache_requests",
+            cache="results",
+            result="hit" if "coverage_report" in record else "miss",
+        )
+    combination_report = record.get("coverage_report")
+    if combination_report is None:
+        combination_report = coverage_report(
+            aoi,
+            difference_threshold=difference_threshold,
+            combinations=combinations,
+            speckle_filter=speckle_filter,
+            **dates,
+        )
+        if cache is not None:
+            cache.update(report_key, coverage_report=combination_report)
+    covered = [row for row in combination_report if row["coverage"] > 0]
+    if not covered:
+        raise ValueError("No image found for the selected dates.")
+    best = max(covered, key=lambda row: row["coverage"])
+
+    if mode == "best":
+        outputs = derive_flood_extents(
+            aoi,
+            difference_threshold=difference_threshold,
+            polarization=best["polarization"],
+            pass_direction=best["pass_direction"],
+            tile_size_km=tile_size_km,
+            max_workers=max_workers,
+            cache=cache,
+            speckle_filter=speckle_filter,
+            **dates,
+        )
+        report = {
+            "combinations": combination_report,
+            "pass_direction": best["pass_direction"],
+            "polarization": best["polarization"],
+        }
+        return tuple(outputs) + (report,)
+
+    report = {
+        "combinations": combination_report,
+        "pass_direction": "all",
+        "polarization": "all",
+    }
+    if "graph" in record:
+        return deserialize_outputs(record["graph"]) + (report,)
+    flood_rasters = []
+    for row in covered:
+        flood_raster, before_filtered, after_filtered = derive_flood_rasters(
+            aoi,
+            difference_threshold=difference_threshold,
+            polarization=row["polarization"],
+            pass_direction=row["pass_direction"],
+            speckle_filter=speckle_filter,
+            **dates,
+        )
+        flood_rasters.append(flood_raster)
+        if row is best:
+            best_images = before_filtered, after_filtered
+    flood_raster = combine_flood_rasters(flood_rasters)
+    outputs = (
+        vectorise_flood_rasters(flood_raster, aoi),
+        flood_raster,
+    ) + best_images
+    if cache is not None:
+        cache.update(report_key, graph=serialize_outputs(outputs))
+    return outputs + (report,)
+
+
+@timed()
+def derive_flood_levels(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    polarization="VH",
+    pass_direction="Ascending",
+    speckle_filter="focal_mean",
+    thresholds=THRESHOLDS,
+    tile_size_km=None,
+    cache=None,
+):
+    """
+    Derive the threshold levels of an area and dates, see threshold_levels.
+
+    The levels hold the flood rasters of all thresholds, so that a new
+    threshold is applied without building the pipeline again (see
+    flood_extents_at_threshold). With pass_direction and polarization
+    'all', the levels of all combinations are merged, as
+    combine_flood_rasters; tiled levels are derived on the tiles of
+    derive_flood_extents_tiled and mosaicked.
+    Inputs:
+        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        polarization (str): Synthetic aperture radar polarization mode, or
+            'all'.
+        pass_direction (str): Synthetic aperture radar pass direction, or
+            'all'.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+        thresholds (list): Thresholds in ascending order.
+        tile_size_km (float): If set, the levels are derived tile by tile.
+        cache (ResultCache): If set, the graph of the levels is stored in
+            this cache under flood_levels_cache_key and reused.
+
+    Returns:
+        levels (ee.Image): Threshold levels.
+    """
+    dates = dict(
+        before_start_date=before_start_date,
+        before_end_date=before_end_date,
+        after_start_date=after_start_date,
+        after_end_date=after_end_date,
+    )
+    if cache is not None:
+        cache_key = flood_levels_cache_key(
+            aoi,
+            polarization=polarization,
+            pass_direction=pass_direction,
+            speckle_filter=speckle_filter,
+            thresholds=thresholds,
+            **dates,
+        )
+        record = cache.get(cache_key) or {}
+        increment(
+            "cache_requests",
+            cache="levels",
+            result="hit" if "graph" in record else "miss",
+        )
+        if "graph" in record:
+            return ee.Image(ee.deserializer.fromJSON(record["graph"]))
+
+    combinations = (
+        COMBINATIONS
+        if polarization == "all"
+        else ((pass_direction, polarization),)
+    )
+
+    def region_levels(region):
+        # Combinations without scenes are masked, and count as not flooded
+        return ee.ImageCollection(
+            [
+                threshold_levels(
+                    derive_flood_ratio(
+                        region,
+                        polarization=combination_polarization,
+                        pass_direction=combination_pass_direction,
+                        speckle_filter=speckle_filter,
+                        **dates,
+                    )[0],
+                    thresholds,
+                )
+                for combination_pass_direction, combination_polarization in (
+                    combinations
+                )
+            ]
+        ).max()
+
+    if tile_size_km:
+        _, regions = tile_regions(aoi, tile_size_km)
+        levels = ee.ImageCollection(
+            [
+                region_levels(tile_region).clip(core_region)
+                for core_region, tile_region in regions
+            ]
+        ).mosaic()
+    else:
+        levels = region_levels(aoi)
+    levels = levels.clip(aoi).toByte().rename("levels")
+    if cache is not None:
+        cache.update(cache_key, graph=ee.serializer.toJSON(levels))
+    return levels
+
+
+def flood_extents_at_threshold(
+    levels, aoi, difference_threshold, thresholds=THRESHOLDS, tile_size_km=None
+):
+    """
+    Derive the flood raster and polygons of one threshold from its levels.
+
+    Inputs:
+        levels (ee.Image): Threshold levels, see derive_flood_levels.
+        aoi (ee.Geometry.Polygon): Geographic extent of analysis area.
+        difference_threshold (float): Threshold, one of thresholds.
+        thresholds (list): Thresholds of the levels.
+        tile_size_km (float): If set, the polygons are derived tile by tile
+            and stitched, as derive_flood_extents_tiled.
+
+    Returns:
+        flood_vectors (ee.FeatureCollection): Detected flood extents as vector
+            geometries.
+        flood_rasters (ee.Image): Detected flood extents as a binary raster.
+    """
+    flood_rasters = flood_rasters_at_threshold(
+        levels, difference_threshold, thresholds
+    )
+    if not tile_size_km:
+        return vectorise_flood_rasters(flood_rasters, aoi), flood_rasters
+    tiles, regions = tile_regions(aoi, tile_size_km)
+    flood_vectors = stitch_flood_vectors(
+        [
+            vectorise_flood_rasters(
+                flood_rasters.clip(core_region), core_region, best_effort=False
+            )
+            for core_region, _ in regions
+        ],
+        seam_lines(tiles),
+    )
+    return flood_vectors, flood_rasters
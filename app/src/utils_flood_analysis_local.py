@@ -0,0 +1,614 @@
+"""Functions to derive flood extent locally with NumPy.
+
+This module mirrors the Google Earth Engine pipeline in utils_flood_analysis
+(mosaic, smoothing, ratio, threshold, permanent water masking, noise
+reduction, slope masking and vectorisation) on local arrays or GeoTIFF files,
+so that cached scenes can be reprocessed without contacting Earth Engine.
+
+All inputs are expected on a common grid, described by a GDAL-style
+geotransform (x_origin, pixel_width, 0, y_origin, 0, -pixel_height).
+
+Compared with the Earth Engine path, outputs match within the tolerance given
+in EE_TOLERANCE: smoothed images agree to a relative tolerance of 1e-5, and
+flood masks agree on at least 99.5 % of the valid pixels (see
+check_smoothing and check_agreement). Differences are
+limited to pixels within one smoothing radius of the AOI or nodata borders,
+where Earth Engine resamples its inputs, and to pixels whose ratio lies
+within the relative tolerance of the threshold.
+"""
+import math
+
+import numpy as np
+import rasterio
+from rasterio import features
+from src.utils_components import remove_small_components
+from src.utils_speckle import get_speckle_filter
+from src.utils_static_masks import (
+    FLAT_BIT,
+    LAND_BIT,
+    build_static_mask,
+    get_static_mask_store,
+    grid_id,
+)
+from src.utils_tiling import run_array_tiles
+from src.utils_vectorise import vectorise_mask
+
+EE_TOLERANCE = {"rtol": 1e-5, "pixel_agreement": 0.995}
+
+
+def read_geotiff(path, band=1):
+    """
+    Read one band of a GeoTIFF file as a float array.
+
+    Nodata pixels are set to NaN.
+    Inputs:
+        path (str): Path to the GeoTIFF file.
+        band (int): Index of the band to read, starting from 1.
+
+    Returns:
+        data (np.ndarray): Band values as float32, with NaN for nodata.
+        transform (tuple): GDAL-style geotransform of the raster.
+        crs (str): Coordinate reference system of the raster.
+    """
+    with rasterio.open(path) as src:
+        data = src.read(band, masked=True).astype("float32")
+        transform = src.transform.to_gdal()
+        crs = src.crs.to_string() if src.crs else None
+    return data.filled(np.nan), transform, crs
+
+
+def _as_array(data, band=1):
+    """Return data as a float array, reading it first if it is a path."""
+    if isinstance(data, str):
+        return read_geotiff(data, band=band)[0]
+    return np.asarray(data, dtype="float32")
+
+
+def pixel_size_meters(transform, crs=None, shape=None):
+    """
+    Return the pixel size of a grid in meters.
+
+    For geographic coordinate systems the pixel width is converted to meters
+    at the latitude of the centre of the grid.
+    Inputs:
+        transform (tuple): GDAL-style geotransform of the grid.
+        crs (str): Coordinate reference system of the grid.
+        shape (tuple): Shape of the grid, used to find its centre.
+
+    Returns:
+        float: Pixel size in meters.
+    """
+    pixel_size = abs(transform[1])
+    if crs is not None and rasterio.crs.CRS.from_user_input(crs).is_geographic:
+        rows = shape[0] if shape is not None else 0
+        latitude = transform[3] + transform[5] * rows / 2
+        pixel_size *= 111320 * math.cos(math.radians(latitude))
+    return pixel_size
+
+
+def retrieve_image_collection(
+    scenes,
+    start_date,
+    end_date,
+    polarization="VH",
+    pass_direction="Ascending",
+):
+    """
+    Select local Sentinel-1 scenes matching the search criteria.
+
+    Scenes are dictionaries with the keys "date" (str, yyyy-mm-dd),
+    "pass_direction" (str) and one key per polarization (e.g. "VH"), holding
+    either an array or the path to a GeoTIFF file. As in Earth Engine, the
+    end date is exclusive.
+    Inputs:
+        scenes (list): Local Sentinel-1 scenes.
+        start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        polarization (str): Synthetic aperture radar polarization mode, e.g.,
+            'VH' or 'VV'.
+        pass_direction (str): Synthetic aperture radar pass direction, either
+            'Ascending' or 'Descending'.
+
+    Returns:
+        collection (list): Arrays of the matching scenes, sorted by date.
+    """
+    selected = sorted(
+        (
+            scene
+            for scene in scenes
+            if start_date <= scene["date"] < end_date
+            and scene["pass_direction"].upper() == pass_direction.upper()
+            and polarization in scene
+        ),
+        key=lambda scene: scene["date"],
+    )
+    return [_as_array(scene[polarization]) for scene in selected]
+
+
+def mosaic(collection, aoi_mask=None):
+    """
+    Create a mosaic of the images, the last valid pixel taking precedence.
+
+    Inputs:
+        collection (list): Arrays of the images, all with the same shape.
+        aoi_mask (np.ndarray): Boolean array, True inside the area of
+            interest. Pixels outside are set to NaN.
+
+    Returns:
+        mosaic_image (np.ndarray): The resulting mosaic.
+    """
+    if not collection:
+        raise ValueError("No image found for the selected dates.")
+    mosaic_image = np.full(collection[0].shape, np.nan, dtype="float32")
+    for image in collection:
+        valid = ~np.isnan(image)
+        mosaic_image[valid] = image[valid]
+    if aoi_mask is not None:
+        mosaic_image[~aoi_mask] = np.nan
+    return mosaic_image
+
+
+def smooth(
+    image, pixel_size=10, smoothing_radius=50, speckle_filter="focal_mean"
+):
+    """
+    Reduce the radar speckle by smoothing.
+
+    The filters ignore NaN pixels, as Earth Engine ignores masked pixels.
+    The default focal mean is computed with FFT convolution, so its cost
+    does not depend on the smoothing radius.
+    Inputs:
+        image (np.ndarray): Input image, NaN for nodata.
+        pixel_size (float): Pixel size in meters.
+        smoothing_radius (int): The radius in meters of the kernel to use for
+            smoothing.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+
+    Returns:
+        smoothed_image (np.ndarray): The resulting image after smoothing is
+            applied.
+    """
+    return get_speckle_filter(speckle_filter, "numpy")(
+        image, pixel_size, smoothing_radius
+    )
+
+
+def mask_permanent_water(image, surface_water):
+    """
+    Mask perennial water bodies (water > 10 months/yr).
+
+    Inputs:
+        image (np.ndarray): Input binary image.
+        surface_water (np.ndarray): Seasonality band of the JRC Global
+            Surface Water Mapping Layers, on the same grid as image.
+
+    Returns:
+        masked_image (np.ndarray): The resulting image after surface water
+        masking is applied.
+    """
+    with np.errstate(invalid="ignore"):
+        permanent_water = surface_water >= 10
+    return image & ~permanent_water
+
+
+def reduce_noise(image, min_connected_pixels=8):
+    """
+    Reduce noise in the image.
+
+    Remove groups of 8-connected flooded pixels smaller than
+    min_connected_pixels, as connectedPixelCount does in Earth Engine. The
+    mask is labelled once and the size of each group computed from its runs,
+    see utils_components.
+    Inputs:
+        image (np.ndarray): A binary image.
+        min_connected_pixels (int): Minimum size of a group of pixels.
+
+    Returns:
+        reduced_noise_image (np.ndarray): The resulting image after noise
+            reduction is applied.
+    """
+    return remove_small_components(image, min_connected_pixels, connectivity=8)
+
+
+def slope_degrees(dem, pixel_size=10):
+    """
+    Compute the terrain slope in degrees from a Digital Elevation Model.
+
+    As ee.Algorithms.Terrain, the slope is derived from the 4-connected
+    neighbours of each pixel.
+    Inputs:
+        dem (np.ndarray): Elevation in meters.
+        pixel_size (float): Pixel size in meters.
+
+    Returns:
+        slope (np.ndarray): Slope in degrees.
+    """
+    gradient_y, gradient_x = np.gradient(dem.astype("float64"), pixel_size)
+    return np.degrees(np.arctan(np.hypot(gradient_x, gradient_y)))
+
+
+def mask_slopes(image, dem, pixel_size=10, max_slope=5):
+    """
+    Mask out areas with more than 5 degrees slope.
+
+    Inputs:
+        image (np.ndarray): Input binary image.
+        dem (np.ndarray): Elevation in meters, on the same grid as image.
+        pixel_size (float): Pixel size in meters.
+        max_slope (float): Maximum slope in degrees.
+
+    Returns:
+         slopes_masked (np.ndarray): The resulting image after slope masking
+            is applied.
+    """
+    with np.errstate(invalid="ignore"):
+        flat = slope_degrees(dem, pixel_size) < max_slope
+    return image & flat
+
+
+def vectorise(image, transform):
+    """
+    Convert a binary flood raster into polygons.
+
+    Inputs:
+        image (np.ndarray): A binary image.
+        transform (tuple): GDAL-style geotransform of the image.
+
+    Returns:
+        flood_vectors (dict): GeoJSON FeatureCollection of the flooded
+            areas, with the same "label" property as reduceToVectors.
+    """
+    return vectorise_mask(image, transform, connectivity=4)
+
+
+def rasterise_aoi(aoi, shape, transform):
+    """
+    Convert an area of interest into a boolean mask on the grid.
+
+    Inputs:
+        aoi (dict): GeoJSON geometry of the area of interest, in the
+            coordinate reference system of the grid.
+        shape (tuple): Shape of the grid.
+        transform (tuple): GDAL-style geotransform of the grid.
+
+    Returns:
+        aoi_mask (np.ndarray): Boolean array, True inside the area.
+    """
+    return features.geometry_mask(
+        [aoi],
+        out_shape=shape,
+        transform=rasterio.Affine.from_gdal(*transform),
+        invert=True,
+    )
+
+
+def check_agreement(flood_raster, reference_raster, valid=None):
+    """
+    Compare a local flood raster with one exported from Earth Engine.
+
+    Inputs:
+        flood_raster (np.ndarray): Binary flood raster from this module.
+        reference_raster (np.ndarray): Binary flood raster from the Earth
+            Engine path, on the same grid.
+        valid (np.ndarray): Boolean array of the pixels to compare.
+
+    Returns:
+        agreement (float): Fraction of the valid pixels that agree.
+        within_tolerance (bool): Whether agreement meets EE_TOLERANCE.
+    """
+    if valid is None:
+        valid = np.ones(flood_raster.shape, dtype=bool)
+    matches = (flood_raster.astype(bool) == reference_raster.astype(bool))[
+        valid
+    ]
+    agreement = float(matches.mean()) if matches.size else 1.0
+    return agreement, agreement >= EE_TOLERANCE["pixel_agreement"]
+
+
+def check_smoothing(smoothed, reference_image, valid=None):
+    """
+    Compare a locally smoothed image with one exported from Earth Engine.
+
+    Inputs:
+        smoothed (np.ndarray): Smoothed image from this module.
+        reference_image (np.ndarray): Smoothed image from the Earth Engine
+            path, on the same grid.
+        valid (np.ndarray): Boolean array of the pixels to compare, by
+            default those valid in both images.
+
+    Returns:
+        relative_error (float): Largest relative difference over the valid
+            pixels.
+        within_tolerance (bool): Whether it meets EE_TOLERANCE.
+    """
+    smoothed = np.asarray(smoothed, dtype="float64")
+    reference_image = np.asarray(reference_image, dtype="float64")
+    if valid is None:
+        valid = ~np.isnan(smoothed) & ~np.isnan(reference_image)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        errors = np.abs(smoothed - reference_image) / np.abs(reference_image)
+    relative_error = float(errors[valid].max()) if valid.any() else 0.0
+    return relative_error, relative_error <= EE_TOLERANCE["rtol"]
+
+
+def derive_flood_ratio_local(
+    before_flood_img_col,
+    after_flood_img_col,
+    pixel_size=10,
+    aoi_mask=None,
+    speckle_filter="focal_mean",
+):
+    """
+    Derive the ratio of the filtered 'after' and 'before' images.
+
+    Inputs:
+        before_flood_img_col (list): Arrays of the 'before' scenes.
+        after_flood_img_col (list): Arrays of the 'after' scenes.
+        pixel_size (float): Pixel size in meters.
+        aoi_mask (np.ndarray): Boolean array, True inside the area of
+            interest.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+
+    Returns:
+        difference (np.ndarray): Ratio of the 'after' and 'before' images.
+        before_filtered (np.ndarray): The 'before' Sentinel-1 image.
+        after_filtered (np.ndarray): The 'after' Sentinel-1 image.
+    """
+    # Create a mosaic of selected tiles and clip to study area
+    before_mosaic = mosaic(before_flood_img_col, aoi_mask)
+    after_mosaic = mosaic(after_flood_img_col, aoi_mask)
+
+    before_filtered = smooth(
+        before_mosaic, pixel_size, speckle_filter=speckle_filter
+    )
+    after_filtered = smooth(
+        after_mosaic, pixel_size, speckle_filter=speckle_filter
+    )
+
+    # Calculate the difference between the before and after images
+    with np.errstate(divide="ignore", invalid="ignore"):
+        difference = after_filtered / before_filtered
+
+    return difference, before_filtered, after_filtered
+
+
+def classify_flood_ratio_local(
+    difference, static_mask, difference_threshold=1.25
+):
+    """
+    Threshold the ratio image and create the flood extent mask.
+
+    Permanent water is masked before the noise reduction and steep slopes
+    after it, as in the Earth Engine path, both from one static mask.
+    Inputs:
+        difference (np.ndarray): Ratio of the 'after' and 'before' images.
+        static_mask (np.ndarray): uint8 flags of land and flat pixels on the
+            same grid, see utils_static_masks.
+        difference_threshold (float): Threshold to be applied on the
+            differenced image (after flood - before flood).
+
+    Returns:
+        flood_rasters (np.ndarray): Detected flood extents as a binary raster.
+    """
+    with np.errstate(invalid="ignore"):
+        difference_binary = difference > difference_threshold
+    difference_binary_masked = difference_binary & (
+        static_mask & LAND_BIT != 0
+    )
+    difference_binary_masked_reduced_noise = reduce_noise(
+        difference_binary_masked
+    )
+    return difference_binary_masked_reduced_noise & (
+        static_mask & FLAT_BIT != 0
+    )
+
+
+def derive_flood_rasters_local(
+    before_flood_img_col,
+    after_flood_img_col,
+    static_mask,
+    pixel_size=10,
+    aoi_mask=None,
+    difference_threshold=1.25,
+    speckle_filter="focal_mean",
+):
+    """
+    Derive the binary flood raster and the filtered Sentinel-1 images.
+
+    Inputs:
+        before_flood_img_col (list): Arrays of the 'before' scenes.
+        after_flood_img_col (list): Arrays of the 'after' scenes.
+        static_mask (np.ndarray): uint8 flags of land and flat pixels on the
+            same grid, see utils_static_masks.
+        pixel_size (float): Pixel size in meters.
+        aoi_mask (np.ndarray): Boolean array, True inside the area of
+            interest.
+        difference_threshold (float): Threshold to be applied on the
+            differenced image (after flood - before flood).
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+
+    Returns:
+        flood_rasters (np.ndarray): Detected flood extents as a binary raster.
+        before_filtered (np.ndarray): The 'before' Sentinel-1 image.
+        after_filtered (np.ndarray): The 'after' Sentinel-1 image.
+    """
+    difference, before_filtered, after_filtered = derive_flood_ratio_local(
+        before_flood_img_col,
+        after_flood_img_col,
+        pixel_size,
+        aoi_mask,
+        speckle_filter=speckle_filter,
+    )
+    flood_rasters = classify_flood_ratio_local(
+        difference, static_mask, difference_threshold
+    )
+
+    return flood_rasters, before_filtered, after_filtered
+
+
+def tile_halo(pixel_size=10, smoothing_radius=50, min_connected_pixels=8):
+    """
+    Return the halo in pixels needed around a tile to avoid seams.
+
+    The halo covers the smoothing kernel, the largest group of pixels that
+    reduce_noise can remove, and the neighbours used for the slope.
+    Inputs:
+        pixel_size (float): Pixel size in meters.
+        smoothing_radius (int): Radius of the smoothing kernel in meters.
+        min_connected_pixels (int): Minimum size of a group of pixels.
+
+    Returns:
+        int: Halo in pixels.
+    """
+    return (
+        int(math.ceil(smoothing_radius / pixel_size))
+        + min_connected_pixels
+        + 1
+    )
+
+
+def get_local_static_mask(local_inputs, pixel_size=10, shape=None):
+    """
+    Return the static mask of local inputs.
+
+    If local_inputs has a "static_mask_dir", the mask built from the
+    surface water and the DEM is stored there once per grid and reused by
+    later runs on the same grid (see utils_static_masks.StaticMaskStore).
+    Inputs:
+        local_inputs (dict): Local data, with either "static_mask" or
+            "surface_water" and "dem", see derive_flood_extents_local.
+        pixel_size (float): Pixel size in meters.
+        shape (tuple): Shape of the grid, needed with a "static_mask_dir".
+
+    Returns:
+        static_mask (np.ndarray): uint8 flags of land and flat pixels, see
+            utils_static_masks.
+    """
+    static_mask = local_inputs.get("static_mask")
+    if static_mask is not None:
+        return _as_array(static_mask).astype("uint8")
+
+    def build():
+        return build_static_mask(
+            _as_array(local_inputs["surface_water"]),
+            _as_array(local_inputs["dem"]),
+            pixel_size,
+        )
+
+    directory = local_inputs.get("static_mask_dir")
+    if directory is None:
+        return build()
+    if shape is None:
+        raise ValueError("The shape of the grid is needed to store its mask")
+    cell = grid_id(local_inputs["transform"], shape, local_inputs.get("crs"))
+    return get_static_mask_store(directory).get(cell, build)
+
+
+def derive_flood_extents_local(
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    local_inputs,
+    difference_threshold=1.25,
+    polarization="VH",
+    pass_direction="Ascending",
+    tile_size_km=None,
+    max_workers=4,
+    speckle_filter="focal_mean",
+):
+    """
+    Derive flood extents from local Sentinel-1 scenes.
+
+    Inputs:
+        aoi (dict or np.ndarray): GeoJSON geometry of the area of interest in
+            the coordinate reference system of the grid, or a boolean mask.
+            If None, the whole grid is processed.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        local_inputs (dict): Local data on a common grid, with the keys
+            "scenes" (see retrieve_image_collection), "transform"
+            (GDAL-style geotransform), optionally "crs", and either
+            "static_mask" (precomputed, see utils_static_masks) or
+            "surface_water" (JRC seasonality) and "dem" (elevation in
+            meters), and optionally "static_mask_dir" to store the mask
+            built from them, see get_local_static_mask. Rasters are arrays
+            or paths to GeoTIFF files.
+        difference_threshold (float): Threshold to be applied on the
+            differenced image (after flood - before flood).
+        polarization (str): Synthetic aperture radar polarization mode.
+        pass_direction (str): Synthetic aperture radar pass direction.
+        tile_size_km (float): If set, the grid is processed in tiles of this
+            size on a pool of threads, with a halo that avoids seams.
+        max_workers (int): Maximum number of tiles processed concurrently.
+        speckle_filter (str): Name of the speckle filter, see
+            utils_speckle.SPECKLE_FILTERS.
+
+    Returns:
+        flood_vectors (dict): Detected flood extents as a GeoJSON
+            FeatureCollection.
+        flood_rasters (np.ndarray): Detected flood extents as a binary raster.
+        before_filtered (np.ndarray): The 'before' Sentinel-1 image.
+        after_filtered (np.ndarray): The 'after' Sentinel-1 image containing
+            view of the flood waters.
+    """
+    transform = local_inputs["transform"]
+    before_flood_img_col = retrieve_image_collection(
+        local_inputs["scenes"],
+        start_date=before_start_date,
+        end_date=before_end_date,
+        polarization=polarization,
+        pass_direction=pass_direction,
+    )
+    after_flood_img_col = retrieve_image_collection(
+        local_inputs["scenes"],
+        start_date=after_start_date,
+        end_date=after_end_date,
+        polarization=polarization,
+        pass_direction=pass_direction,
+    )
+    if not before_flood_img_col or not after_flood_img_col:
+        raise ValueError("No image found for the selected dates.")
+    shape = before_flood_img_col[0].shape
+    pixel_size = pixel_size_meters(transform, local_inputs.get("crs"), shape)
+    static_mask = get_local_static_mask(local_inputs, pixel_size, shape)
+
+    if aoi is None:
+        aoi_mask = np.ones(shape, dtype=bool)
+    elif isinstance(aoi, np.ndarray):
+        aoi_mask = aoi
+    else:
+        aoi_mask = rasterise_aoi(aoi, shape, transform)
+
+    def compute_window(window):
+        return derive_flood_rasters_local(
+            [image[window] for image in before_flood_img_col],
+            [image[window] for image in after_flood_img_col],
+            static_mask[window],
+            pixel_size=pixel_size,
+            aoi_mask=aoi_mask[window],
+            difference_threshold=difference_threshold,
+            speckle_filter=speckle_filter,
+        )
+
+    if tile_size_km:
+        flood_rasters, before_filtered, after_filtered = run_array_tiles(
+            compute_window,
+            shape,
+            tile_size=max(int(tile_size_km * 1000 / pixel_size), 1),
+            halo=tile_halo(pixel_size),
+            max_workers=max_workers,
+        )
+    else:
+        flood_rasters, before_filtered, after_filtered = compute_window(
+            (slice(None), slice(None))
+        )
+    flood_vectors = vectorise(flood_rasters, transform)
+
+    return flood_vectors, flood_rasters, before_filtered, after_filtered
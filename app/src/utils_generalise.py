@@ -0,0 +1,528 @@
+"""Generalisation of flood polygons: simplification and quantisation.
+
+Polygons traced along pixel edges (by reduceToVectors or utils_vectorise)
+follow every step of the pixel grid, so their vertex count grows with the
+resolution. They are generalised in three steps:
+
+- the coordinates are quantised on a grid of a fixed step, so that the
+  vertices shared by several rings are equal;
+- the rings are split into arcs at the junctions, the vertices where rings
+  meet or part, and the arcs shared by several rings are stored once, as in
+  TopoJSON;
+- each arc is simplified with the Douglas-Peucker algorithm, keeping its
+  ends, so that neighbouring polygons keep a common boundary and touching
+  polygons still touch.
+
+Rings that collapse at a tolerance are dropped, with their polygon for an
+exterior ring. The arcs of a polygon that becomes invalid, e.g. when two of
+its arcs cross, are simplified again with a smaller tolerance; crossings
+between different polygons are not checked. Each consumer picks a level of
+detail, see LEVELS_OF_DETAIL, and the outputs can be encoded as GeoJSON or
+TopoJSON, whose arcs are stored as integer deltas on the grid.
+"""
+import json
+import math
+
+import numpy as np
+import shapely
+from src.utils_tiling import METERS_PER_DEGREE
+
+# Tolerance of the simplification in meters for each consumer: analytics
+# only drops the collinear vertices, downloads drop the steps of a 10 m
+# pixel, and the map drops those below the resolution of a typical zoom
+LEVELS_OF_DETAIL = {"analytics": 0.0, "download": 10.0, "display": 30.0}
+
+# Step of the quantisation grid, in the units of the coordinates (about
+# 0.1 m for degrees)
+DEFAULT_QUANTUM = 1e-6
+
+# Length of the equator, the width of the Web Mercator map at zoom 0, in
+# meters
+EARTH_CIRCUMFERENCE = 40075016.686
+
+
+def tolerance_for_zoom(zoom, tile_size=256):
+    """
+    Return the tolerance matching the resolution of a zoom level.
+
+    Inputs:
+        zoom (int): Zoom level of a Web Mercator map.
+        tile_size (int): Size of the tiles in pixels.
+
+    Returns:
+        float: Half the size of a pixel at the equator, in meters.
+    """
+    return EARTH_CIRCUMFERENCE / (tile_size * 2**zoom) / 2
+
+
+def count_vertices(flood_vectors):
+    """Return the number of positions of a GeoJSON FeatureCollection."""
+    count = 0
+    for feature in flood_vectors["features"]:
+        geometry = feature["geometry"]
+        polygons = (
+            geometry["coordinates"]
+            if geometry["type"] == "MultiPolygon"
+            else [geometry["coordinates"]]
+        )
+        count += sum(len(ring) for rings in polygons for ring in rings)
+    return count
+
+
+def payload_bytes(data):
+    """Return the size of a dictionary encoded as compact JSON."""
+    return len(json.dumps(data, separators=(",", ":")))
+
+
+def _polygons(flood_vectors):
+    """Yield the rings and properties of each polygon of a collection."""
+    for feature in flood_vectors["features"]:
+        geometry = feature["geometry"]
+        if geometry["type"] == "Polygon":
+            yield geometry["coordinates"], feature.get("properties") or {}
+        elif geometry["type"] == "MultiPolygon":
+            for rings in geometry["coordinates"]:
+                yield rings, feature.get("properties") or {}
+
+
+def _canonical_arc(arc):
+    """Return an arc in the direction shared by its copies, and the sign."""
+    if arc[0] > arc[-1] or (arc[0] == arc[-1] and arc[1] > arc[-2]):
+        return arc[::-1], True
+    return arc, False
+
+
+def build_topology(flood_vectors, quantum=DEFAULT_QUANTUM):
+    """
+    Quantise polygons and split their rings into shared arcs.
+
+    A vertex is a junction if it has different neighbours in two of the
+    rings passing through it. Rings are cut at their junctions, and arcs
+    with the same vertices, in either direction, are stored once; rings
+    without junctions are stored as closed arcs starting at their smallest
+    vertex.
+    Inputs:
+        flood_vectors (dict): GeoJSON FeatureCollection of polygons or
+            multipolygons, e.g. from utils_vectorise.vectorise_mask.
+        quantum (float): Step of the quantisation grid, in the units of the
+            coordinates.
+
+    Returns:
+        topology (dict): "vertices" (integer grid positions, shape (n, 2)),
+            "arcs" (vertex indices of each arc), "polygons" (rings of each
+            polygon as arc references, ~i for arc i reversed),
+            "properties" of each polygon and the grid "quantum" and
+            "translate".
+    """
+    rings, ring_polygon, properties = [], [], []
+    for polygon_rings, polygon_properties in _polygons(flood_vectors):
+        for ring in polygon_rings:
+            rings.append(np.asarray(ring, dtype="float64")[:-1])
+            ring_polygon.append(len(properties))
+        properties.append(polygon_properties)
+    topology = {
+        "vertices": np.empty((0, 2), dtype="int64"),
+        "arcs": [],
+        "polygons": [[] for _ in properties],
+        "properties": properties,
+        "quantum": quantum,
+        "translate": (0.0, 0.0),
+    }
+    if not rings:
+        return topology
+
+    coordinates = np.concatenate(rings)
+    translate = np.floor(coordinates.min(axis=0) / quantum) * quantum
+    grid = np.rint((coordinates - translate) / quantum).astype("int64")
+    vertices, vertex_ids = np.unique(grid, axis=0, return_inverse=True)
+    vertex_ids = vertex_ids.ravel()
+    topology["vertices"] = vertices
+    topology["translate"] = tuple(translate.tolist())
+
+    # Drop the consecutive duplicates created by the quantisation
+    lengths = np.array([len(ring) for ring in rings])
+    ring_of = np.repeat(np.arange(len(rings)), lengths)
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    previous = np.arange(vertex_ids.size) - 1
+    previous[starts] = starts + lengths - 1
+    keep = vertex_ids != vertex_ids[previous]
+    vertex_ids, ring_of = vertex_ids[keep], ring_of[keep]
+    lengths = np.bincount(ring_of, minlength=len(rings))
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+
+    # Neighbours of each occurrence of a vertex along its ring
+    position = np.arange(vertex_ids.size) - starts[ring_of]
+    length = lengths[ring_of]
+    before = vertex_ids[starts[ring_of] + (position - 1) % length]
+    after = vertex_ids[starts[ring_of] + (position + 1) % length]
+    n_vertices = len(vertices)
+    pairs = np.minimum(before, after) * n_vertices + np.maximum(before, after)
+    order = np.lexsort((pairs, vertex_ids))
+    sorted_ids, sorted_pairs = vertex_ids[order], pairs[order]
+    differs = (sorted_ids[1:] == sorted_ids[:-1]) & (
+        sorted_pairs[1:] != sorted_pairs[:-1]
+    )
+    junction = np.zeros(n_vertices, dtype=bool)
+    junction[sorted_ids[1:][differs]] = True
+
+    arc_index = {}
+    ends = starts + lengths
+    for ring_id, (start, end) in enumerate(zip(starts, ends)):
+        ring, count = vertex_ids[start:end], end - start
+        rings_of_polygon = topology["polygons"][ring_polygon[ring_id]]
+        if count < 3:
+            # A ring collapsed by the quantisation; without its exterior
+            # ring, a polygon is dropped
+            if not rings_of_polygon:
+                rings_of_polygon.append(None)
+            continue
+        cuts = np.nonzero(junction[ring])[0]
+        if cuts.size == 0:
+            # Closed arc, from its smallest vertex
+            ring = np.roll(ring, -int(ring.argmin()))
+            pieces = [np.r_[ring, ring[0]]]
+        else:
+            ring = np.roll(ring, -int(cuts[0]))
+            cuts = np.r_[cuts - cuts[0], count]
+            closed = np.r_[ring, ring[0]]
+            pieces = [
+                closed[first:stop]
+                for first, stop in zip(cuts[:-1], cuts[1:] + 1)
+            ]
+        references = []
+        for piece in pieces:
+            arc, reversed_ = _canonical_arc(piece)
+            key = arc.tobytes()
+            index = arc_index.get(key)
+            if index is None:
+                index = arc_index[key] = len(topology["arcs"])
+                topology["arcs"].append(arc)
+            references.append(~index if reversed_ else index)
+        rings_of_polygon.append(references)
+    topology["polygons"] = [
+        [] if not rings or rings[0] is None else rings
+        for rings in topology["polygons"]
+    ]
+    return topology
+
+
+def _ring_coordinates(arcs, references):
+    """Join the arcs of a ring into a closed array of grid positions."""
+    parts = []
+    for reference in references:
+        arc = arcs[~reference][::-1] if reference < 0 else arcs[reference]
+        parts.append(arc if not parts else arc[1:])
+    return np.concatenate(parts)
+
+
+def _ring_is_valid(ring):
+    """Check that a closed ring has at least three vertices and an area."""
+    if len(ring) < 4:
+        return False
+    x, y = ring[:, 0], ring[:, 1]
+    return bool(np.dot(x[:-1], y[1:]) != np.dot(x[1:], y[:-1]))
+
+
+def _build_polygon(arcs, rings):
+    """
+    Build the shapely polygon of rings of arcs.
+
+    Returns the polygon and its rings without the collapsed holes, or None
+    and no rings if the exterior ring collapsed.
+    """
+    exterior = _ring_coordinates(arcs, rings[0])
+    if not _ring_is_valid(exterior):
+        return None, []
+    kept, holes = [rings[0]], []
+    for references in rings[1:]:
+        hole = _ring_coordinates(arcs, references)
+        if _ring_is_valid(hole):
+            kept.append(references)
+            holes.append(hole)
+    return shapely.Polygon(exterior, holes), kept
+
+
+def _simplify_arcs(arcs, tolerances):
+    """Simplify arcs of grid positions, each with its own tolerance."""
+    lines = shapely.simplify(
+        shapely.linestrings(
+            np.concatenate(arcs).astype("float64"),
+            indices=np.repeat(
+                np.arange(len(arcs)), [len(arc) for arc in arcs]
+            ),
+        ),
+        tolerances,
+        preserve_topology=False,
+    )
+    return [
+        np.rint(shapely.get_coordinates(line)).astype("int64")
+        for line in lines
+    ]
+
+
+def simplify_topology(topology, tolerance):
+    """
+    Simplify the arcs of a topology with the Douglas-Peucker algorithm.
+
+    Each arc is simplified once, whatever the number of rings it belongs
+    to, and keeps its ends, so shared boundaries stay shared. A tolerance
+    of 0 only drops the collinear vertices. The arcs of the polygons made
+    invalid by the simplification are simplified again with half the
+    tolerance, down to their full detail, until the polygons are valid.
+    Inputs:
+        topology (dict): Topology, see build_topology.
+        tolerance (float): Largest distance between an arc and its
+            simplification, in the units of the coordinates.
+
+    Returns:
+        topology (dict): Topology with the simplified arcs, without the
+            polygons and holes collapsed below the tolerance.
+    """
+    original = [topology["vertices"][arc] for arc in topology["arcs"]]
+    if not original:
+        return dict(topology, arcs=[])
+    # Tolerance of each arc, in steps of the grid
+    tolerances = np.full(len(original), tolerance / topology["quantum"])
+    arcs = _simplify_arcs(original, tolerances)
+
+    built = [
+        _build_polygon(arcs, rings) if rings else (None, [])
+        for rings in topology["polygons"]
+    ]
+    # Polygons invalid in the input are left as they are
+    valid_input = {}
+    while True:
+        polygons = np.array([polygon for polygon, _ in built], dtype=object)
+        relaxed = set()
+        for i in np.nonzero(
+            (polygons != None) & ~shapely.is_valid(polygons)  # noqa: E711
+        )[0]:
+            rings = topology["polygons"][i]
+            if i not in valid_input:
+                valid_input[i] = _build_polygon(original, rings)[0].is_valid
+            if valid_input[i]:
+                relaxed.update(
+                    index
+                    for ring in rings
+                    for index in (
+                        max(reference, ~reference) for reference in ring
+                    )
+                    if tolerances[index] > 0
+                )
+        if not relaxed:
+            break
+        relaxed = sorted(relaxed)
+        # Below half a step of the grid, arcs keep their full detail
+        tolerances[relaxed] /= 2
+        tolerances[tolerances < 0.5] = 0
+        for index, arc in zip(
+            relaxed,
+            _simplify_arcs(
+                [original[i] for i in relaxed], tolerances[relaxed]
+            ),
+        ):
+            arcs[index] = arc
+        relaxed = set(relaxed)
+        built = [
+            _build_polygon(arcs, rings)
+            if polygon is not None
+            and any(
+                max(reference, ~reference) in relaxed
+                for ring in rings
+                for reference in ring
+            )
+            else (polygon, kept)
+            for (polygon, kept), rings in zip(built, topology["polygons"])
+        ]
+
+    kept = [
+        (rings, properties)
+        for (polygon, rings), properties in zip(built, topology["properties"])
+        if polygon is not None
+    ]
+    return dict(
+        topology,
+        arcs=arcs,
+        polygons=[rings for rings, _ in kept],
+        properties=[properties for _, properties in kept],
+    )
+
+
+def _digits(quantum):
+    """Return the number of decimals of the positions of a grid."""
+    return max(0, math.ceil(-math.log10(quantum)))
+
+
+def topology_to_geojson(topology):
+    """
+    Convert a topology into a GeoJSON FeatureCollection of polygons.
+
+    Each polygon is a feature, including the parts of multipolygons.
+    Inputs:
+        topology (dict): Topology, see build_topology.
+
+    Returns:
+        flood_vectors (dict): GeoJSON FeatureCollection, with the
+            coordinates rounded to the quantisation grid.
+    """
+    quantum, digits = topology["quantum"], _digits(topology["quantum"])
+    translate = np.asarray(topology["translate"])
+    features = []
+    for rings, properties in zip(topology["polygons"], topology["properties"]):
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [
+                        np.round(
+                            _ring_coordinates(topology["arcs"], references)
+                            * quantum
+                            + translate,
+                            digits,
+                        ).tolist()
+                        for references in rings
+                    ],
+                },
+                "properties": properties,
+            }
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def topology_to_topojson(topology, name="flood_extent"):
+    """
+    Encode a topology as TopoJSON with quantised, delta-encoded arcs.
+
+    Only the arcs used by the remaining polygons are written.
+    Inputs:
+        topology (dict): Topology, see build_topology.
+        name (str): Name of the object of the polygons.
+
+    Returns:
+        topojson (dict): TopoJSON Topology.
+    """
+    used = sorted(
+        {
+            reference if reference >= 0 else ~reference
+            for rings in topology["polygons"]
+            for ring in rings
+            for reference in ring
+        }
+    )
+    new_index = {index: i for i, index in enumerate(used)}
+
+    def renumber(reference):
+        if reference >= 0:
+            return new_index[reference]
+        return ~new_index[~reference]
+
+    arcs = [topology["arcs"][index] for index in used]
+    quantum = topology["quantum"]
+    translate = list(topology["translate"])
+    topojson = {
+        "type": "Topology",
+        "transform": {"scale": [quantum, quantum], "translate": translate},
+        "objects": {
+            name: {
+                "type": "GeometryCollection",
+                "geometries": [
+                    {
+                        "type": "Polygon",
+                        "arcs": [
+                            [renumber(reference) for reference in ring]
+                            for ring in rings
+                        ],
+                        "properties": properties,
+                    }
+                    for rings, properties in zip(
+                        topology["polygons"], topology["properties"]
+                    )
+                ],
+            }
+        },
+        "arcs": [
+            np.diff(arc, axis=0, prepend=[[0, 0]]).tolist() for arc in arcs
+        ],
+    }
+    if arcs:
+        positions = np.concatenate(arcs)
+        low = positions.min(axis=0) * quantum + translate
+        high = positions.max(axis=0) * quantum + translate
+        topojson["bbox"] = np.round(
+            np.r_[low, high], _digits(quantum)
+        ).tolist()
+    return topojson
+
+
+def _reduction(value, total):
+    """Return the relative reduction from a total to a value."""
+    return 1 - value / total if total else 0.0
+
+
+def generalise(
+    flood_vectors,
+    levels=None,
+    quantum=DEFAULT_QUANTUM,
+    meters_per_unit=METERS_PER_DEGREE,
+    topojson=False,
+):
+    """
+    Simplify and quantise polygons at several levels of detail.
+
+    The topology is built once and simplified at each tolerance.
+    Inputs:
+        flood_vectors (dict): GeoJSON FeatureCollection of polygons.
+        levels (dict): Tolerance in meters of each level of detail, by
+            name; by default LEVELS_OF_DETAIL.
+        quantum (float): Step of the quantisation grid, in the units of the
+            coordinates.
+        meters_per_unit (float): Meters per unit of the coordinates, to
+            convert the tolerances; by default for degrees of latitude,
+            which overestimates the tolerance across meridians.
+        topojson (bool): If True, the levels are also encoded as TopoJSON.
+
+    Returns:
+        outputs (dict): For each level, the GeoJSON FeatureCollection
+            ("geojson") and, if requested, the TopoJSON ("topojson").
+        report (dict): Number of features, vertices and bytes of the input
+            ("input") and of each level, with the reduction of the vertices
+            and of the GeoJSON and TopoJSON payloads.
+    """
+    if levels is None:
+        levels = LEVELS_OF_DETAIL
+    topology = build_topology(flood_vectors, quantum=quantum)
+    vertices, geojson_bytes = (
+        count_vertices(flood_vectors),
+        payload_bytes(flood_vectors),
+    )
+    report = {
+        "input": {
+            "features": len(flood_vectors["features"]),
+            "vertices": vertices,
+            "geojson_bytes": geojson_bytes,
+        }
+    }
+    outputs = {}
+    for name, tolerance in levels.items():
+        simplified = simplify_topology(topology, tolerance / meters_per_unit)
+        outputs[name] = {"geojson": topology_to_geojson(simplified)}
+        row = {
+            "tolerance_m": tolerance,
+            "features": len(simplified["polygons"]),
+            "vertices": count_vertices(outputs[name]["geojson"]),
+            "geojson_bytes": payload_bytes(outputs[name]["geojson"]),
+        }
+        if topojson:
+            outputs[name]["topojson"] = topology_to_topojson(simplified)
+            row["topojson_bytes"] = payload_bytes(outputs[name]["topojson"])
+        row["vertices_reduction"] = _reduction(row["vertices"], vertices)
+        row["geojson_reduction"] = _reduction(
+            row["geojson_bytes"], geojson_bytes
+        )
+        if topojson:
+            row["topojson_reduction"] = _reduction(
+                row["topojson_bytes"], geojson_bytes
+            )
+        report[name] = row
+    return outputs, report
@@ -0,0 +1,158 @@
+"""Deferred imports and import-time profiling.
+
+Modules that are slow to import (ee, scipy.signal, ...) are bound with
+lazy_import, so that the pages render before they are needed: the module is
+imported on the first access to one of its attributes, e.g. the first Earth
+Engine call of a run. ImportProfiler times the imports of a process, as
+`python -X importtime` does, and is used by profile_startup.py.
+"""
+import builtins
+import importlib
+import importlib.util
+import sys
+import time
+import types
+
+from src.utils_metrics import span
+
+
+class LazyModule(types.ModuleType):
+    """Proxy of a module, imported on the first access to an attribute."""
+
+    def __getattr__(self, attribute):
+        """Import the module if needed and return one of its attributes."""
+        module = self.__dict__.get("_module")
+        if module is None:
+            with span("import", module=self.__name__):
+                module = importlib.import_module(self.__name__)
+            self.__dict__["_module"] = module
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        """Show whether the module was imported."""
+        state = "imported" if self.__dict__.get("_module") else "deferred"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Return a module that is imported on first use.
+
+    If the module was already imported, it is returned as is.
+    Inputs:
+        name (str): Full name of the module, e.g. 'scipy.ndimage'.
+
+    Returns:
+        module: The module, or a LazyModule standing for it.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+class ImportProfiler:
+    """
+    Time the imports of a process.
+
+    Each import of a module not imported yet is timed, including the modules
+    it imports itself ("seconds") and excluding them ("self_seconds"). Only
+    the thread that installs the profiler should import while it is
+    installed.
+    """
+
+    def __init__(self):
+        """Create a profiler, not installed yet."""
+        self.records = []
+        self._children = []
+        self._original_import = None
+
+    def install(self):
+        """Start timing the imports."""
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        """Stop timing the imports."""
+        builtins.__import__ = self._original_import
+
+    def __enter__(self):
+        """Start timing the imports."""
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        """Stop timing the imports."""
+        self.uninstall()
+        return False
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        """Import a module as __import__ does, timing new modules."""
+        module_name = name
+        if level:
+            try:
+                package = (globals or {}).get("__package__") or ""
+                module_name = importlib.util.resolve_name(
+                    "." * level + name, package
+                )
+            except (ImportError, ValueError):
+                pass
+        if module_name in sys.modules:
+            return self._original_import(
+                name, globals, locals, fromlist, level
+            )
+        self._children.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original_import(
+                name, globals, locals, fromlist, level
+            )
+        finally:
+            seconds = time.perf_counter() - start
+            children = self._children.pop()
+            if self._children:
+                self._children[-1] += seconds
+            self.records.append(
+                {
+                    "module": module_name,
+                    "seconds": seconds,
+                    "self_seconds": seconds - children,
+                    "depth": len(self._children),
+                }
+            )
+
+    def report(self, top=None):
+        """
+        Return the slowest imports.
+
+        Inputs:
+            top (int): Number of modules to return, all if None.
+
+        Returns:
+            records (list): "module", "seconds", "self_seconds" and "depth"
+                (0 for the modules imported directly) of each import, the
+                slowest first.
+        """
+        records = sorted(
+            self.records, key=lambda record: record["seconds"], reverse=True
+        )
+        return records[:top] if top else records
+
+
+def format_import_report(records):
+    """
+    Format the records of ImportProfiler.report as a table.
+
+    Inputs:
+        records (list): Records of ImportProfiler.report.
+
+    Returns:
+        str: One line per module, with times in milliseconds.
+    """
+    lines = [f"{'total ms':>10}{'self ms':>10}  module"]
+    for record in records:
+        lines.append(
+            f"{record['seconds'] * 1000:>10.1f}"
+            f"{record['self_seconds'] * 1000:>10.1f}  "
+            f"{'  ' * record['depth']}{record['module']}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,138 @@
+"""Folium elements of the output map."""
+import folium
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from jinja2 import Template
+
+# Style of the flood polygons in the vector tiles
+FLOOD_VECTOR_STYLE = {
+    "fill": True,
+    "fillColor": "#0000ff",
+    "fillOpacity": 0.3,
+    "color": "#0000ff",
+    "weight": 1,
+}
+
+# Style of the flood polygons rendered by Earth Engine, as in geemap
+EE_VECTOR_STYLE = {"color": "000000", "width": 2, "fill_opacity": 0.5}
+
+
+class VectorGridProtobuf(JSCSSMixin, Layer):
+    """Layer of Mapbox Vector Tiles, drawn with Leaflet.VectorGrid."""
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.vectorGrid.protobuf(
+                {{ this.url|tojson }},
+                {{ this.options|tojson }}
+            ).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """
+    )
+
+    default_js = [
+        (
+            "leaflet.vectorgrid",
+            "https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/"
+            "Leaflet.VectorGrid.bundled.min.js",
+        )
+    ]
+
+    def __init__(
+        self,
+        url,
+        name=None,
+        layer_name="flood_extent",
+        style=None,
+        max_native_zoom=18,
+        overlay=True,
+        control=True,
+        show=True,
+    ):
+        """
+        Create the layer.
+
+        The browser requests the tiles of the current view only, as for
+        raster tiles, instead of receiving all the polygons at once.
+        Inputs:
+            url (str): URL template of the tiles, with {z}, {x} and {y},
+                e.g. from utils_tiles.TileServer.add_vectors.
+            name (str): Name of the layer in the layer control.
+            layer_name (str): Name of the layer in the tiles.
+            style (dict): Leaflet path options of the polygons.
+            max_native_zoom (int): Zoom of the most detailed tiles; tiles
+                are scaled above it.
+            overlay (bool): Whether the layer is an overlay.
+            control (bool): Whether the layer is in the layer control.
+            show (bool): Whether the layer is shown when the map opens.
+        """
+        super().__init__(
+            name=name, overlay=overlay, control=control, show=show
+        )
+        self._name = "VectorGridProtobuf"
+        self.url = url
+        self.options = {
+            "vectorTileLayerStyles": {layer_name: style or FLOOD_VECTOR_STYLE},
+            "maxNativeZoom": max_native_zoom,
+        }
+
+
+def ee_tile_url(ee_object, vis_params=None):
+    """
+    Request the map id of an Earth Engine object and return its tile URL.
+
+    Feature collections are drawn as their outline over a translucent fill,
+    as geemap does, since Earth Engine only serves tiles of images.
+    Inputs:
+        ee_object (ee.Image or ee.FeatureCollection): Object to draw.
+        vis_params (dict): Visualisation parameters of images, see
+            ee.Image.getMapId.
+
+    Returns:
+        str: URL template of the tiles, with {z}, {x} and {y}.
+    """
+    # Imported here, as the map only needs Earth Engine for its layers
+    import ee
+
+    if isinstance(ee_object, ee.FeatureCollection):
+        fill = ee_object.style(fillColor=EE_VECTOR_STYLE["color"]).updateMask(
+            ee.Image.constant(EE_VECTOR_STYLE["fill_opacity"])
+        )
+        outline = ee_object.style(
+            color=EE_VECTOR_STYLE["color"],
+            fillColor="00000000",
+            width=EE_VECTOR_STYLE["width"],
+        )
+        ee_object, vis_params = fill.blend(outline), None
+    map_id = ee_object.getMapId(vis_params or {})
+    return map_id["tile_fetcher"].url_format
+
+
+def add_tile_layers(output_map, layers):
+    """
+    Add tile layers to a map.
+
+    Inputs:
+        output_map (folium.Map): Map, e.g. a geemap.foliumap.Map.
+        layers (list): Layers as dictionaries with their "name", "url" (URL
+            template of the tiles), "attribution" and "type": "tiles" for
+            image tiles, or "vector_tiles" for Mapbox Vector Tiles.
+
+    Returns:
+        output_map (folium.Map): The map.
+    """
+    for layer in layers:
+        if layer["type"] == "vector_tiles":
+            VectorGridProtobuf(layer["url"], name=layer["name"]).add_to(
+                output_map
+            )
+        else:
+            folium.TileLayer(
+                tiles=layer["url"],
+                name=layer["name"],
+                attr=layer["attribution"],
+                overlay=True,
+                max_native_zoom=18,
+            ).add_to(output_map)
+    return output_map
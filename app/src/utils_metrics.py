@@ -0,0 +1,365 @@
+"""Spans and counters recorded across the pipeline and the app.
+
+Instrumentation is off unless the FLOOD_METRICS environment variable is set,
+to "log" (one JSON record per span on stderr, or appended to the file given
+in FLOOD_METRICS_LOG), "http" (totals served on a local /metrics endpoint,
+see serve_metrics) or "log,http". When it is off, span returns a shared
+object that does nothing and increment returns at once, so instrumented code
+runs at the same speed.
+
+Metrics recorded by the app:
+    spans: duration of the stages, e.g. "derive_flood_extents" or
+        "page.center_object", with the errors raised inside them.
+    ee_requests{kind}: requests sent to Earth Engine (getInfo,
+        startProcessing, getTaskStatus, getDownloadUrl).
+    bytes_downloaded: bytes received by utils_download.
+    cache_requests{cache, result}: hits and misses of the caches.
+    errors{stage}: errors handled without raising.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Instrumentation mode, e.g. "log,http"; empty to disable it
+MODES = {
+    mode.strip()
+    for mode in os.environ.get("FLOOD_METRICS", "").lower().split(",")
+    if mode.strip()
+}
+ENABLED = bool(MODES)
+
+# Local address of the /metrics endpoint
+METRICS_HOST = os.environ.get("FLOOD_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("FLOOD_METRICS_PORT", "9464"))
+
+logger = logging.getLogger(__name__)
+
+# Name of the span being run, recorded as the parent of nested spans
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def _configure_logger():
+    """Write the JSON records to stderr or to FLOOD_METRICS_LOG."""
+    path = os.environ.get("FLOOD_METRICS_LOG")
+    handler = (
+        logging.FileHandler(path)
+        if path
+        else logging.StreamHandler(sys.stderr)
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+if "log" in MODES:
+    _configure_logger()
+
+
+class MetricsRegistry:
+    """Thread-safe totals of the spans and counters of a process."""
+
+    def __init__(self):
+        """Create an empty registry."""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all totals."""
+        with self._lock:
+            self._counters = {}
+            self._spans = {}
+
+    def increment(self, name, value=1, labels=None):
+        """
+        Add a value to a counter.
+
+        Inputs:
+            name (str): Name of the counter.
+            value (float): Value to add.
+            labels (dict): Labels of the counter, e.g. {"kind": "getInfo"}.
+        """
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, error=False):
+        """
+        Add the duration of a span.
+
+        Inputs:
+            name (str): Name of the span.
+            seconds (float): Duration in seconds.
+            error (bool): Whether the span raised an exception.
+        """
+        with self._lock:
+            totals = self._spans.setdefault(
+                name,
+                {"count": 0, "seconds": 0.0, "max_seconds": 0.0, "errors": 0},
+            )
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["max_seconds"] = max(totals["max_seconds"], seconds)
+            totals["errors"] += int(error)
+
+    def snapshot(self):
+        """
+        Return a copy of the totals.
+
+        Returns:
+            dict: "counters", a list of {"name", "labels", "value"}, and
+                "spans", the "count", "seconds", "max_seconds" and "errors"
+                of each span.
+        """
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                "spans": {
+                    name: dict(totals)
+                    for name, totals in sorted(self._spans.items())
+                },
+            }
+
+    def to_prometheus(self):
+        """
+        Format the totals in the Prometheus text exposition format.
+
+        Returns:
+            str: One line per counter and per span statistic.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for counter in snapshot["counters"]:
+            labels = ",".join(
+                f'{key}="{value}"' for key, value in counter["labels"].items()
+            )
+            lines.append(
+                f"flood_{counter['name']}_total{{{labels}}} {counter['value']}"
+            )
+        for name, totals in snapshot["spans"].items():
+            label = f'{{span="{name}"}}'
+            lines.extend(
+                [
+                    f"flood_span_seconds_count{label} {totals['count']}",
+                    f"flood_span_seconds_sum{label} {totals['seconds']}",
+                    f"flood_span_seconds_max{label} {totals['max_seconds']}",
+                    f"flood_span_errors_total{label} {totals['errors']}",
+                ]
+            )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class Span:
+    """A timed stage, used as a context manager or started and finished."""
+
+    def __init__(self, name, attributes):
+        """
+        Create a span.
+
+        Inputs:
+            name (str): Name of the stage.
+            attributes (dict): Values logged with the span.
+        """
+        self.name = name
+        self.attributes = attributes
+        self._start = None
+        self._token = None
+
+    def set(self, **attributes):
+        """Add attributes to the span, e.g. values known at its end."""
+        self.attributes.update(attributes)
+
+    def start(self):
+        """Start the span and return it."""
+        self._token = _current_span.set(self.name)
+        self._start = time.perf_counter()
+        return self
+
+    def finish(self, error=None):
+        """
+        Finish the span and record it.
+
+        Inputs:
+            error (str): Name of the exception raised in the span, if any.
+        """
+        seconds = time.perf_counter() - self._start
+        parent = None
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+                parent = _current_span.get()
+            except ValueError:
+                # Finished in another context than the one it started in
+                pass
+            self._token = None
+        REGISTRY.observe(self.name, seconds, error is not None)
+        if "log" in MODES:
+            record = {
+                "type": "span",
+                "name": self.name,
+                "parent": parent,
+                "seconds": round(seconds, 6),
+                "timestamp": time.time(),
+                "attributes": self.attributes,
+            }
+            if error is not None:
+                record["error"] = error
+            logger.info(json.dumps(record, default=str))
+
+    def __enter__(self):
+        """Start the span."""
+        return self.start()
+
+    def __exit__(self, exc_type, exc, traceback):
+        """Finish the span, recording the exception raised, if any."""
+        self.finish(exc_type.__name__ if exc_type else None)
+        return False
+
+
+class _NullSpan:
+    """Span returned when instrumentation is off; all methods do nothing."""
+
+    def set(self, **attributes):
+        pass
+
+    def start(self):
+        return self
+
+    def finish(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **attributes):
+    """
+    Return a span timing a stage.
+
+    Example:
+        with span("download", files=3) as download_span:
+            ...
+            download_span.set(bytes=size)
+
+    Inputs:
+        name (str): Name of the stage.
+        **attributes: Values logged with the span.
+
+    Returns:
+        Span: Span to use as a context manager, or to start and finish.
+    """
+    if not ENABLED:
+        return _NULL_SPAN
+    return Span(name, attributes)
+
+
+def timed(name=None):
+    """
+    Decorate a function so that each call is recorded as a span.
+
+    Inputs:
+        name (str): Name of the span, by default the name of the function.
+
+    Returns:
+        function: Decorator.
+    """
+
+    def decorator(function):
+        span_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with Span(span_name, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def increment(name, value=1, **labels):
+    """
+    Add a value to a counter, if instrumentation is on.
+
+    Inputs:
+        name (str): Name of the counter, e.g. "ee_requests".
+        value (float): Value to add.
+        **labels: Labels of the counter, e.g. kind="getInfo".
+    """
+    if ENABLED:
+        REGISTRY.increment(name, value, labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the totals of the registry."""
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = REGISTRY.to_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body = json.dumps(REGISTRY.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serve the metrics on a local HTTP endpoint, if the "http" mode is on.
+
+    The totals are served in the Prometheus format on /metrics and as JSON
+    on /metrics.json, from a daemon thread. Only one server is started per
+    process, so the function can be called on every run of a page.
+    Inputs:
+        host (str): Address to listen on.
+        port (int): Port to listen on.
+
+    Returns:
+        server (ThreadingHTTPServer): The server, or None if the mode is off.
+    """
+    global _server
+    if "http" not in MODES:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(
+                target=_server.serve_forever,
+                name="metrics-server",
+                daemon=True,
+            ).start()
+    return _server
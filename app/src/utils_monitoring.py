@@ -0,0 +1,559 @@
+"""Incremental monitoring of an ongoing flood over one area of interest.
+
+A monitor keeps the smoothed 'before' baseline of an area, computed once,
+and processes each new 'after' acquisition on its own: the flood extent of
+the acquisition date is added to a history and folded into the running
+maximum extent. An update therefore costs the new acquisitions only, instead
+of the whole 'after' window.
+
+The state of a monitor is saved in its own directory, named after a hash of
+its parameters, so that the same monitor picks up where it stopped:
+    state.json: parameters and history, one entry per acquisition date.
+    baseline.npz: smoothed baseline, static mask and area mask (NumPy
+        backend).
+    maximum.npz: running maximum extent and date of first flooding of each
+        pixel, in days since 1970-01-01 (NumPy backend).
+
+With the Earth Engine backend, the acquisition dates are listed with one
+request and the flooded area of each new date with one more. The baseline
+is exported once to an asset of the asset folder of the monitor, so that
+Earth Engine does not compute it again for every date, and each update
+exports the running maximum extent to a new asset, folding the new dates
+into the previous maximum. The flood raster of each date is also kept as a
+serialized graph, for the dates not folded yet.
+"""
+import datetime
+import json
+import os
+
+import numpy as np
+from src import utils_flood_analysis_local as local
+from src.utils_cache import canonical_hash
+from src.utils_flood_analysis import (
+    ALGORITHM_VERSION,
+    STATIC_MASK_ASSET,
+    classify_flood_ratio,
+    flooded_area_km2,
+    retrieve_image_collection,
+    smooth,
+    wait_for_tasks,
+)
+from src.utils_imports import lazy_import
+from src.utils_metrics import increment, span
+
+ee = lazy_import("ee")
+
+EPOCH = datetime.date(1970, 1, 1)
+
+# Folder of the assets of the monitors with the Earth Engine backend
+MONITORING_ASSET_FOLDER = os.environ.get("FLOOD_MONITORING_ASSET_FOLDER")
+
+# Pixel size of the exported baseline and maximum extent, in meters
+EXPORT_SCALE = 10
+
+
+def _next_day(date):
+    """Return the day after a date in format yyyy-mm-dd."""
+    return (
+        datetime.date.fromisoformat(date) + datetime.timedelta(days=1)
+    ).isoformat()
+
+
+def _write_atomically(path, write):
+    """Write a file through a temporary file, replaced at the end."""
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as f:
+        write(f)
+    os.replace(temporary_path, path)
+
+
+class FloodMonitor:
+    """
+    Flood extent of an area, updated with each new Sentinel-1 acquisition.
+
+    Example:
+        monitor = FloodMonitor(
+            ".cache/monitoring", aoi, "2022-07-01", "2022-07-30",
+            "2022-08-25", backend="numpy", local_inputs=local_inputs,
+        )
+        monitor.update()
+        maximum = monitor.maximum_extent()
+    """
+
+    def __init__(
+        self,
+        state_dir,
+        aoi,
+        before_start_date,
+        before_end_date,
+        after_start_date,
+        difference_threshold=1.25,
+        polarization="VH",
+        pass_direction="Ascending",
+        speckle_filter="focal_mean",
+        backend="ee",
+        local_inputs=None,
+        asset_folder=MONITORING_ASSET_FOLDER,
+    ):
+        """
+        Open a monitor, loading its state if it was saved before.
+
+        Inputs:
+            state_dir (str): Directory of the states of all monitors.
+            aoi (dict): GeoJSON geometry of the area of interest, in degrees
+                for the Earth Engine backend, or in the coordinate reference
+                system of the grid for the NumPy backend.
+            before_start_date (str): Date in format yyyy-mm-dd, e.g.,
+                '2020-10-01'.
+            before_end_date (str): Date in format yyyy-mm-dd.
+            after_start_date (str): First date of the acquisitions
+                monitored, in format yyyy-mm-dd.
+            difference_threshold (float): Threshold to be applied on the
+                differenced image (after flood - before flood).
+            polarization (str): Synthetic aperture radar polarization mode.
+            pass_direction (str): Synthetic aperture radar pass direction.
+            speckle_filter (str): Name of the speckle filter, see
+                utils_speckle.SPECKLE_FILTERS.
+            backend (str): Execution backend, either 'ee' (Google Earth
+                Engine) or 'numpy' (local arrays).
+            local_inputs (dict): Local scenes and auxiliary rasters, see
+                utils_flood_analysis_local.derive_flood_extents_local. Only
+                used if backend='numpy'.
+            asset_folder (str): Id of the asset folder to which the baseline
+                and the maximum extent are exported, by default that of the
+                FLOOD_MONITORING_ASSET_FOLDER environment variable. Required
+                if backend='ee'.
+        """
+        if backend not in ("ee", "numpy"):
+            raise ValueError(f"Unknown backend: {backend}")
+        if backend == "ee" and not asset_folder:
+            raise ValueError(
+                "The Earth Engine backend needs an asset folder, to which "
+                "the baseline and the maximum extent are exported: set "
+                "asset_folder or FLOOD_MONITORING_ASSET_FOLDER"
+            )
+        self.parameters = {
+            "aoi": aoi,
+            "before_start_date": str(before_start_date),
+            "before_end_date": str(before_end_date),
+            "after_start_date": str(after_start_date),
+            "difference_threshold": float(difference_threshold),
+            "polarization": polarization,
+            "pass_direction": pass_direction,
+            "speckle_filter": speckle_filter,
+            "backend": backend,
+            "algorithm_version": ALGORITHM_VERSION,
+        }
+        if backend == "numpy":
+            self.parameters["transform"] = list(local_inputs["transform"])
+        else:
+            self.parameters["static_mask"] = STATIC_MASK_ASSET or "derived"
+        self.local_inputs = local_inputs
+        self.asset_folder = asset_folder
+        self.monitor_id = canonical_hash(self.parameters)[:16]
+        self.directory = os.path.join(state_dir, self.monitor_id)
+        os.makedirs(self.directory, exist_ok=True)
+        self._baseline = None
+        self.state = {
+            "parameters": self.parameters,
+            "baseline_exported": False,
+            "maximum_asset": None,
+            "history": [],
+        }
+        if os.path.exists(self._path("state.json")):
+            with open(self._path("state.json")) as f:
+                self.state = json.load(f)
+
+    def _path(self, name):
+        """Return the path of a file of the state."""
+        return os.path.join(self.directory, name)
+
+    def _save_state(self):
+        """Save the parameters and history."""
+        _write_atomically(
+            self._path("state.json"),
+            lambda f: f.write(json.dumps(self.state, indent=2).encode()),
+        )
+
+    @property
+    def history(self):
+        """Entries of the processed acquisition dates, in date order."""
+        return sorted(self.state["history"], key=lambda entry: entry["date"])
+
+    def processed_dates(self):
+        """Return the acquisition dates already processed."""
+        return {entry["date"] for entry in self.state["history"]}
+
+    def update(self, end_date=None):
+        """
+        Process the acquisitions not processed yet.
+
+        Each acquisition date is processed on its own against the baseline,
+        and the state is saved after each date, so that an interrupted
+        update resumes with the next date.
+        Inputs:
+            end_date (str): Last date, excluded, of the acquisitions to
+                process, in format yyyy-mm-dd; all dates if None.
+
+        Returns:
+            entries (list): History entries of the new dates, with "date",
+                "scenes" (number of scenes of the date), "flooded_km2" and,
+                with the NumPy backend, "new_flooded_km2" (area not flooded
+                on the earlier dates) and "maximum_km2".
+        """
+        with span("monitor.update", monitor=self.monitor_id) as update_span:
+            if self.parameters["backend"] == "numpy":
+                entries = self._update_local(end_date)
+            else:
+                entries = self._update_ee(end_date)
+            update_span.set(dates=len(entries))
+        return entries
+
+    # NumPy backend
+
+    def _local_collection(self, start_date, end_date):
+        """Return the arrays of the local scenes of a period."""
+        return local.retrieve_image_collection(
+            self.local_inputs["scenes"],
+            start_date,
+            end_date,
+            self.parameters["polarization"],
+            self.parameters["pass_direction"],
+        )
+
+    def _new_local_dates(self, end_date):
+        """Return the dates of the local scenes not processed yet."""
+        processed = self.processed_dates()
+        return sorted(
+            {
+                scene["date"]
+                for scene in self.local_inputs["scenes"]
+                if self.parameters["after_start_date"] <= scene["date"]
+                and (end_date is None or scene["date"] < end_date)
+                and scene["date"] not in processed
+                and scene["pass_direction"].upper()
+                == self.parameters["pass_direction"].upper()
+                and self.parameters["polarization"] in scene
+            }
+        )
+
+    def _local_baseline(self, shape):
+        """Return the baseline, computed and saved on the first call."""
+        if self._baseline is not None:
+            return self._baseline
+        path = self._path("baseline.npz")
+        if os.path.exists(path):
+            with np.load(path) as data:
+                self._baseline = {name: data[name] for name in data.files}
+            return self._baseline
+
+        transform = self.local_inputs["transform"]
+        pixel_size = local.pixel_size_meters(
+            transform, self.local_inputs.get("crs"), shape
+        )
+        aoi = self.parameters["aoi"]
+        aoi_mask = (
+            np.ones(shape, dtype=bool)
+            if aoi is None
+            else local.rasterise_aoi(aoi, shape, transform)
+        )
+        with span("monitor.baseline", monitor=self.monitor_id):
+            before_filtered = local.smooth(
+                local.mosaic(
+                    self._local_collection(
+                        self.parameters["before_start_date"],
+                        self.parameters["before_end_date"],
+                    ),
+                    aoi_mask,
+                ),
+                pixel_size,
+                speckle_filter=self.parameters["speckle_filter"],
+            )
+        self._baseline = {
+            "before_filtered": before_filtered,
+            "static_mask": local.get_local_static_mask(
+                self.local_inputs, pixel_size, shape
+            ),
+            "aoi_mask": aoi_mask,
+            "pixel_size": np.array(pixel_size),
+        }
+        _write_atomically(
+            path, lambda f: np.savez_compressed(f, **self._baseline)
+        )
+        return self._baseline
+
+    def _load_maximum(self, shape):
+        """Return the running maximum and the dates of first flooding."""
+        path = self._path("maximum.npz")
+        if os.path.exists(path):
+            with np.load(path) as data:
+                return data["maximum"], data["first_flooded"]
+        return np.zeros(shape, dtype=bool), np.zeros(shape, dtype="int32")
+
+    def _update_local(self, end_date):
+        """Process the new local acquisitions, see update."""
+        dates = self._new_local_dates(end_date)
+        if not dates:
+            return []
+        collections = (
+            (date, self._local_collection(date, _next_day(date)))
+            for date in dates
+        )
+        baseline = None
+        entries = []
+        for date, images in collections:
+            if baseline is None:
+                baseline = self._local_baseline(images[0].shape)
+                pixel_size = float(baseline["pixel_size"])
+                pixel_area_km2 = (pixel_size / 1000) ** 2
+                maximum, first_flooded = self._load_maximum(images[0].shape)
+            with span("monitor.acquisition", date=date):
+                after_filtered = local.smooth(
+                    local.mosaic(images, baseline["aoi_mask"]),
+                    pixel_size,
+                    speckle_filter=self.parameters["speckle_filter"],
+                )
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    difference = after_filtered / baseline["before_filtered"]
+                flood_rasters = local.classify_flood_ratio_local(
+                    difference,
+                    baseline["static_mask"],
+                    self.parameters["difference_threshold"],
+                )
+            day = (datetime.date.fromisoformat(date) - EPOCH).days
+            new = flood_rasters & ~maximum
+            # Dates processed late keep the earliest flooding date
+            earlier = flood_rasters & maximum & (first_flooded > day)
+            first_flooded[new | earlier] = day
+            maximum |= flood_rasters
+            entry = {
+                "date": date,
+                "scenes": len(images),
+                "flooded_km2": float(flood_rasters.sum()) * pixel_area_km2,
+                "new_flooded_km2": float(new.sum()) * pixel_area_km2,
+                "maximum_km2": float(maximum.sum()) * pixel_area_km2,
+            }
+            _write_atomically(
+                self._path("maximum.npz"),
+                lambda f: np.savez_compressed(
+                    f, maximum=maximum, first_flooded=first_flooded
+                ),
+            )
+            self.state["history"].append(entry)
+            self._save_state()
+            entries.append(entry)
+        return entries
+
+    # Earth Engine backend
+
+    def _ee_aoi(self):
+        """Return the area of interest as an Earth Engine geometry."""
+        return ee.Geometry(self.parameters["aoi"])
+
+    def _export_to_asset(self, image, asset_id, description):
+        """Export an image over the area to an asset and wait for it."""
+        task = ee.batch.Export.image.toAsset(
+            image=image,
+            description=description,
+            assetId=asset_id,
+            region=self._ee_aoi(),
+            scale=EXPORT_SCALE,
+            maxPixels=1e13,
+        )
+        task.start()
+        increment("ee_requests", kind="startProcessing")
+        states = wait_for_tasks([task.id])
+        if states[task.id]["state"] != "COMPLETED":
+            raise RuntimeError(
+                f"{asset_id} could not be exported: "
+                f"{states[task.id]['error_message']}"
+            )
+
+    def _ee_baseline(self):
+        """Return the baseline, exported to its asset on the first call."""
+        if self._baseline is not None:
+            return self._baseline
+        asset_id = f"{self.asset_folder}/baseline_{self.monitor_id}"
+        if not self.state["baseline_exported"]:
+            aoi = self._ee_aoi()
+            parameters = self.parameters
+            baseline = smooth(
+                retrieve_image_collection(
+                    aoi,
+                    parameters["before_start_date"],
+                    parameters["before_end_date"],
+                    parameters["polarization"],
+                    parameters["pass_direction"],
+                )
+                .mosaic()
+                .clip(aoi),
+                speckle_filter=parameters["speckle_filter"],
+            )
+            self._export_to_asset(
+                baseline, asset_id, "export_monitoring_baseline"
+            )
+            self.state["baseline_exported"] = True
+            self._save_state()
+        self._baseline = ee.Image(asset_id)
+        return self._baseline
+
+    def acquisition_dates(self, end_date=None):
+        """
+        List the dates of the acquisitions over the area on Earth Engine.
+
+        Inputs:
+            end_date (str): Last date, excluded, in format yyyy-mm-dd; all
+                dates if None.
+
+        Returns:
+            list: Dates in format yyyy-mm-dd, in order.
+        """
+        parameters = self.parameters
+        collection = retrieve_image_collection(
+            self._ee_aoi(),
+            parameters["after_start_date"],
+            end_date or _next_day(datetime.date.today().isoformat()),
+            parameters["polarization"],
+            parameters["pass_direction"],
+        )
+        increment("ee_requests", kind="getInfo")
+        times = collection.aggregate_array("system:time_start").getInfo()
+        return sorted(
+            {
+                datetime.datetime.fromtimestamp(
+                    time / 1000, datetime.timezone.utc
+                )
+                .date()
+                .isoformat()
+                for time in times
+            }
+        )
+
+    def _ee_flood_raster(self, date):
+        """Return the flood raster of one acquisition date."""
+        aoi = self._ee_aoi()
+        parameters = self.parameters
+        after_filtered = smooth(
+            retrieve_image_collection(
+                aoi,
+                date,
+                _next_day(date),
+                parameters["polarization"],
+                parameters["pass_direction"],
+            )
+            .mosaic()
+            .clip(aoi),
+            speckle_filter=parameters["speckle_filter"],
+        )
+        return classify_flood_ratio(
+            after_filtered.divide(self._ee_baseline()),
+            parameters["difference_threshold"],
+        )
+
+    def _update_ee(self, end_date):
+        """Process the new Earth Engine acquisitions, see update."""
+        processed = self.processed_dates()
+        entries = []
+        for date in self.acquisition_dates(end_date):
+            if date in processed:
+                continue
+            with span("monitor.acquisition", date=date):
+                flood_rasters = self._ee_flood_raster(date)
+                entry = {
+                    "date": date,
+                    "scenes": None,
+                    "flooded_km2": flooded_area_km2(
+                        flood_rasters, self._ee_aoi()
+                    ),
+                    "graph": ee.serializer.toJSON(flood_rasters),
+                }
+            self.state["history"].append(entry)
+            self._save_state()
+            entries.append(entry)
+        self._update_ee_maximum()
+        return entries
+
+    def _ee_maximum(self, entries):
+        """Return the maximum extent of the asset and of dates not folded."""
+        images = [
+            ee.Image(ee.deserializer.fromJSON(entry["graph"])).unmask(0)
+            for entry in entries
+        ]
+        if self.state.get("maximum_asset"):
+            images.insert(0, ee.Image(self.state["maximum_asset"]))
+        return ee.ImageCollection(images).max().toByte().rename("maximum")
+
+    def _update_ee_maximum(self):
+        """
+        Fold the dates not folded yet into a new maximum extent asset.
+
+        The assets are numbered by the number of dates folded, and the
+        previous asset is deleted once the new one is exported.
+        """
+        pending = [
+            entry for entry in self.history if not entry.get("in_maximum")
+        ]
+        if not pending:
+            return
+        folded = len(self.state["history"])
+        asset_id = f"{self.asset_folder}/maximum_{self.monitor_id}_{folded}"
+        self._export_to_asset(
+            self._ee_maximum(pending), asset_id, "export_monitoring_maximum"
+        )
+        previous = self.state.get("maximum_asset")
+        for entry in pending:
+            entry["in_maximum"] = True
+        self.state["maximum_asset"] = asset_id
+        self._save_state()
+        if previous:
+            increment("ee_requests", kind="deleteAsset")
+            ee.data.deleteAsset(previous)
+
+    # Outputs
+
+    def maximum_extent(self):
+        """
+        Return the maximum flood extent over the processed dates.
+
+        Returns:
+            maximum (np.ndarray or ee.Image): Binary raster, True (1) where
+                any acquisition was flooded, or None before the first
+                update.
+        """
+        if not self.state["history"]:
+            return None
+        if self.parameters["backend"] == "numpy":
+            with np.load(self._path("maximum.npz")) as data:
+                return data["maximum"]
+        # Dates whose export failed are folded on top of the asset
+        return self._ee_maximum(
+            [entry for entry in self.history if not entry.get("in_maximum")]
+        ).selfMask()
+
+    def first_flooded(self):
+        """
+        Return the date of first flooding of each pixel (NumPy backend).
+
+        Returns:
+            np.ndarray: Days since 1970-01-01, 0 where never flooded, or None
+                before the first update.
+        """
+        path = self._path("maximum.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return data["first_flooded"]
+
+    def maximum_vectors(self):
+        """
+        Return the maximum flood extent as polygons (NumPy backend).
+
+        Returns:
+            dict: GeoJSON FeatureCollection, see
+                utils_flood_analysis_local.vectorise, or None before the
+                first update.
+        """
+        maximum = self.maximum_extent()
+        if maximum is None:
+            return None
+        return local.vectorise(maximum, self.local_inputs["transform"])
@@ -0,0 +1,541 @@
+"""Local index of Sentinel-1 scene footprints, for pre-flight checks.
+
+The footprints, acquisition times, pass directions and polarisations of the
+COPERNICUS/S1_GRD scenes used by the pipeline (IW mode, 10 m) are stored in
+a SQLite database with an R*Tree over longitude, latitude and day. Before a
+run, the page checks that the scenes of both periods cover the area of
+interest, and suggests the nearest acquisitions that do if they do not, in
+milliseconds instead of after a failed run.
+
+The index is filled incrementally from Earth Engine (refresh_from_ee only
+requests the dates not indexed yet for an area) or from a GeoJSON fixture
+(load_fixture), e.g. for offline use. Features of a fixture have the
+properties of scene_features: "id", "time_start" (milliseconds since the
+epoch), "pass" ("ASCENDING" or "DESCENDING"), "polarisations" (list, e.g.
+["VV", "VH"]) and "relative_orbit".
+"""
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+import shapely
+from shapely.geometry import shape
+from src.utils_imports import lazy_import
+from src.utils_metrics import increment, span
+
+ee = lazy_import("ee")
+
+# GeoJSON fixture loaded instead of querying Earth Engine, if set
+SCENE_FIXTURE = os.environ.get("FLOOD_SCENE_FIXTURE")
+
+MILLISECONDS_PER_DAY = 86400000
+
+# Delay after which COPERNICUS/S1_GRD scenes are assumed to be ingested in
+# Earth Engine, in days: more recent periods are requested again by each
+# refresh, as their scenes may still be added
+INGESTION_LATENCY_DAYS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenes (
+    rowid INTEGER PRIMARY KEY,
+    scene_id TEXT UNIQUE NOT NULL,
+    time_start INTEGER NOT NULL,
+    pass TEXT NOT NULL,
+    polarisations TEXT NOT NULL,
+    relative_orbit INTEGER,
+    footprint TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS scene_bounds USING rtree(
+    rowid, west, east, south, north, first_day, last_day
+);
+CREATE TABLE IF NOT EXISTS refreshes (
+    west REAL, south REAL, east REAL, north REAL,
+    start_time INTEGER, end_time INTEGER
+);
+"""
+
+
+def to_milliseconds(date):
+    """
+    Convert a date to milliseconds since the epoch, in UTC.
+
+    Inputs:
+        date (str, datetime.date or int): Date in format yyyy-mm-dd, date,
+            or milliseconds.
+
+    Returns:
+        int: Milliseconds since the epoch.
+    """
+    if isinstance(date, int):
+        return date
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date[:10])
+    if not isinstance(date, datetime.datetime):
+        date = datetime.datetime(date.year, date.month, date.day)
+    date = date.replace(tzinfo=date.tzinfo or datetime.timezone.utc)
+    return int(date.timestamp() * 1000)
+
+
+def to_date(milliseconds):
+    """Return the UTC date of a time in milliseconds since the epoch."""
+    return datetime.datetime.fromtimestamp(
+        milliseconds / 1000, datetime.timezone.utc
+    ).date()
+
+
+def _subtract_intervals(interval, covered):
+    """Return the parts of an interval not covered by other intervals."""
+    start, end = interval
+    missing = []
+    for covered_start, covered_end in sorted(covered):
+        if covered_end <= start or covered_start >= end:
+            continue
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+        if start >= end:
+            break
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+def scene_features(bounds, start_date, end_date, page_size=1000):
+    """
+    Request the footprints of the Sentinel-1 scenes of an area and period.
+
+    The scenes are those the pipeline can use (IW mode, 10 m), in both pass
+    directions and all polarisations, so that alternatives can be suggested.
+    Inputs:
+        bounds (tuple): (west, south, east, north) of the area in degrees.
+        start_date (str): First date, included, in format yyyy-mm-dd.
+        end_date (str): Last date, excluded, in format yyyy-mm-dd.
+        page_size (int): Number of scenes per request.
+
+    Yields:
+        dict: GeoJSON feature of a scene.
+    """
+    collection = (
+        ee.ImageCollection("COPERNICUS/S1_GRD")
+        .filter(ee.Filter.eq("instrumentMode", "IW"))
+        .filter(ee.Filter.eq("resolution_meters", 10))
+        .filterBounds(ee.Geometry.Rectangle(list(bounds)))
+        .filterDate(start_date, end_date)
+    )
+    features = collection.map(
+        lambda image: ee.Feature(
+            image.geometry(),
+            {
+                "id": image.id(),
+                "time_start": image.get("system:time_start"),
+                "pass": image.get("orbitProperties_pass"),
+                "polarisations": image.get("transmitterReceiverPolarisation"),
+                "relative_orbit": image.get("relativeOrbitNumber_start"),
+            },
+        )
+    )
+    offset = 0
+    while True:
+        increment("ee_requests", kind="getInfo")
+        page = ee.FeatureCollection(
+            features.toList(page_size, offset)
+        ).getInfo()["features"]
+        yield from page
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+
+class SceneIndex:
+    """
+    SQLite index of Sentinel-1 scene footprints.
+
+    The index can be shared between threads; queries and updates are
+    serialised with a lock.
+    """
+
+    def __init__(self, path=":memory:"):
+        """
+        Open the index, creating the database if needed.
+
+        Inputs:
+            path (str): Path of the SQLite database, or ':memory:'.
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        """Close the database."""
+        self._connection.close()
+
+    def __len__(self):
+        """Return the number of scenes in the index."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM scenes"
+            ).fetchone()[0]
+
+    def add_features(self, features):
+        """
+        Add or update scenes.
+
+        Inputs:
+            features (iterable): GeoJSON features with the properties of
+                scene_features.
+
+        Returns:
+            int: Number of scenes added or updated.
+        """
+        # Requested before locking, as features may come from Earth Engine
+        features = list(features)
+        with self._lock, self._connection:
+            for feature in features:
+                properties = feature["properties"]
+                footprint = shape(feature["geometry"])
+                west, south, east, north = footprint.bounds
+                day = properties["time_start"] / MILLISECONDS_PER_DAY
+                polarisations = properties["polarisations"]
+                if not isinstance(polarisations, str):
+                    polarisations = ",".join(polarisations)
+                row = self._connection.execute(
+                    "SELECT rowid FROM scenes WHERE scene_id = ?",
+                    (properties["id"],),
+                ).fetchone()
+                values = (
+                    properties["id"],
+                    int(properties["time_start"]),
+                    properties["pass"].upper(),
+                    polarisations,
+                    properties.get("relative_orbit"),
+                    json.dumps(feature["geometry"]),
+                )
+                if row is None:
+                    rowid = self._connection.execute(
+                        "INSERT INTO scenes (scene_id, time_start, pass, "
+                        "polarisations, relative_orbit, footprint) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        values,
+                    ).lastrowid
+                else:
+                    rowid = row[0]
+                    self._connection.execute(
+                        "UPDATE scenes SET scene_id = ?, time_start = ?, "
+                        "pass = ?, polarisations = ?, relative_orbit = ?, "
+                        "footprint = ? WHERE rowid = ?",
+                        values + (rowid,),
+                    )
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO scene_bounds "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (rowid, west, east, south, north, day, day),
+                )
+        return len(features)
+
+    def load_fixture(self, path):
+        """
+        Add the scenes of a GeoJSON FeatureCollection file.
+
+        Inputs:
+            path (str): Path of the file.
+
+        Returns:
+            int: Number of scenes added or updated.
+        """
+        with open(path) as f:
+            return self.add_features(json.load(f)["features"])
+
+    def missing_ranges(self, bounds, start_date, end_date):
+        """
+        Return the periods not indexed yet for an area.
+
+        Inputs:
+            bounds (tuple): (west, south, east, north) of the area in degrees.
+            start_date (str): First date, included, in format yyyy-mm-dd.
+            end_date (str): Last date, excluded, in format yyyy-mm-dd.
+
+        Returns:
+            list: (start, end) periods in milliseconds since the epoch.
+        """
+        west, south, east, north = bounds
+        start, end = to_milliseconds(start_date), to_milliseconds(end_date)
+        with self._lock:
+            covered = self._connection.execute(
+                "SELECT start_time, end_time FROM refreshes "
+                "WHERE west <= ? AND south <= ? AND east >= ? AND north >= ? "
+                "AND start_time < ? AND end_time > ?",
+                (west, south, east, north, end, start),
+            ).fetchall()
+        return _subtract_intervals((start, end), covered)
+
+    def refresh_from_ee(self, bounds, start_date, end_date, page_size=1000):
+        """
+        Index the scenes of an area and period that are not indexed yet.
+
+        Only the periods not requested before for an area containing these
+        bounds are requested from Earth Engine. A period is recorded as
+        indexed up to INGESTION_LATENCY_DAYS before now only, so that the
+        scenes of an ongoing flood are requested again until they are all
+        ingested.
+        Inputs:
+            bounds (tuple): (west, south, east, north) of the area in degrees.
+            start_date (str): First date, included, in format yyyy-mm-dd.
+            end_date (str): Last date, excluded, in format yyyy-mm-dd.
+            page_size (int): Number of scenes per request.
+
+        Returns:
+            int: Number of scenes added or updated.
+        """
+        count = 0
+        ingested = (
+            to_milliseconds(datetime.datetime.now(datetime.timezone.utc))
+            - INGESTION_LATENCY_DAYS * MILLISECONDS_PER_DAY
+        )
+        for start, end in self.missing_ranges(bounds, start_date, end_date):
+            with span("scene_index.refresh", bounds=bounds):
+                count += self.add_features(
+                    scene_features(
+                        bounds,
+                        to_date(start).isoformat(),
+                        to_date(end).isoformat(),
+                        page_size,
+                    )
+                )
+            if min(end, ingested) <= start:
+                continue
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "INSERT INTO refreshes VALUES (?, ?, ?, ?, ?, ?)",
+                    tuple(bounds) + (start, min(end, ingested)),
+                )
+        return count
+
+    def find_scenes(
+        self,
+        aoi,
+        start_date,
+        end_date,
+        pass_direction=None,
+        polarization=None,
+    ):
+        """
+        Return the scenes intersecting an area in a period.
+
+        Inputs:
+            aoi (dict or shapely geometry): Area of interest, as a GeoJSON
+                geometry or a shapely geometry.
+            start_date (str): First date, included, in format yyyy-mm-dd.
+            end_date (str): Last date, excluded, in format yyyy-mm-dd.
+            pass_direction (str): 'Ascending' or 'Descending'; both if None.
+            polarization (str): Polarisation the scenes must have, e.g.
+                'VH'; any if None.
+
+        Returns:
+            scenes (list): Dictionaries with "id", "time_start", "pass",
+                "polarisations", "relative_orbit" and "footprint" (shapely
+                geometry), sorted by time.
+        """
+        geometry = aoi if isinstance(aoi, shapely.Geometry) else shape(aoi)
+        west, south, east, north = geometry.bounds
+        start, end = to_milliseconds(start_date), to_milliseconds(end_date)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT s.scene_id, s.time_start, s.pass, s.polarisations, "
+                "s.relative_orbit, s.footprint FROM scene_bounds AS b "
+                "JOIN scenes AS s ON s.rowid = b.rowid "
+                "WHERE b.west <= ? AND b.east >= ? AND b.south <= ? "
+                "AND b.north >= ? AND b.last_day >= ? AND b.first_day <= ? "
+                "AND s.time_start >= ? AND s.time_start < ? "
+                "ORDER BY s.time_start",
+                (
+                    east,
+                    west,
+                    north,
+                    south,
+                    start / MILLISECONDS_PER_DAY - 1,
+                    end / MILLISECONDS_PER_DAY + 1,
+                    start,
+                    end,
+                ),
+            ).fetchall()
+        scenes = []
+        for row in rows:
+            scene_id, time_start, orbit_pass, polarisations, orbit, text = row
+            if pass_direction and orbit_pass != pass_direction.upper():
+                continue
+            if polarization and polarization not in polarisations.split(","):
+                continue
+            footprint = shape(json.loads(text))
+            # Footprints only touching the area do not cover any of it
+            if not footprint.intersects(geometry) or footprint.touches(
+                geometry
+            ):
+                continue
+            scenes.append(
+                {
+                    "id": scene_id,
+                    "time_start": time_start,
+                    "pass": orbit_pass,
+                    "polarisations": polarisations.split(","),
+                    "relative_orbit": orbit,
+                    "footprint": footprint,
+                }
+            )
+        return scenes
+
+
+def coverage_fraction(aoi, scenes):
+    """
+    Return the fraction of an area covered by the footprints of scenes.
+
+    Inputs:
+        aoi (dict or shapely geometry): Area of interest.
+        scenes (list): Scenes of SceneIndex.find_scenes.
+
+    Returns:
+        float: Covered fraction of the area, between 0 and 1.
+    """
+    geometry = aoi if isinstance(aoi, shapely.Geometry) else shape(aoi)
+    if not scenes or geometry.area == 0:
+        return 0.0
+    footprints = shapely.union_all([scene["footprint"] for scene in scenes])
+    return geometry.intersection(footprints).area / geometry.area
+
+
+def nearest_acquisitions(
+    index,
+    aoi,
+    start_date,
+    end_date,
+    polarization="VH",
+    search_days=30,
+    min_coverage=0.99,
+    limit=3,
+):
+    """
+    Suggest the acquisitions covering an area nearest to a period.
+
+    Scenes of the same day and pass direction are grouped, as the pipeline
+    mosaics them. Acquisitions covering at least min_coverage of the area
+    come first, nearest to the period first.
+    Inputs:
+        index (SceneIndex): Index of the scenes.
+        aoi (dict or shapely geometry): Area of interest.
+        start_date (str): First date of the period, in format yyyy-mm-dd.
+        end_date (str): Last date of the period, excluded.
+        polarization (str): Polarisation the scenes must have.
+        search_days (int): Days searched before and after the period.
+        min_coverage (float): Fraction of the area considered covered.
+        limit (int): Number of suggestions.
+
+    Returns:
+        suggestions (list): Dictionaries with "date" (yyyy-mm-dd),
+            "pass_direction" ('Ascending' or 'Descending'), "coverage" and
+            "days_away" (0 within the period).
+    """
+    geometry = aoi if isinstance(aoi, shapely.Geometry) else shape(aoi)
+    start, end = to_milliseconds(start_date), to_milliseconds(end_date)
+    scenes = index.find_scenes(
+        geometry,
+        start - search_days * MILLISECONDS_PER_DAY,
+        end + search_days * MILLISECONDS_PER_DAY,
+        polarization=polarization,
+    )
+    acquisitions = {}
+    for scene in scenes:
+        date = to_date(scene["time_start"])
+        acquisitions.setdefault((date, scene["pass"]), []).append(scene)
+    suggestions = []
+    for (date, orbit_pass), group in acquisitions.items():
+        coverage = coverage_fraction(geometry, group)
+        if not coverage:
+            continue
+        time_start = to_milliseconds(date)
+        days_away = max(start - time_start, time_start - end + 1, 0)
+        suggestions.append(
+            {
+                "date": date.isoformat(),
+                "pass_direction": orbit_pass.capitalize(),
+                "coverage": coverage,
+                "days_away": -(-days_away // MILLISECONDS_PER_DAY),
+            }
+        )
+    suggestions.sort(
+        key=lambda suggestion: (
+            suggestion["coverage"] < min_coverage,
+            suggestion["days_away"],
+            -suggestion["coverage"],
+        )
+    )
+    return suggestions[:limit]
+
+
+def preflight_check(
+    index,
+    aoi,
+    before_start_date,
+    before_end_date,
+    after_start_date,
+    after_end_date,
+    polarization="VH",
+    pass_direction="Ascending",
+    min_coverage=0.99,
+    search_days=30,
+):
+    """
+    Check that Sentinel-1 scenes cover an area in both periods of a run.
+
+    Inputs:
+        index (SceneIndex): Index of the scenes, already refreshed for the
+            area and periods.
+        aoi (dict or shapely geometry): Area of interest.
+        before_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        before_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_start_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        after_end_date (str): Date in format yyyy-mm-dd, e.g., '2020-10-01'.
+        polarization (str): Synthetic aperture radar polarization mode, or
+            None for any.
+        pass_direction (str): Synthetic aperture radar pass direction, or
+            None for any.
+        min_coverage (float): Fraction of the area that must be covered.
+        search_days (int): Days searched around a period for suggestions.
+
+    Returns:
+        report (dict): "ok" (bool), and for "before" and "after": "scenes"
+            (number of scenes), "coverage" (fraction of the area) and
+            "suggestions" (see nearest_acquisitions, empty if covered).
+    """
+    geometry = aoi if isinstance(aoi, shapely.Geometry) else shape(aoi)
+    report = {"ok": True}
+    periods = {
+        "before": (before_start_date, before_end_date),
+        "after": (after_start_date, after_end_date),
+    }
+    for period, (start_date, end_date) in periods.items():
+        scenes = index.find_scenes(
+            geometry, start_date, end_date, pass_direction, polarization
+        )
+        coverage = coverage_fraction(geometry, scenes)
+        covered = coverage >= min_coverage
+        report[period] = {
+            "scenes": len(scenes),
+            "coverage": coverage,
+            "suggestions": []
+            if covered
+            else nearest_acquisitions(
+                index,
+                geometry,
+                start_date,
+                end_date,
+                polarization=polarization,
+                search_days=search_days,
+                min_coverage=min_coverage,
+            ),
+        }
+        report["ok"] = report["ok"] and covered
+    return report
@@ -0,0 +1,242 @@
+"""Precomputed static masks of permanent water and steep slopes.
+
+The static mask combines the two masks that do not depend on the Sentinel-1
+scenes into one uint8 raster of bit flags:
+    LAND_BIT: not a perennial water body (water <= 10 months/yr).
+    FLAT_BIT: slope under 5 degrees.
+Masks are stored bit-packed, one file per grid cell of one degree or per
+local grid (see grid_id), and reused across runs.
+"""
+import functools
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+LAND_BIT = 1
+FLAT_BIT = 2
+
+
+def cell_id(longitude, latitude, cell_size=1):
+    """
+    Return the id of the grid cell containing a point, e.g. 'N05E100'.
+
+    Inputs:
+        longitude (float): Longitude in degrees.
+        latitude (float): Latitude in degrees.
+        cell_size (int): Side of the grid cells in degrees.
+
+    Returns:
+        str: Id of the cell, named after its south-west corner.
+    """
+    south = int(math.floor(latitude / cell_size) * cell_size)
+    west = int(math.floor(longitude / cell_size) * cell_size)
+    return "%s%02d%s%03d" % (
+        "N" if south >= 0 else "S",
+        abs(south),
+        "E" if west >= 0 else "W",
+        abs(west),
+    )
+
+
+def cell_bounds(cell, cell_size=1):
+    """
+    Return the bounding box of a grid cell.
+
+    Inputs:
+        cell (str): Id of the cell, see cell_id.
+        cell_size (int): Side of the grid cells in degrees.
+
+    Returns:
+        tuple: (west, south, east, north) in degrees.
+    """
+    south = int(cell[1:3]) * (1 if cell[0] == "N" else -1)
+    west = int(cell[4:7]) * (1 if cell[3] == "E" else -1)
+    return west, south, west + cell_size, south + cell_size
+
+
+def cells_covering(bounds, cell_size=1):
+    """
+    Return the ids of the grid cells intersecting a bounding box.
+
+    Inputs:
+        bounds (tuple): (west, south, east, north) in degrees.
+        cell_size (int): Side of the grid cells in degrees.
+
+    Returns:
+        list: Ids of the cells.
+    """
+    west, south, east, north = bounds
+    return [
+        cell_id(lon + cell_size / 2, lat + cell_size / 2, cell_size)
+        for lat in range(
+            int(math.floor(south / cell_size) * cell_size),
+            int(math.ceil(north / cell_size) * cell_size),
+            cell_size,
+        )
+        for lon in range(
+            int(math.floor(west / cell_size) * cell_size),
+            int(math.ceil(east / cell_size) * cell_size),
+            cell_size,
+        )
+    ]
+
+
+def grid_id(transform, shape, crs=None):
+    """
+    Return the id of a local grid, e.g. 'grid_3f2a9c0d1e4b5a67'.
+
+    Static masks depend on the location only, so the mask of a grid is
+    shared by all runs on the same grid.
+    Inputs:
+        transform (tuple): GDAL-style geotransform of the grid.
+        shape (tuple): Shape of the grid.
+        crs (str): Coordinate reference system of the grid.
+
+    Returns:
+        str: Id of the grid.
+    """
+    payload = json.dumps(
+        [[float(value) for value in transform], [int(n) for n in shape], crs]
+    )
+    return "grid_" + hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def build_static_mask(surface_water, dem, pixel_size=10, max_slope=5):
+    """
+    Build the static mask from the JRC seasonality and a DEM.
+
+    Inputs:
+        surface_water (np.ndarray): Seasonality band of the JRC Global
+            Surface Water Mapping Layers, NaN where there is no data.
+        dem (np.ndarray): Elevation in meters on the same grid.
+        pixel_size (float): Pixel size in meters.
+        max_slope (float): Maximum slope in degrees.
+
+    Returns:
+        static_mask (np.ndarray): uint8 array of LAND_BIT and FLAT_BIT flags.
+    """
+    # Imported here to avoid a circular import
+    from src.utils_flood_analysis_local import slope_degrees
+
+    with np.errstate(invalid="ignore"):
+        land = ~(surface_water >= 10)
+        flat = slope_degrees(dem, pixel_size) < max_slope
+    return (land * LAND_BIT + flat * FLAT_BIT).astype("uint8")
+
+
+def pack_static_mask(static_mask):
+    """
+    Pack a static mask to one bit per pixel and flag.
+
+    Inputs:
+        static_mask (np.ndarray): uint8 array of LAND_BIT and FLAT_BIT flags.
+
+    Returns:
+        packed (dict): Packed bit planes and the shape of the mask.
+    """
+    return {
+        "shape": np.array(static_mask.shape),
+        "land": np.packbits(static_mask & LAND_BIT != 0),
+        "flat": np.packbits(static_mask & FLAT_BIT != 0),
+    }
+
+
+def unpack_static_mask(packed):
+    """
+    Unpack a static mask packed with pack_static_mask.
+
+    Inputs:
+        packed (dict): Packed bit planes and the shape of the mask.
+
+    Returns:
+        static_mask (np.ndarray): uint8 array of LAND_BIT and FLAT_BIT flags.
+    """
+    shape = tuple(packed["shape"])
+    size = int(np.prod(shape))
+    land = np.unpackbits(packed["land"], count=size).reshape(shape)
+    flat = np.unpackbits(packed["flat"], count=size).reshape(shape)
+    return (land * LAND_BIT + flat * FLAT_BIT).astype("uint8")
+
+
+class StaticMaskStore:
+    """
+    Store of static masks keyed by grid cell or grid, in memory and on disk.
+
+    Each mask is built once with the function given to get, saved bit-packed
+    to disk, and then shared by every later run on the same cell. The most
+    recently used masks are also kept unpacked in memory.
+    """
+
+    def __init__(self, directory, max_cells_in_memory=4):
+        """
+        Create the store.
+
+        Inputs:
+            directory (str): Directory of the packed masks.
+            max_cells_in_memory (int): Number of unpacked masks kept in
+                memory.
+        """
+        self.directory = directory
+        self.max_cells_in_memory = max_cells_in_memory
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, cell):
+        """Return the path of the packed mask of a cell."""
+        return os.path.join(self.directory, cell + ".npz")
+
+    def get(self, cell, build=None):
+        """
+        Return the static mask of a cell, building it if needed.
+
+        Inputs:
+            cell (str): Id of the grid cell or of the grid, see cell_id and
+                grid_id.
+            build (callable): Function without arguments returning the static
+                mask of the cell, e.g. wrapping build_static_mask. Only called
+                if the mask is not stored yet.
+
+        Returns:
+            static_mask (np.ndarray): uint8 array of LAND_BIT and FLAT_BIT
+                flags, or None if it is not stored and build is None.
+        """
+        with self._lock:
+            if cell in self._masks:
+                self._masks.move_to_end(cell)
+                return self._masks[cell]
+            if os.path.exists(self._path(cell)):
+                with np.load(self._path(cell)) as packed:
+                    static_mask = unpack_static_mask(packed)
+            elif build is not None:
+                static_mask = build()
+                temporary_path = self._path(cell) + ".tmp.npz"
+                np.savez_compressed(
+                    temporary_path, **pack_static_mask(static_mask)
+                )
+                os.replace(temporary_path, self._path(cell))
+            else:
+                return None
+            self._masks[cell] = static_mask
+            while len(self._masks) > self.max_cells_in_memory:
+                self._masks.popitem(last=False)
+            return static_mask
+
+
+@functools.lru_cache(maxsize=None)
+def get_static_mask_store(directory):
+    """
+    Return the store of a directory, shared by all runs of a process.
+
+    Inputs:
+        directory (str): Directory of the packed masks.
+
+    Returns:
+        StaticMaskStore: The store.
+    """
+    return StaticMaskStore(directory)
@@ -0,0 +1,594 @@
+"""Local XYZ tiles of flood rasters and polygons.
+
+Raster tiles are rendered as PNG from a local raster, e.g. the Cloud-Optimized
+GeoTIFF downloaded by utils_download, instead of being rendered by Earth
+Engine for every pan and zoom. Each tile is read from the overview of the
+raster closest to its resolution and warped to Web Mercator, so low zoom
+levels do not read the full resolution raster. Rendered tiles are kept in a
+bounded LRU cache and served with an ETag, so that browsers revalidate them
+with a 304 response instead of downloading them again.
+
+Flood polygons are served as Mapbox Vector Tiles, cut from a FlatGeobuf or
+GeoParquet file (see utils_vector_io) through its spatial index and
+simplified to the resolution of each zoom level, so that the browser only
+receives the polygons of the current view, at the detail it can show.
+
+Downloaded files can also be served whole, streamed in chunks from disk, at
+a path signed with a secret of the server, so that a page links to them
+instead of embedding them.
+"""
+import collections
+import hashlib
+import hmac
+import io
+import math
+import os
+import re
+import secrets
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import rasterio
+import shapely
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from shapely.geometry import shape
+from src.utils_metrics import increment
+from src.utils_vector_io import read_features_bbox
+
+# Half the side of the Web Mercator square, in meters
+ORIGIN = 20037508.342789244
+
+# Side of a tile in pixels
+TILE_SIZE = 256
+
+# Colour of the flooded pixels (value 1) in the tiles; other values are
+# transparent
+FLOOD_COLOR = (0, 0, 255)
+
+# Path of the tiles served by TileServer: /tiles/<layer>/<z>/<x>/<y>.png
+# for rasters, .pbf for vector tiles
+TILE_PATH = re.compile(r"^/tiles/(\w+)/(\d+)/(\d+)/(\d+)\.(png|pbf)$")
+
+# Path of the files served by TileServer: /files/<signature>/<file name>
+FILE_PATH = re.compile(r"^/files/(\w+)/([\w.-]+)$")
+
+# Size of the chunks of the files streamed by TileServer, in bytes
+FILE_CHUNK_SIZE = 2**20
+
+# Earth radius of the Web Mercator projection, in meters
+EARTH_RADIUS = 6378137.0
+
+# Largest latitude of the Web Mercator projection
+MAX_LATITUDE = 85.0511287798
+
+
+def tile_bounds(z, x, y):
+    """
+    Return the Web Mercator bounds of an XYZ tile.
+
+    Inputs:
+        z (int): Zoom level.
+        x (int): Column of the tile, from the west.
+        y (int): Row of the tile, from the north.
+
+    Returns:
+        bounds (tuple): (west, south, east, north) in EPSG:3857 meters.
+    """
+    size = 2 * ORIGIN / 2**z
+    west = -ORIGIN + x * size
+    north = ORIGIN - y * size
+    return west, north - size, west + size, north
+
+
+def encode_png(data, color=FLOOD_COLOR):
+    """
+    Encode a flood mask as a PNG with a palette.
+
+    Inputs:
+        data (np.ndarray): uint8 mask, 1 where flooded.
+        color (tuple): RGB colour of the flooded pixels.
+
+    Returns:
+        bytes: PNG image, transparent where not flooded.
+    """
+    # Imported here, as Pillow is only needed to render tiles
+    from PIL import Image
+
+    image = Image.fromarray((data == 1).astype("uint8"), mode="L")
+    image = image.convert("P")
+    image.putpalette([0, 0, 0] + list(color))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True, transparency=0)
+    return buffer.getvalue()
+
+
+def to_web_mercator(geometries):
+    """Project geometries from longitude, latitude to Web Mercator."""
+
+    def project(coordinates):
+        longitude = np.radians(coordinates[:, 0])
+        latitude = np.radians(
+            np.clip(coordinates[:, 1], -MAX_LATITUDE, MAX_LATITUDE)
+        )
+        return np.column_stack(
+            (
+                EARTH_RADIUS * longitude,
+                EARTH_RADIUS * np.log(np.tan(np.pi / 4 + latitude / 2)),
+            )
+        )
+
+    return shapely.transform(geometries, project)
+
+
+class TileRenderer:
+    """Render the XYZ tiles of one raster."""
+
+    # Extension and media type of the tiles
+    extension = "png"
+    media_type = "image/png"
+
+    def __init__(self, path, color=FLOOD_COLOR, min_value=1):
+        """
+        Open a raster and its overviews.
+
+        Inputs:
+            path (str): Path of the raster, ideally a Cloud-Optimized GeoTIFF
+                (see utils_cog).
+            color (tuple): RGB colour of the flooded pixels.
+            min_value (int): Pixels at least this value are flooded, e.g. a
+                level of utils_flood_analysis.threshold_levels.
+        """
+        self.path = path
+        self.color = color
+        self.min_value = min_value
+        # Datasets are not thread-safe: tiles of a raster are read one at a
+        # time
+        self._lock = threading.Lock()
+        with rasterio.open(path) as src:
+            self.crs = src.crs
+            self.resolution = src.res[0]
+            self.factors = src.overviews(1)
+            self.bounds = transform_bounds(src.crs, "EPSG:3857", *src.bounds)
+        self._datasets = {}
+        self.empty_tile = encode_png(
+            np.zeros((TILE_SIZE, TILE_SIZE), "uint8"), color
+        )
+
+    def close(self):
+        """Close the datasets."""
+        with self._lock:
+            for dataset in self._datasets.values():
+                dataset.close()
+            self._datasets.clear()
+
+    def _dataset(self, tile_resolution):
+        """Return the coarsest level at least as fine as a resolution."""
+        level = None
+        for i, factor in enumerate(self.factors):
+            if self.resolution * factor <= tile_resolution:
+                level = i
+        if level not in self._datasets:
+            options = {} if level is None else {"overview_level": level}
+            self._datasets[level] = rasterio.open(self.path, **options)
+        return self._datasets[level]
+
+    def render(self, z, x, y):
+        """
+        Render a tile.
+
+        Inputs:
+            z (int): Zoom level.
+            x (int): Column of the tile, from the west.
+            y (int): Row of the tile, from the north.
+
+        Returns:
+            bytes: PNG image of the tile, transparent outside the raster.
+        """
+        west, south, east, north = tile_bounds(z, x, y)
+        r_west, r_south, r_east, r_north = self.bounds
+        if west >= r_east or east <= r_west or south >= r_north:
+            return self.empty_tile
+        if north <= r_south:
+            return self.empty_tile
+        tile_west, _, tile_east, _ = transform_bounds(
+            "EPSG:3857", self.crs, west, south, east, north
+        )
+        size = (east - west) / TILE_SIZE
+        with self._lock:
+            src = self._dataset((tile_east - tile_west) / TILE_SIZE)
+            with WarpedVRT(
+                src,
+                crs="EPSG:3857",
+                transform=rasterio.Affine(size, 0, west, 0, -size, north),
+                width=TILE_SIZE,
+                height=TILE_SIZE,
+                resampling=Resampling.nearest,
+                src_nodata=src.nodata,
+                nodata=0,
+            ) as vrt:
+                data = vrt.read(1) >= self.min_value
+        if not data.any():
+            return self.empty_tile
+        return encode_png(data.astype("uint8"), self.color)
+
+
+class VectorTileRenderer:
+    """Render the Mapbox Vector Tiles of flood polygons."""
+
+    # Extension and media type of the tiles
+    extension = "pbf"
+    media_type = "application/vnd.mapbox-vector-tile"
+
+    def __init__(
+        self, path, layer_name="flood_extent", extent=4096, buffer_pixels=4
+    ):
+        """
+        Serve the polygons of a file in longitude, latitude.
+
+        Inputs:
+            path (str): Path of a FlatGeobuf or GeoParquet file, see
+                utils_vector_io.
+            layer_name (str): Name of the layer in the tiles.
+            extent (int): Number of units of the side of a tile.
+            buffer_pixels (int): Margin around each tile, in pixels of a 256
+                pixel tile, so that polygons cut at the tile edges join
+                without visible seams.
+        """
+        self.path = path
+        self.layer_name = layer_name
+        self.extent = extent
+        self.buffer_pixels = buffer_pixels
+
+    def close(self):
+        """Release nothing: the file is opened for each tile."""
+
+    def render(self, z, x, y):
+        """
+        Render a tile.
+
+        The polygons intersecting the tile are read through the spatial
+        index of the file, clipped to the tile and its margin, simplified
+        with a tolerance of half a pixel, and the polygons smaller than a
+        pixel are dropped.
+        Inputs:
+            z (int): Zoom level.
+            x (int): Column of the tile, from the west.
+            y (int): Row of the tile, from the north.
+
+        Returns:
+            bytes: Encoded vector tile.
+        """
+        # Imported here, as only vector tiles need the encoder
+        import mapbox_vector_tile
+
+        west, south, east, north = tile_bounds(z, x, y)
+        pixel = (east - west) / TILE_SIZE
+        margin = self.buffer_pixels * pixel
+        bbox = transform_bounds(
+            "EPSG:3857",
+            "EPSG:4326",
+            west - margin,
+            south - margin,
+            east + margin,
+            north + margin,
+        )
+        features = list(read_features_bbox(self.path, bbox))
+        geometries = to_web_mercator(
+            np.array(
+                [shape(feature["geometry"]) for feature in features],
+                dtype=object,
+            )
+        )
+        geometries = shapely.clip_by_rect(
+            geometries,
+            west - margin,
+            south - margin,
+            east + margin,
+            north + margin,
+        )
+        geometries = shapely.simplify(
+            geometries, pixel / 2, preserve_topology=True
+        )
+        keep = shapely.area(geometries) >= pixel * pixel
+        return mapbox_vector_tile.encode(
+            [
+                {
+                    "name": self.layer_name,
+                    "features": [
+                        {
+                            "geometry": geometry,
+                            "properties": feature["properties"],
+                        }
+                        for geometry, feature, kept in zip(
+                            geometries, features, keep
+                        )
+                        if kept
+                    ],
+                }
+            ],
+            default_options={
+                "quantize_bounds": (west, south, east, north),
+                "extents": self.extent,
+                "y_coord_down": False,
+            },
+        )
+
+
+class TileCache:
+    """Thread-safe LRU cache of rendered tiles, bounded in bytes."""
+
+    def __init__(self, max_bytes=64 * 2**20):
+        """
+        Create an empty cache.
+
+        Inputs:
+            max_bytes (int): Maximum total size of the cached tiles.
+        """
+        self.max_bytes = max_bytes
+        self._tiles = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the (data, etag) pair of a tile, or None."""
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+        increment(
+            "cache_requests",
+            cache="tiles",
+            result="miss" if tile is None else "hit",
+        )
+        return tile
+
+    def put(self, key, data):
+        """
+        Add a tile, evicting the least recently used ones above the limit.
+
+        Inputs:
+            key (tuple): (layer, z, x, y) of the tile.
+            data (bytes): Encoded tile, PNG or vector tile.
+
+        Returns:
+            tile (tuple): (data, etag) pair of the tile.
+        """
+        tile = data, '"' + hashlib.sha1(data).hexdigest()[:20] + '"'
+        with self._lock:
+            if key in self._tiles:
+                self._bytes -= len(self._tiles.pop(key)[0])
+            self._tiles[key] = tile
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._tiles) > 1:
+                _, (evicted, _) = self._tiles.popitem(last=False)
+                self._bytes -= len(evicted)
+        return tile
+
+    def __len__(self):
+        """Return the number of cached tiles."""
+        return len(self._tiles)
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    """Serve the tiles of the layers of a TileServer."""
+
+    def do_GET(self):
+        file_match = FILE_PATH.match(self.path.split("?")[0])
+        if file_match:
+            self._send_file(file_match.group(1))
+            return
+        match = TILE_PATH.match(self.path.split("?")[0])
+        renderer = match and self.server.layers.get(match.group(1))
+        if renderer is None or match.group(5) != renderer.extension:
+            self.send_error(404)
+            return
+        z, x, y = (int(value) for value in match.groups()[1:4])
+        if not (0 <= x < 2**z and 0 <= y < 2**z):
+            self.send_error(404)
+            return
+        key = (match.group(1), z, x, y)
+        tile = self.server.cache.get(key)
+        if tile is None:
+            tile = self.server.cache.put(key, renderer.render(z, x, y))
+        data, etag = tile
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", renderer.media_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_file(self, signature):
+        """Stream a file registered with TileServer.add_file."""
+        path, filename, media_type = self.server.files.get(
+            signature, (None, None, None)
+        )
+        try:
+            f = open(path, "rb") if path else None
+        except OSError:
+            # The file was removed, e.g. with its cached result
+            f = None
+        if f is None:
+            self.send_error(404)
+            return
+        with f:
+            self.send_response(200)
+            self.send_header("Content-Type", media_type)
+            self.send_header(
+                "Content-Length", str(os.fstat(f.fileno()).st_size)
+            )
+            self.send_header(
+                "Content-Disposition", f'attachment; filename="{filename}"'
+            )
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, FILE_CHUNK_SIZE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileServer:
+    """Local HTTP server of the XYZ tiles of flood rasters and polygons."""
+
+    def __init__(self, host="127.0.0.1", port=0, cache_bytes=64 * 2**20):
+        """
+        Create the server, without starting it.
+
+        Inputs:
+            host (str): Address to listen on.
+            port (int): Port to listen on; 0 for any free port.
+            cache_bytes (int): Maximum size of the tile cache.
+        """
+        self._server = ThreadingHTTPServer((host, port), _TileHandler)
+        self._server.daemon_threads = True
+        self._server.layers = {}
+        self._server.files = {}
+        self._server.cache = TileCache(cache_bytes)
+        self._secret = secrets.token_bytes(32)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def address(self):
+        """Return the base URL of the server."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def cache(self):
+        """Return the tile cache."""
+        return self._server.cache
+
+    def start(self):
+        """Serve the tiles from a daemon thread, and return the server."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._server.serve_forever,
+                    name="tile-server",
+                    daemon=True,
+                )
+                self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server and close the layers."""
+        with self._lock:
+            if self._thread is not None:
+                self._server.shutdown()
+                self._thread = None
+        self._server.server_close()
+        for renderer in list(self._server.layers.values()):
+            renderer.close()
+
+    def add_raster(self, path, color=FLOOD_COLOR, min_value=1):
+        """
+        Serve the tiles of a raster.
+
+        The layer name depends on the path and modification time of the
+        file, so a raster written again is served as a new layer and its
+        cached tiles are not reused.
+        Inputs:
+            path (str): Path of the raster.
+            color (tuple): RGB colour of the flooded pixels.
+            min_value (int): Pixels at least this value are flooded.
+
+        Returns:
+            str: URL template of the tiles, with {z}, {x} and {y}.
+        """
+        return self._add_layer(
+            TileRenderer, path, color=color, min_value=min_value
+        )
+
+    def add_vectors(self, path, layer_name="flood_extent"):
+        """
+        Serve the vector tiles of polygons.
+
+        As for add_raster, the layer name depends on the path and
+        modification time of the file.
+        Inputs:
+            path (str): Path of a FlatGeobuf or GeoParquet file in
+                longitude, latitude, see utils_vector_io.
+            layer_name (str): Name of the layer in the tiles.
+
+        Returns:
+            str: URL template of the tiles, with {z}, {x} and {y}.
+        """
+        return self._add_layer(VectorTileRenderer, path, layer_name=layer_name)
+
+    def add_file(
+        self, path, filename=None, media_type="application/octet-stream"
+    ):
+        """
+        Serve a file for download, streamed in chunks.
+
+        The path of the URL is signed with a secret of the server, so that
+        only the URLs returned here can be downloaded.
+        Inputs:
+            path (str): Path of the file.
+            filename (str): Name of the downloaded file, by default that of
+                the path; letters, digits, '.', '-' and '_' only.
+            media_type (str): Media type of the file.
+
+        Returns:
+            str: URL of the file.
+        """
+        filename = filename or os.path.basename(path)
+        stat = os.stat(path)
+        signature = hmac.new(
+            self._secret,
+            f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{filename}".encode(),
+            hashlib.sha256,
+        ).hexdigest()[:32]
+        with self._lock:
+            self._server.files[signature] = (path, filename, media_type)
+        return f"{self.address}/files/{signature}/{filename}"
+
+    def _add_layer(self, renderer_class, path, **options):
+        """Register a renderer of a file and return its URL template."""
+        stat = os.stat(path)
+        layer = hashlib.sha1(
+            f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{options}".encode()
+        ).hexdigest()[:16]
+        with self._lock:
+            if layer not in self._server.layers:
+                self._server.layers[layer] = renderer_class(path, **options)
+        extension = renderer_class.extension
+        return f"{self.address}/tiles/{layer}/{{z}}/{{x}}/{{y}}.{extension}"
+
+
+def tile_range(bounds, z):
+    """
+    Return the tiles of a zoom level covering geographic bounds.
+
+    Inputs:
+        bounds (tuple): (west, south, east, north) in degrees.
+        z (int): Zoom level.
+
+    Returns:
+        tiles (list): (z, x, y) of the tiles.
+    """
+    west, south, east, north = transform_bounds(
+        "EPSG:4326", "EPSG:3857", *bounds
+    )
+    size = 2 * ORIGIN / 2**z
+    x_min = max(int(math.floor((west + ORIGIN) / size)), 0)
+    x_max = min(int(math.floor((east + ORIGIN) / size)), 2**z - 1)
+    y_min = max(int(math.floor((ORIGIN - north) / size)), 0)
+    y_max = min(int(math.floor((ORIGIN - south) / size)), 2**z - 1)
+    return [
+        (z, x, y)
+        for x in range(x_min, x_max + 1)
+        for y in range(y_min, y_max + 1)
+    ]
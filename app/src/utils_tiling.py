@@ -0,0 +1,229 @@
+"""Functions to split an area of interest into tiles and merge the results."""
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from shapely.geometry import LineString
+
+# Meters per degree of latitude, and of longitude at the equator
+METERS_PER_DEGREE = 111320
+
+# Size in degrees of a 10 m pixel in EPSG:4326, as used by reduceToVectors
+PIXEL_SIZE_DEGREES = 10 / METERS_PER_DEGREE
+
+
+def tile_overlap(smoothing_radius=50, min_connected_pixels=8, scale=10):
+    """
+    Return the overlap needed between tiles to avoid seams, in meters.
+
+    The overlap covers the smoothing kernel and the largest group of pixels
+    that reduce_noise can remove, so that focal_mean and connectedPixelCount
+    give the same result on a tile as on the whole area.
+    Inputs:
+        smoothing_radius (int): Radius of the smoothing kernel in meters.
+        min_connected_pixels (int): Minimum size of a group of pixels kept by
+            the noise reduction.
+        scale (int): Pixel size in meters.
+
+    Returns:
+        float: Overlap in meters.
+    """
+    return smoothing_radius + min_connected_pixels * scale
+
+
+def polygon_bounds(coordinates):
+    """
+    Return the bounding box of a polygon.
+
+    Inputs:
+        coordinates (list): (longitude, latitude) pairs of the polygon.
+
+    Returns:
+        tuple: (west, south, east, north) in degrees.
+    """
+    longitudes = [lon for lon, _ in coordinates]
+    latitudes = [lat for _, lat in coordinates]
+    return min(longitudes), min(latitudes), max(longitudes), max(latitudes)
+
+
+def bounds_side_km(coordinates):
+    """
+    Return the longest side of the bounding box of a polygon, in kilometers.
+
+    Inputs:
+        coordinates (list): (longitude, latitude) pairs of the polygon.
+
+    Returns:
+        float: Longest side in kilometers.
+    """
+    west, south, east, north = polygon_bounds(coordinates)
+    latitude = max(abs(south), abs(north))
+    height = (north - south) * METERS_PER_DEGREE
+    width = (
+        (east - west)
+        * METERS_PER_DEGREE
+        * math.cos(math.radians(min(latitude, 89)))
+    )
+    return max(height, width) / 1000
+
+
+def _snap(value, step):
+    """Snap a coordinate down to a multiple of step."""
+    return math.floor(value / step) * step
+
+
+def split_bounds(bounds, tile_size_km, overlap_m):
+    """
+    Split geographic bounds into a grid of overlapping tiles.
+
+    Tile edges are snapped to the 10 m pixel grid, so that pixels on either
+    side of a seam line up exactly.
+    Inputs:
+        bounds (tuple): (west, south, east, north) in degrees.
+        tile_size_km (float): Side of the tiles in kilometers.
+        overlap_m (float): Overlap between neighbouring tiles in meters.
+
+    Returns:
+        tiles (list): One (core, buffered) pair per tile, each a (west,
+            south, east, north) tuple in degrees. Cores do not overlap and
+            cover the bounds; buffered tiles extend the cores by overlap_m.
+    """
+    west, south, east, north = bounds
+    latitude = max(abs(south), abs(north))
+    meters_per_degree_lon = METERS_PER_DEGREE * math.cos(
+        math.radians(min(latitude, 89))
+    )
+    step_lat = _snap(
+        tile_size_km * 1000 / METERS_PER_DEGREE, PIXEL_SIZE_DEGREES
+    )
+    step_lon = _snap(
+        tile_size_km * 1000 / meters_per_degree_lon, PIXEL_SIZE_DEGREES
+    )
+    step_lat = max(step_lat, PIXEL_SIZE_DEGREES)
+    step_lon = max(step_lon, PIXEL_SIZE_DEGREES)
+    buffer_lat = overlap_m / METERS_PER_DEGREE
+    buffer_lon = overlap_m / meters_per_degree_lon
+
+    tiles = []
+    tile_south = _snap(south, PIXEL_SIZE_DEGREES)
+    while tile_south < north:
+        tile_north = min(tile_south + step_lat, north)
+        tile_west = _snap(west, PIXEL_SIZE_DEGREES)
+        while tile_west < east:
+            tile_east = min(tile_west + step_lon, east)
+            core = (tile_west, tile_south, tile_east, tile_north)
+            buffered = (
+                tile_west - buffer_lon,
+                tile_south - buffer_lat,
+                tile_east + buffer_lon,
+                tile_north + buffer_lat,
+            )
+            tiles.append((core, buffered))
+            tile_west = tile_east
+        tile_south = tile_north
+    return tiles
+
+
+def seam_lines(tiles):
+    """
+    Return the edges shared by neighbouring tile cores.
+
+    Inputs:
+        tiles (list): Tiles as returned by split_bounds.
+
+    Returns:
+        lines (list): shapely LineStrings of the internal tile edges.
+    """
+    cores = [core for core, _ in tiles]
+    west = min(core[0] for core in cores)
+    south = min(core[1] for core in cores)
+    east = max(core[2] for core in cores)
+    north = max(core[3] for core in cores)
+    longitudes = sorted({core[0] for core in cores} - {west})
+    latitudes = sorted({core[1] for core in cores} - {south})
+    return [LineString([(lon, south), (lon, north)]) for lon in longitudes] + [
+        LineString([(west, lat), (east, lat)]) for lat in latitudes
+    ]
+
+
+def run_tiles(function, tiles, max_workers=4):
+    """
+    Run a function on each tile with a bounded pool of workers.
+
+    Inputs:
+        function (callable): Function taking a tile and returning a result.
+        tiles (list): Tiles to process.
+        max_workers (int): Maximum number of tiles processed concurrently.
+
+    Returns:
+        results (list): Results in the same order as tiles.
+    """
+    if max_workers <= 1 or len(tiles) <= 1:
+        return [function(tile) for tile in tiles]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, tiles))
+
+
+def array_windows(shape, tile_size, halo):
+    """
+    Split an array shape into overlapping windows.
+
+    Inputs:
+        shape (tuple): Shape of the array (rows, columns).
+        tile_size (int): Side of the tiles in pixels.
+        halo (int): Number of pixels added on each side of a tile.
+
+    Returns:
+        windows (list): One (core, buffered) pair per tile, each a tuple of
+            two slices (rows, columns).
+    """
+    rows, cols = shape
+    windows = []
+    for row in range(0, rows, tile_size):
+        for col in range(0, cols, tile_size):
+            core = (
+                slice(row, min(row + tile_size, rows)),
+                slice(col, min(col + tile_size, cols)),
+            )
+            buffered = (
+                slice(max(row - halo, 0), min(row + tile_size + halo, rows)),
+                slice(max(col - halo, 0), min(col + tile_size + halo, cols)),
+            )
+            windows.append((core, buffered))
+    return windows
+
+
+def run_array_tiles(function, shape, tile_size, halo, max_workers=4):
+    """
+    Compute arrays tile by tile and merge the tiles without seams.
+
+    Each tile is computed on its buffered window and cropped back to its
+    core, so the halo must be at least the reach of the function.
+    Inputs:
+        function (callable): Function taking a buffered window (a tuple of
+            two slices) and returning a tuple of arrays computed on that
+            window.
+        shape (tuple): Shape of the output arrays.
+        tile_size (int): Side of the tiles in pixels.
+        halo (int): Number of pixels added on each side of a tile.
+        max_workers (int): Maximum number of tiles processed concurrently.
+
+    Returns:
+        outputs (tuple): The merged arrays.
+    """
+    windows = array_windows(shape, tile_size, halo)
+    results = run_tiles(
+        lambda window: function(window[1]), windows, max_workers
+    )
+    outputs = tuple(np.empty(shape, dtype=array.dtype) for array in results[0])
+    for (core, buffered), result in zip(windows, results):
+        offset = tuple(
+            slice(
+                core_slice.start - buffered_slice.start,
+                core_slice.stop - buffered_slice.start,
+            )
+            for core_slice, buffered_slice in zip(core, buffered)
+        )
+        for output, array in zip(outputs, result):
+            output[core] = array[offset]
+    return outputs
@@ -0,0 +1,343 @@
+"""Streamed vector outputs with a spatial index: FlatGeobuf and GeoParquet.
+
+Features are converted one at a time (FlatGeobuf) or in row groups of a
+fixed number of features (GeoParquet), so memory does not grow with the
+number of polygons. Both formats can be read by bounding box without
+loading the whole file:
+
+- FlatGeobuf files are written with their packed Hilbert R-tree, which OGR
+  (and read_features_bbox) uses to read only the features intersecting the
+  box;
+- GeoParquet files have a "bbox" struct column (xmin, ymin, xmax, ymax)
+  declared as the covering of the geometry column, whose row group
+  statistics let readers skip the row groups outside the box.
+"""
+import itertools
+import json
+import os
+
+import shapely
+from shapely.geometry import mapping, shape
+
+# Formats written by write_vectors, by file extension
+VECTOR_FORMATS = {".fgb": "FlatGeobuf", ".parquet": "GeoParquet"}
+
+# Names of the columns of the bounding box of each feature in GeoParquet
+BBOX_FIELDS = ("xmin", "ymin", "xmax", "ymax")
+
+
+def iter_features(path):
+    """
+    Read the features of a vector file one at a time.
+
+    Inputs:
+        path (str): Path of a file readable by OGR, e.g. GeoJSON or
+            FlatGeobuf, or of a GeoParquet file written by write_geoparquet.
+
+    Yields:
+        feature (dict): GeoJSON feature.
+    """
+    if path.lower().endswith(".parquet"):
+        yield from read_features_bbox(path)
+        return
+
+    # Imported here, as only the OGR formats need it
+    import fiona
+
+    with fiona.open(path) as source:
+        yield from _as_geojson(source)
+
+
+def _as_geojson(records):
+    """Convert fiona records into GeoJSON features."""
+    for record in records:
+        yield {
+            "type": "Feature",
+            "geometry": dict(record["geometry"].__geo_interface__),
+            "properties": dict(record["properties"]),
+        }
+
+
+def _batches(iterable, size):
+    """Yield lists of up to size consecutive items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _property_schema(feature):
+    """Return the fiona schema of the properties of a feature."""
+    types = {bool: "bool", int: "int", float: "float"}
+    return {
+        name: types.get(type(value), "str")
+        for name, value in (feature.get("properties") or {}).items()
+    }
+
+
+def write_flatgeobuf(features, path, crs="EPSG:4326", properties=None):
+    """
+    Write features to FlatGeobuf with a packed Hilbert R-tree.
+
+    Features are passed to OGR one at a time; OGR spools them to a temporary
+    file, then sorts them along a Hilbert curve to build the index.
+    Inputs:
+        features (iterable): GeoJSON features, e.g. from iter_features.
+        path (str): Output path.
+        crs (str): Coordinate reference system of the coordinates.
+        properties (dict): fiona schema of the properties, e.g. {"label":
+            "int"}; by default taken from the first feature.
+
+    Returns:
+        count (int): Number of features written.
+    """
+    # Imported here, as only the OGR formats need it
+    import fiona
+
+    features = iter(features)
+    first = next(features, None)
+    if properties is None:
+        properties = _property_schema(first or {})
+    schema = {"geometry": "Unknown", "properties": properties}
+    count = 0
+    with fiona.open(
+        path,
+        "w",
+        driver="FlatGeobuf",
+        crs=crs,
+        schema=schema,
+        SPATIAL_INDEX="YES",
+    ) as destination:
+        for feature in itertools.chain([first] if first else [], features):
+            destination.write(
+                {
+                    "geometry": feature["geometry"],
+                    "properties": {
+                        name: (feature.get("properties") or {}).get(name)
+                        for name in properties
+                    },
+                }
+            )
+            count += 1
+    return count
+
+
+def _geoparquet_metadata(crs):
+    """Return the GeoParquet metadata of a WKB column with a bbox covering."""
+    column = {
+        "encoding": "WKB",
+        # Empty as the types are not known before the end of the stream
+        "geometry_types": [],
+        "covering": {
+            "bbox": {name: ["bbox", name] for name in BBOX_FIELDS},
+        },
+    }
+    if crs not in (None, "EPSG:4326", "OGC:CRS84"):
+        # Longitude, latitude coordinates (the default CRS of GeoParquet) are
+        # left implicit; others are identified by their code
+        authority, code = crs.split(":")
+        column["crs"] = {"id": {"authority": authority, "code": int(code)}}
+    return {
+        "version": "1.1.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": column},
+    }
+
+
+def write_geoparquet(
+    features, path, crs="EPSG:4326", properties=None, row_group_size=10000
+):
+    """
+    Write features to GeoParquet, one row group at a time.
+
+    Geometries are stored as WKB, with the bounding box of each feature in a
+    "bbox" struct column, so that the statistics of each row group give its
+    extent.
+    Inputs:
+        features (iterable): GeoJSON features, e.g. from iter_features.
+        path (str): Output path.
+        crs (str): Coordinate reference system of the coordinates, as
+            'AUTHORITY:CODE'.
+        properties (list): Names of the properties to write; by default
+            those of the first feature, with types inferred from the first
+            row group.
+        row_group_size (int): Number of features per row group, i.e. held
+            in memory at a time.
+
+    Returns:
+        count (int): Number of features written.
+    """
+    # Imported here, as only GeoParquet outputs need Arrow
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer, schema, count = None, None, 0
+    try:
+        for batch in _batches(features, row_group_size):
+            geometries = [shape(feature["geometry"]) for feature in batch]
+            bounds = shapely.bounds(geometries)
+            if properties is None:
+                properties = list(batch[0].get("properties") or {})
+            columns = {
+                name: [
+                    (feature.get("properties") or {}).get(name)
+                    for feature in batch
+                ]
+                for name in properties
+            }
+            columns["bbox"] = pa.StructArray.from_arrays(
+                [pa.array(bounds[:, i]) for i in range(4)],
+                names=list(BBOX_FIELDS),
+            )
+            columns["geometry"] = pa.array(
+                shapely.to_wkb(geometries), pa.binary()
+            )
+            if writer is None:
+                table = pa.table(columns)
+                schema = table.schema.with_metadata(
+                    {"geo": json.dumps(_geoparquet_metadata(crs))}
+                )
+                table = table.replace_schema_metadata(schema.metadata)
+                writer = pq.ParquetWriter(path, schema)
+            else:
+                table = pa.table(columns, schema=schema)
+            writer.write_table(table)
+            count += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        # No feature: write an empty file with the geometry columns only
+        table = pa.table(
+            {
+                "bbox": pa.array(
+                    [],
+                    pa.struct(
+                        [pa.field(name, pa.float64()) for name in BBOX_FIELDS]
+                    ),
+                ),
+                "geometry": pa.array([], pa.binary()),
+            }
+        )
+        pq.write_table(
+            table.replace_schema_metadata(
+                {"geo": json.dumps(_geoparquet_metadata(crs))}
+            ),
+            path,
+        )
+    return count
+
+
+def write_vectors(features, path, crs="EPSG:4326", **options):
+    """
+    Write features to FlatGeobuf or GeoParquet, by file extension.
+
+    Inputs:
+        features (iterable): GeoJSON features, e.g. from iter_features.
+        path (str): Output path, ending with .fgb or .parquet.
+        crs (str): Coordinate reference system of the coordinates.
+        options: Other arguments of write_flatgeobuf or write_geoparquet.
+
+    Returns:
+        count (int): Number of features written.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in VECTOR_FORMATS:
+        raise ValueError(f"Unknown vector format: {extension}")
+    if extension == ".parquet":
+        return write_geoparquet(features, path, crs=crs, **options)
+    return write_flatgeobuf(features, path, crs=crs, **options)
+
+
+def convert_vectors(src_path, dst_path, crs="EPSG:4326", **options):
+    """
+    Convert a vector file to FlatGeobuf or GeoParquet, streaming features.
+
+    Inputs:
+        src_path (str): Path of the file to convert, e.g. GeoJSON.
+        dst_path (str): Output path, ending with .fgb or .parquet.
+        crs (str): Coordinate reference system of the coordinates.
+        options: Other arguments of write_flatgeobuf or write_geoparquet.
+
+    Returns:
+        dst_path (str): Output path.
+    """
+    write_vectors(iter_features(src_path), dst_path, crs=crs, **options)
+    return dst_path
+
+
+def _row_groups_in_bbox(metadata, bbox):
+    """Return the row groups whose bbox statistics intersect a box."""
+    west, south, east, north = bbox
+    paths = {f"bbox.{name}": name for name in BBOX_FIELDS}
+    row_groups = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        extent = {}
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            name = paths.get(column.path_in_schema)
+            if name and column.statistics and column.statistics.has_min_max:
+                extent[name] = column.statistics
+        if len(extent) == 4 and (
+            extent["xmin"].min > east
+            or extent["xmax"].max < west
+            or extent["ymin"].min > north
+            or extent["ymax"].max < south
+        ):
+            continue
+        row_groups.append(i)
+    return row_groups
+
+
+def read_features_bbox(path, bbox=None):
+    """
+    Read the features of a FlatGeobuf or GeoParquet file within a box.
+
+    Only the parts of the file near the box are read: FlatGeobuf through its
+    R-tree, GeoParquet through the statistics of its bbox column.
+    Inputs:
+        path (str): Path of a file written by write_vectors.
+        bbox (tuple): (west, south, east, north) of the box, or None for all
+            features.
+
+    Yields:
+        feature (dict): GeoJSON feature whose bounding box intersects the
+            box.
+    """
+    if not path.lower().endswith(".parquet"):
+        # Imported here, as only the OGR formats need it
+        import fiona
+
+        with fiona.open(path) as source:
+            yield from _as_geojson(
+                source.filter(bbox=bbox) if bbox else source
+            )
+        return
+
+    # Imported here, as only GeoParquet outputs need Arrow
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(path)
+    row_groups = (
+        _row_groups_in_bbox(parquet.metadata, bbox)
+        if bbox
+        else range(parquet.metadata.num_row_groups)
+    )
+    for i in row_groups:
+        for row in parquet.read_row_group(i).to_pylist():
+            box, wkb = row.pop("bbox"), row.pop("geometry")
+            if bbox and (
+                box["xmin"] > bbox[2]
+                or box["xmax"] < bbox[0]
+                or box["ymin"] > bbox[3]
+                or box["ymax"] < bbox[1]
+            ):
+                continue
+            yield {
+                "type": "Feature",
+                "geometry": mapping(shapely.from_wkb(wkb)),
+                "properties": row,
+            }
@@ -0,0 +1,442 @@
+"""Local conversion of binary flood rasters into polygons.
+
+Polygons are traced along pixel edges, so they keep the full resolution of
+the raster, as reduceToVectors does with bestEffort=False. All steps work on
+arrays: labelling (see utils_components), edge extraction, linking each edge
+to the next one, and ordering the edges of each ring with pointer jumping.
+The run time grows with the number of pixels plus a logarithmic factor for
+the sort. Rings passing twice through a vertex where pixels touch by a
+corner are split there, so that all polygons are valid.
+"""
+import json
+import os
+import time
+
+import numpy as np
+import shapely
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from src.utils_components import label as label_components
+from src.utils_vector_io import write_flatgeobuf, write_geoparquet
+
+# Directions of the edges, in the order of left turns when the polygon
+# interior is on the left (exterior rings counter-clockwise)
+WEST, SOUTH, EAST, NORTH = 0, 1, 2, 3
+
+# Output drivers by file extension
+DRIVERS = {
+    ".geojson": "GeoJSON",
+    ".json": "GeoJSON",
+    ".gpkg": "GPKG",
+    ".fgb": "FlatGeobuf",
+    ".parquet": "GeoParquet",
+}
+
+
+def _boundary_edges(labels):
+    """
+    Extract the directed pixel edges between different labels.
+
+    Returns the start and end vertices (as indices on the grid of pixel
+    corners), the direction and the label of each edge.
+    """
+    rows, cols = labels.shape
+    padded = np.pad(labels, 1)
+    centre = padded[1:-1, 1:-1]
+    n_cols = cols + 1
+    starts, ends, directions, edge_labels = [], [], [], []
+    # (neighbour, start corner offset, end corner offset, direction)
+    sides = (
+        (padded[:-2, 1:-1], (0, 1), (0, 0), WEST),
+        (padded[1:-1, :-2], (0, 0), (1, 0), SOUTH),
+        (padded[2:, 1:-1], (1, 0), (1, 1), EAST),
+        (padded[1:-1, 2:], (1, 1), (0, 1), NORTH),
+    )
+    for neighbour, start, end, direction in sides:
+        row, col = np.nonzero((centre != neighbour) & (centre > 0))
+        starts.append((row + start[0]) * n_cols + col + start[1])
+        ends.append((row + end[0]) * n_cols + col + end[1])
+        directions.append(np.full(row.size, direction, dtype="int8"))
+        edge_labels.append(centre[row, col])
+    return (
+        np.concatenate(starts),
+        np.concatenate(ends),
+        np.concatenate(directions),
+        np.concatenate(edge_labels).astype("int64"),
+    )
+
+
+def _next_edges(starts, ends, directions, edge_labels, n_vertices):
+    """
+    Link each edge to the next edge of its ring.
+
+    Where two edges of the same label leave a vertex (pixels of the same
+    label touching by a corner), the edge turning left is chosen, which
+    keeps the pixels apart: their interiors only touch at the vertex, so
+    that they are parts of a multipolygon with 8-connectivity. Also returns
+    the pairs of edges entering each such vertex, see _split_rings.
+    """
+    start_keys = edge_labels * n_vertices + starts
+    order = np.argsort(start_keys, kind="stable")
+    sorted_keys = start_keys[order]
+    end_keys = edge_labels * n_vertices + ends
+    first = np.searchsorted(sorted_keys, end_keys, side="left")
+    count = np.searchsorted(sorted_keys, end_keys, side="right") - first
+    candidate = order[first]
+    saddle = count == 2
+    if saddle.any():
+        preferred = (directions[saddle] + 1) % 4
+        second = order[first[saddle] + 1]
+        use_second = directions[second] == preferred
+        candidate[saddle] = np.where(use_second, second, candidate[saddle])
+    # Both edges of a label entering a saddle vertex, side by side
+    entering = np.nonzero(saddle)[0]
+    pairs = entering[np.argsort(end_keys[entering], kind="stable")]
+    return candidate, pairs.reshape(-1, 2)
+
+
+def _ring_ids(next_edge):
+    """Return the id of the ring of each edge."""
+    n_edges = next_edge.size
+    graph = coo_matrix(
+        (np.ones(n_edges), (np.arange(n_edges), next_edge)),
+        shape=(n_edges, n_edges),
+    )
+    return connected_components(graph, directed=False)[1]
+
+
+def _split_rings(next_edge, saddle_pairs):
+    """
+    Split the rings passing twice through a saddle vertex.
+
+    Background pixels touching by a corner are joined by the left turns, so
+    that a ring can pass twice through a vertex and touch itself, which is
+    invalid. Swapping the next edges of the two edges entering the vertex
+    splits the ring into two rings touching there: an exterior ring and a
+    hole, or two holes. As rings do not cross, splitting at a vertex never
+    joins the visits of another vertex, and one pass is enough; the loop
+    only checks it.
+    """
+    next_edge = next_edge.copy()
+    while saddle_pairs.size:
+        ring = _ring_ids(next_edge)
+        same = ring[saddle_pairs[:, 0]] == ring[saddle_pairs[:, 1]]
+        if not same.any():
+            break
+        first, second = saddle_pairs[same].T
+        next_edge[first], next_edge[second] = (
+            next_edge[second],
+            next_edge[first],
+        )
+    return next_edge
+
+
+def _order_rings(next_edge):
+    """
+    Group the edges into rings and order the edges within each ring.
+
+    Returns the ring id of each edge and the order of the edges, sorted by
+    ring and by position along the ring.
+    """
+    n_edges = next_edge.size
+    ring = _ring_ids(next_edge)
+    # Break each ring after its first edge and rank the edges by their
+    # distance to the end of the chain, with pointer jumping
+    first_edge = np.full(ring.max() + 1, n_edges)
+    np.minimum.at(first_edge, ring, np.arange(n_edges))
+    successor = next_edge.copy()
+    is_last = next_edge == first_edge[ring]
+    successor[is_last] = np.nonzero(is_last)[0]
+    distance = (~is_last).astype("int64")
+    while True:
+        jumped = successor[successor]
+        if np.array_equal(jumped, successor):
+            break
+        distance = distance + distance[successor]
+        successor = jumped
+    order = np.lexsort((-distance, ring))
+    return ring, order
+
+
+def _signed_areas(x, y, ring_starts):
+    """Return the signed area of each ring with the shoelace formula."""
+    x_next = np.empty_like(x)
+    y_next = np.empty_like(y)
+    x_next[:-1], y_next[:-1] = x[1:], y[1:]
+    ring_ends = np.append(ring_starts[1:], x.size) - 1
+    x_next[ring_ends], y_next[ring_ends] = x[ring_starts], y[ring_starts]
+    return np.add.reduceat(x * y_next - x_next * y, ring_starts) / 2
+
+
+def vectorise_mask(
+    mask,
+    transform=(0, 1, 0, 0, 0, -1),
+    connectivity=4,
+    holes=True,
+    min_hole_area=0,
+    labels=None,
+):
+    """
+    Convert a binary mask into polygons.
+
+    Inputs:
+        mask (np.ndarray): Binary mask, True for flooded pixels.
+        transform (tuple): GDAL-style geotransform of the mask.
+        connectivity (int): 4 (as reduceToVectors with eightConnected=False)
+            or 8.
+        holes (bool): If False, holes are filled.
+        min_hole_area (float): Holes smaller than this area, in squared
+            units of the coordinate reference system, are filled.
+        labels (np.ndarray): Precomputed labels of the mask, e.g. from
+            utils_components.label_tiled. If None, the mask is labelled here.
+
+    Returns:
+        flood_vectors (dict): GeoJSON FeatureCollection with one polygon per
+            group of pixels, with the properties "label" and "count" as
+            reduceToVectors; with 8-connectivity, pixels touching by a
+            corner give multipolygons. All polygons are valid.
+    """
+    if labels is None:
+        labels, pixel_counts = label_components(mask, connectivity)
+    else:
+        pixel_counts = np.bincount(labels.ravel())
+    if not labels.any():
+        return {"type": "FeatureCollection", "features": []}
+    n_cols = labels.shape[1] + 1
+    n_vertices = (labels.shape[0] + 1) * n_cols
+    starts, ends, directions, edge_labels = _boundary_edges(labels)
+    next_edge, saddle_pairs = _next_edges(
+        starts, ends, directions, edge_labels, n_vertices
+    )
+    ring, order = _order_rings(_split_rings(next_edge, saddle_pairs))
+
+    # Keep only the corners of the rings, where the direction changes
+    ordered_ring = ring[order]
+    ordered_directions = directions[order]
+    ring_change = np.r_[True, ordered_ring[1:] != ordered_ring[:-1]]
+    ring_first = np.nonzero(ring_change)[0]
+    previous = np.empty_like(order)
+    previous[1:] = np.arange(order.size - 1)
+    ring_last = np.append(ring_first[1:], order.size) - 1
+    previous[ring_first] = ring_last
+    corner = ordered_directions != ordered_directions[previous]
+    vertices = starts[order][corner]
+    corner_ring = ordered_ring[corner]
+    corner_labels = edge_labels[order][corner]
+    ring_change = np.r_[True, corner_ring[1:] != corner_ring[:-1]]
+    ring_starts = np.nonzero(ring_change)[0]
+
+    x0, pixel_width, row_rotation, y0, col_rotation, pixel_height = transform
+    row, col = np.divmod(vertices, n_cols)
+    x = x0 + col * pixel_width + row * row_rotation
+    y = y0 + col * col_rotation + row * pixel_height
+    # Areas in grid units, positive for exterior rings whatever the sign of
+    # the pixel height
+    areas = _signed_areas(
+        col.astype("float64"), -row.astype("float64"), ring_starts
+    )
+    pixel_area = abs(pixel_width * pixel_height)
+
+    # Close the rings by repeating their first vertex, and convert all the
+    # coordinates to lists at once
+    ring_ends = np.append(ring_starts[1:], vertices.size)
+    closed = np.insert(np.arange(vertices.size), ring_ends, ring_starts)
+    coordinates = np.column_stack((x[closed], y[closed])).tolist()
+    closed_starts = ring_starts + np.arange(ring_starts.size)
+    closed_ends = ring_ends + np.arange(1, ring_starts.size + 1)
+
+    exteriors, interiors = {}, {}
+    for label, start, end, area in zip(
+        corner_labels[ring_starts].tolist(),
+        closed_starts.tolist(),
+        closed_ends.tolist(),
+        areas.tolist(),
+    ):
+        if area > 0:
+            exteriors.setdefault(label, []).append(coordinates[start:end])
+        elif holes and -area * pixel_area >= min_hole_area:
+            interiors.setdefault(label, []).append(coordinates[start:end])
+
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": _polygon_geometry(rings, interiors.get(label, [])),
+                "properties": {
+                    "label": 1,
+                    "count": int(pixel_counts[label]),
+                },
+            }
+            for label, rings in sorted(exteriors.items())
+        ],
+    }
+
+
+def _polygon_geometry(exteriors, interiors):
+    """
+    Return the GeoJSON geometry of the rings of one group of pixels.
+
+    A group has several exterior rings only with 8-connectivity, where
+    pixels touching by a corner are parts of a multipolygon touching there;
+    its holes are then given to the part containing them.
+    """
+    if len(exteriors) == 1:
+        return {"type": "Polygon", "coordinates": exteriors + interiors}
+    polygons = [[exterior] for exterior in exteriors]
+    shells = np.array([shapely.Polygon(exterior) for exterior in exteriors])
+    shapely.prepare(shells)
+    for interior in interiors:
+        point = shapely.Polygon(interior).representative_point()
+        polygons[int(np.argmax(shapely.contains(shells, point)))].append(
+            interior
+        )
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def write_features(flood_vectors, path, crs="EPSG:4326", driver=None):
+    """
+    Write polygons to GeoJSON, GeoPackage, FlatGeobuf or GeoParquet.
+
+    FlatGeobuf and GeoParquet files have a spatial index, see
+    utils_vector_io.
+    Inputs:
+        flood_vectors (dict): GeoJSON FeatureCollection.
+        path (str): Output path; the format is taken from its extension
+            (.geojson, .gpkg, .fgb or .parquet) unless driver is given.
+        crs (str): Coordinate reference system of the coordinates.
+        driver (str): OGR driver name, e.g. 'GPKG'.
+
+    Returns:
+        path (str): Output path.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    driver = driver or DRIVERS.get(extension)
+    if driver is None:
+        raise ValueError(f"Unknown vector format: {extension}")
+    if driver == "GeoJSON":
+        with open(path, "w") as f:
+            json.dump(flood_vectors, f)
+        return path
+    records = (
+        {
+            "type": "Feature",
+            "geometry": feature["geometry"],
+            "properties": {
+                "label": feature["properties"].get("label", 1),
+                "count": feature["properties"].get("count", 0),
+            },
+        }
+        for feature in flood_vectors["features"]
+    )
+    if driver == "GeoParquet":
+        write_geoparquet(records, path, crs=crs)
+        return path
+    if driver == "FlatGeobuf":
+        write_flatgeobuf(
+            records, path, crs=crs, properties={"label": "int", "count": "int"}
+        )
+        return path
+
+    # Imported here, as only the binary formats need OGR
+    import fiona
+
+    # Polygons, and multipolygons of pixels touching by a corner
+    schema = {
+        "geometry": "Unknown",
+        "properties": {"label": "int", "count": "int"},
+    }
+    with fiona.open(
+        path, "w", driver=driver, crs=crs, schema=schema
+    ) as destination:
+        destination.writerecords(records)
+    return path
+
+
+def vectorise_raster(path, output_path, min_value=1, connectivity=4):
+    """
+    Convert the flooded pixels of a raster file into a polygon file.
+
+    Inputs:
+        path (str): Path of the raster, e.g. downloaded with
+            utils_download.download_image.
+        output_path (str): Output path, see write_features.
+        min_value (int): Pixels at least this value are flooded, e.g. a
+            level of utils_flood_analysis.threshold_levels.
+        connectivity (int): 4 or 8, see vectorise_mask.
+
+    Returns:
+        output_path (str): Output path.
+    """
+    # Imported here, as only rasters on disk need rasterio
+    import rasterio
+
+    with rasterio.open(path) as src:
+        mask = src.read(1) >= min_value
+        transform = src.transform.to_gdal()
+        crs = src.crs.to_string()
+    return write_features(
+        vectorise_mask(mask, transform, connectivity=connectivity),
+        output_path,
+        crs=crs,
+    )
+
+
+def benchmark_against_ee(flood_rasters, region, scale=10):
+    """
+    Time the local vectoriser against reduceToVectors on the same raster.
+
+    The raster is downloaded once at the given scale, then vectorised locally
+    and on Earth Engine (with bestEffort=False, so both keep the full
+    resolution).
+    Inputs:
+        flood_rasters (ee.Image): Detected flood extents as a binary raster.
+        region (ee.Geometry): Region small enough for a single download.
+        scale (int): Pixel size in meters.
+
+    Returns:
+        results (dict): Run time in seconds and number of polygons of each
+            path, and the time spent downloading the raster.
+    """
+    # Imported here, so that the local vectoriser does not need Earth Engine
+    import ee
+    import rasterio
+    import requests
+
+    start = time.perf_counter()
+    url = (
+        flood_rasters.unmask(0)
+        .toByte()
+        .getDownloadUrl(
+            {"region": region, "scale": scale, "format": "GEO_TIFF"}
+        )
+    )
+    with rasterio.MemoryFile(requests.get(url).content) as memory_file:
+        with memory_file.open() as src:
+            mask = src.read(1) > 0
+            transform = src.transform.to_gdal()
+    download_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    local_vectors = vectorise_mask(mask, transform)
+    local_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ee_vectors = flood_rasters.reduceToVectors(
+        scale=scale,
+        geometryType="polygon",
+        geometry=region,
+        eightConnected=False,
+        bestEffort=False,
+        maxPixels=1e13,
+    ).getInfo()
+    ee_time = time.perf_counter() - start
+
+    return {
+        "download_seconds": download_time,
+        "local_seconds": local_time,
+        "local_polygons": len(local_vectors["features"]),
+        "ee_seconds": ee_time,
+        "ee_polygons": len(ee_vectors["features"]),
+        "ee_version": ee.__version__,
+    }
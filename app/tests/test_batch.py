@@ -0,0 +1,170 @@
+"""Tests of the batch manifests and of resuming interrupted batches."""
+import json
+
+import pytest
+from src.utils_batch import bbox_geometry, load_state, read_manifest, run_batch
+
+DATES = {
+    "before_start_date": "2022-01-01",
+    "before_end_date": "2022-01-31",
+    "after_start_date": "2022-02-01",
+    "after_end_date": "2022-02-28",
+}
+BBOX = "10,20,10.5,20.5"
+
+
+def write(path, text):
+    """Write a manifest and return its path as a string."""
+    path.write_text(text)
+    return str(path)
+
+
+def make_jobs(count):
+    """Return jobs with distinct ids and the same small area."""
+    return [
+        dict(id=f"job_{index}", geometry=bbox_geometry(BBOX), **DATES)
+        for index in range(count)
+    ]
+
+
+def test_read_csv(tmp_path):
+    """CSV rows are read as jobs, with bbox and typed parameters."""
+    header = "id,bbox," + ",".join(DATES) + ",difference_threshold"
+    rows = [
+        f'a,"{BBOX}",' + ",".join(DATES.values()) + ",1.5",
+        f'b,"{BBOX}",' + ",".join(DATES.values()) + ",",
+    ]
+    path = write(tmp_path / "jobs.csv", "\n".join([header] + rows) + "\n")
+    jobs = read_manifest(path)
+    assert [job["id"] for job in jobs] == ["a", "b"]
+    assert jobs[0]["geometry"] == bbox_geometry(BBOX)
+    assert jobs[0]["difference_threshold"] == 1.5
+    assert "difference_threshold" not in jobs[1]
+    assert all(job[field] == DATES[field] for job in jobs for field in DATES)
+
+
+def test_read_yaml_defaults(tmp_path):
+    """YAML jobs inherit the defaults and can override them."""
+    defaults = "\n".join(f"  {key}: '{value}'" for key, value in DATES.items())
+    text = (
+        f"defaults:\n{defaults}\n  polarization: VH\n"
+        f"jobs:\n"
+        f"  - id: a\n    bbox: [10, 20, 10.5, 20.5]\n"
+        f"  - bbox: '{BBOX}'\n    polarization: VV\n"
+    )
+    jobs = read_manifest(write(tmp_path / "jobs.yaml", text))
+    assert [job["id"] for job in jobs] == ["a", "job_2"]
+    assert [job["polarization"] for job in jobs] == ["VH", "VV"]
+    assert jobs[0]["geometry"] == jobs[1]["geometry"]
+    assert jobs[1]["after_end_date"] == DATES["after_end_date"]
+
+
+def test_read_geojson(tmp_path):
+    """Features are jobs, identified by their id property or feature id."""
+    features = [
+        {
+            "type": "Feature",
+            "id": feature_id,
+            "properties": dict(DATES, **properties),
+            "geometry": bbox_geometry(BBOX),
+        }
+        for feature_id, properties in [("f1", {"id": "a"}), ("f2", {})]
+    ]
+    text = json.dumps({"type": "FeatureCollection", "features": features})
+    jobs = read_manifest(write(tmp_path / "jobs.geojson", text))
+    assert [job["id"] for job in jobs] == ["a", "f2"]
+    assert jobs[1]["geometry"] == bbox_geometry(BBOX)
+
+
+@pytest.mark.parametrize(
+    "name, text, message",
+    [
+        ("jobs.txt", "", "Unknown manifest format"),
+        (
+            "jobs.csv",
+            "id,bbox," + ",".join(DATES) + "\n"
+            f'a,"{BBOX}",' + ",".join(DATES.values()) + "\n"
+            f'a,"{BBOX}",' + ",".join(DATES.values()) + "\n",
+            "unique",
+        ),
+        ("jobs.csv", "id,bbox\na," + f'"{BBOX}"\n', "has no before_start"),
+        ("jobs.csv", "id," + ",".join(DATES) + "\na,1,2,3,4\n", "geometry"),
+    ],
+)
+def test_read_invalid(tmp_path, name, text, message):
+    """Invalid manifests raise a ValueError naming the problem."""
+    with pytest.raises(ValueError, match=message):
+        read_manifest(write(tmp_path / name, text))
+
+
+def test_resume_skips_done_jobs(tmp_path):
+    """A batch run again only runs the jobs that did not complete."""
+    state_path = str(tmp_path / "state.json")
+    jobs = make_jobs(4)
+    calls = []
+
+    def run(job):
+        """Fail the second job, and record the calls."""
+        calls.append(job["id"])
+        if job["id"] == "job_1":
+            raise ValueError("invalid job")
+        return {"id": job["id"]}
+
+    state = run_batch(jobs, run, state_path, retries=0, progress=lambda _: 0)
+    assert sorted(calls) == [job["id"] for job in jobs]
+    assert state["jobs"]["job_1"]["status"] == "failed"
+    assert "ValueError: invalid job" in state["jobs"]["job_1"]["error"]
+    assert load_state(state_path)["jobs"] == state["jobs"]
+
+    calls.clear()
+    state = run_batch(jobs, run, state_path, retries=0, progress=lambda _: 0)
+    assert calls == ["job_1"]
+    assert state["ran"] == ["job_1"]
+    assert state["jobs"]["job_0"]["outputs"] == {"id": "job_0"}
+
+
+def test_resume_reruns_changed_and_forced_jobs(tmp_path):
+    """Jobs whose parameters changed, or all jobs with force, run again."""
+    state_path = str(tmp_path / "state.json")
+    jobs = make_jobs(3)
+    messages = []
+    run_batch(jobs, lambda job: {}, state_path, progress=messages.append)
+    assert not any("Skipping" in message for message in messages)
+
+    jobs[2]["difference_threshold"] = 2.0
+    messages.clear()
+    state = run_batch(
+        jobs, lambda job: {}, state_path, progress=messages.append
+    )
+    assert state["ran"] == ["job_2"]
+    assert messages[0] == "Skipping 2 completed job(s)"
+
+    state = run_batch(
+        jobs, lambda job: {}, state_path, force=True, progress=messages.append
+    )
+    assert sorted(state["ran"]) == [job["id"] for job in jobs]
+
+
+def test_retries(tmp_path, monkeypatch):
+    """Errors other than ValueError are retried up to the limit."""
+    monkeypatch.setattr("src.utils_batch.time.sleep", lambda seconds: None)
+    attempts = {}
+
+    def run(job):
+        """Fail the first attempt of every job, and always for job_1."""
+        attempts[job["id"]] = attempts.get(job["id"], 0) + 1
+        if attempts[job["id"]] == 1 or job["id"] == "job_1":
+            raise RuntimeError("timeout")
+        return {}
+
+    state = run_batch(
+        make_jobs(2),
+        run,
+        str(tmp_path / "state.json"),
+        retries=2,
+        progress=lambda _: 0,
+    )
+    assert state["jobs"]["job_0"]["status"] == "done"
+    assert state["jobs"]["job_0"]["attempts"] == 2
+    assert state["jobs"]["job_1"]["status"] == "failed"
+    assert state["jobs"]["job_1"]["attempts"] == 3
@@ -0,0 +1,154 @@
+"""Tests of the two-tier result cache."""
+import pickle
+import threading
+import time
+
+import pytest
+from src import utils_cache
+from src.utils_cache import ResultCache, canonical_hash
+
+
+class Clock:
+    """Replacement of time.monotonic and time.time, advanced by hand."""
+
+    def __init__(self):
+        """Start at the current time."""
+        self.now = time.time()
+
+    def __call__(self):
+        """Return the current time of the clock."""
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Patch the clocks of the cache module."""
+    clock = Clock()
+    monkeypatch.setattr(utils_cache.time, "monotonic", clock)
+    monkeypatch.setattr(utils_cache.time, "time", clock)
+    return clock
+
+
+def record_size(record):
+    """Return the size of a pickled record, as counted by the cache."""
+    return len(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def test_canonical_hash_of_equivalent_payloads():
+    """Key order and float noise below the precision give the same hash."""
+    first = canonical_hash({"aoi": [1.00000001, 2.0], "threshold": 1.25})
+    second = canonical_hash({"threshold": 1.25, "aoi": [1.0, 2.0]})
+    assert first == second
+    assert first != canonical_hash({"aoi": [1.0, 2.0], "threshold": 1.5})
+
+
+def test_memory_tier_evicts_least_recently_used():
+    """Without a disk tier, evicted records are gone and reported."""
+    evicted = []
+    record = {"value": "x" * 100}
+    cache = ResultCache(
+        max_memory_bytes=2 * record_size(record), on_evict=evicted.append
+    )
+    cache.put("a", record)
+    cache.put("b", record)
+    assert cache.get("a") == record
+    cache.put("c", record)
+    assert evicted == ["b"]
+    assert cache.get("b") is None
+    assert cache.get("a") == record
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_keeps_records_evicted_from_memory(tmp_path):
+    """Records evicted from memory are read back from disk."""
+    evicted = []
+    record = {"value": "x" * 100}
+    cache = ResultCache(
+        cache_dir=str(tmp_path),
+        max_memory_bytes=record_size(record),
+        on_evict=evicted.append,
+    )
+    cache.put("a", record)
+    cache.put("b", record)
+    assert cache.get("a") == record
+    stats = cache.stats()
+    assert stats["disk_hits"] == 1
+    assert stats["memory_records"] == 1
+    assert evicted == []
+
+
+def test_disk_tier_evicts_above_size_limit(tmp_path):
+    """The least recently used files are removed and reported."""
+    evicted = []
+    record = {"value": "x" * 100}
+    cache = ResultCache(
+        cache_dir=str(tmp_path),
+        max_memory_bytes=0,
+        max_disk_bytes=2 * record_size(record),
+        on_evict=evicted.append,
+    )
+    for key in ("a", "b", "c"):
+        cache.put(key, record)
+        # Modification times order the files for eviction
+        (tmp_path / f"{key}.pkl").touch()
+        time.sleep(0.01)
+    assert evicted == ["a"]
+    assert cache.get("a") is None
+    assert cache.get("c") == record
+
+
+def test_records_expire_after_ttl_in_memory(clock):
+    """Records not used for ttl_seconds are evicted and reported."""
+    evicted = []
+    cache = ResultCache(ttl_seconds=60, on_evict=evicted.append)
+    cache.put("a", {"value": 1})
+    cache.put("b", {"value": 2})
+    clock.now += 30
+    assert cache.get("b") == {"value": 2}
+    clock.now += 40
+    assert cache.get("a") is None
+    assert cache.get("b") == {"value": 2}
+    assert evicted == ["a"]
+    assert cache.stats()["expirations"] == 1
+
+
+def test_records_expire_after_ttl_on_disk(tmp_path, clock):
+    """Expired files are removed once, with one on_evict call each."""
+    evicted = []
+    cache = ResultCache(
+        cache_dir=str(tmp_path), ttl_seconds=60, on_evict=evicted.append
+    )
+    cache.put("a", {"value": 1})
+    clock.now += 120
+    assert cache.get("a") is None
+    assert not (tmp_path / "a.pkl").exists()
+    assert evicted == ["a"]
+    assert cache.stats()["expirations"] == 1
+
+
+def test_get_without_count_leaves_counters():
+    """Reads for an update are not counted as hits or misses."""
+    cache = ResultCache()
+    cache.put("a", {"value": 1})
+    assert cache.get("a", count=False) == {"value": 1}
+    assert cache.get("b", count=False) is None
+    stats = cache.stats()
+    assert stats["memory_hits"] == stats["misses"] == 0
+
+
+def test_concurrent_updates_keep_all_fields(tmp_path):
+    """Updates of one record from many threads keep every field."""
+    cache = ResultCache(cache_dir=str(tmp_path))
+
+    def update(thread):
+        for i in range(50):
+            cache.update("a", **{f"field_{thread}_{i}": i})
+
+    threads = [
+        threading.Thread(target=update, args=(thread,)) for thread in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache.get("a")) == 8 * 50
@@ -0,0 +1,121 @@
+"""Tests of the local flood pipeline against direct reference stages."""
+import numpy as np
+import pytest
+from benchmarks.synthetic import DATES, synthetic_local_inputs
+from scipy import ndimage
+from src.utils_flood_analysis import derive_flood_extents
+from src.utils_flood_analysis_local import (
+    EE_TOLERANCE,
+    check_agreement,
+    check_smoothing,
+    reduce_noise,
+    smooth,
+)
+from src.utils_speckle import circular_kernel
+from src.utils_static_masks import FLAT_BIT, LAND_BIT, build_static_mask
+
+PIXEL_SIZE = 10
+
+
+def reference_focal_mean(image, pixel_size=PIXEL_SIZE, radius=50):
+    """Return the focal mean ignoring NaN pixels, by direct convolution."""
+    kernel = circular_kernel(radius / pixel_size)
+    valid = ~np.isnan(image)
+    values = np.where(valid, image, 0).astype("float64")
+    totals = ndimage.convolve(values, kernel, mode="constant")
+    counts = ndimage.convolve(valid.astype("float64"), kernel, mode="constant")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        filtered = totals / counts
+    filtered[~valid] = np.nan
+    return filtered
+
+
+def reference_reduce_noise(mask, min_connected_pixels=8):
+    """Remove the 8-connected groups smaller than min_connected_pixels."""
+    labels, _ = ndimage.label(mask, structure=np.ones((3, 3)))
+    sizes = np.bincount(labels.ravel())
+    return mask & (sizes[labels] >= min_connected_pixels)
+
+
+def reference_flood_raster(local_inputs, difference_threshold=1.25):
+    """Return the flood raster of synthetic inputs from reference stages."""
+    before, after = (scene["VH"] for scene in local_inputs["scenes"])
+    difference = reference_focal_mean(after) / reference_focal_mean(before)
+    static_mask = build_static_mask(
+        local_inputs["surface_water"], local_inputs["dem"], PIXEL_SIZE
+    )
+    with np.errstate(invalid="ignore"):
+        flooded = (difference > difference_threshold) & (
+            static_mask & LAND_BIT != 0
+        )
+    return reference_reduce_noise(flooded) & (static_mask & FLAT_BIT != 0)
+
+
+@pytest.fixture(scope="module")
+def local_inputs():
+    """Return synthetic inputs of 3 km, with flooded patches and hills."""
+    return synthetic_local_inputs(3, pixel_size=PIXEL_SIZE)
+
+
+def test_smooth_matches_reference_within_rtol(local_inputs):
+    """The FFT focal mean matches a direct convolution within rtol."""
+    image = local_inputs["scenes"][0]["VH"].copy()
+    image[:40, :25] = np.nan
+    relative_error, within_tolerance = check_smoothing(
+        smooth(image, PIXEL_SIZE), reference_focal_mean(image)
+    )
+    assert within_tolerance, relative_error
+    assert relative_error <= EE_TOLERANCE["rtol"]
+
+
+def test_check_smoothing_detects_differences():
+    """Differences above rtol are reported as out of tolerance."""
+    image = np.full((4, 4), -15.0)
+    assert check_smoothing(image, image) == (0.0, True)
+    _, within_tolerance = check_smoothing(image * (1 + 1e-3), image)
+    assert not within_tolerance
+
+
+@pytest.mark.parametrize("density", [0.1, 0.3, 0.5])
+def test_reduce_noise_matches_scipy_label(density):
+    """Noise removal keeps the same pixels as scipy.ndimage.label."""
+    mask = np.random.default_rng(1).random((120, 90)) < density
+    np.testing.assert_array_equal(
+        reduce_noise(mask), reference_reduce_noise(mask)
+    )
+
+
+@pytest.mark.parametrize("tile_size_km", [None, 1])
+def test_derive_flood_extents_numpy_matches_reference(
+    local_inputs, tile_size_km
+):
+    """Untiled and tiled runs agree with the reference stages."""
+    flood_vectors, flood_rasters, before, after = derive_flood_extents(
+        None,
+        **DATES,
+        backend="numpy",
+        local_inputs=local_inputs,
+        tile_size_km=tile_size_km,
+    )
+    expected = reference_flood_raster(local_inputs)
+    assert expected.any()
+    agreement, within_tolerance = check_agreement(flood_rasters, expected)
+    assert within_tolerance, agreement
+    _, within_tolerance = check_smoothing(
+        before, reference_focal_mean(local_inputs["scenes"][0]["VH"])
+    )
+    assert within_tolerance
+    assert flood_vectors["features"]
+    assert sum(
+        feature["properties"]["count"] for feature in flood_vectors["features"]
+    ) == int(flood_rasters.sum())
+
+
+def test_check_agreement_tolerance():
+    """Agreement below EE_TOLERANCE is reported as out of tolerance."""
+    reference = np.zeros((10, 100), dtype=bool)
+    flood_raster = reference.copy()
+    flood_raster[0, :4] = True
+    assert check_agreement(flood_raster, reference) == (0.996, True)
+    flood_raster[0, :6] = True
+    assert not check_agreement(flood_raster, reference)[1]
@@ -0,0 +1,185 @@
+"""Tests of the topology-preserving generalisation of flood polygons."""
+import numpy as np
+import pytest
+import rasterio.features
+import shapely
+from rasterio.transform import Affine
+from shapely.geometry import shape
+from src.utils_generalise import (
+    build_topology,
+    count_vertices,
+    generalise,
+    simplify_topology,
+    topology_to_geojson,
+    topology_to_topojson,
+)
+from src.utils_vectorise import vectorise_mask
+
+TRANSFORM = Affine(10, 0, 500000, 0, -10, 4000000)
+
+# Step of the quantisation grid, in meters
+QUANTUM = 0.01
+
+
+def random_masks():
+    """Return random masks of several densities, with many holes."""
+    generator = np.random.default_rng(0)
+    return [generator.random((40, 50)) < d for d in (0.3, 0.5, 0.6, 0.7)]
+
+
+def partition(seed, shape=(60, 80), regions=8):
+    """
+    Return polygons tiling a rectangle, with jagged shared boundaries.
+
+    The regions are the pixels nearest to random seeds, so that their
+    boundaries follow staircases of the pixel grid.
+    """
+    generator = np.random.default_rng(seed)
+    seeds = generator.random((regions, 2)) * shape
+    rows, cols = np.indices(shape)
+    distances = np.hypot(
+        rows[..., None] - seeds[:, 0], cols[..., None] - seeds[:, 1]
+    )
+    labels = distances.argmin(axis=-1).astype("int32")
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": geometry,
+                "properties": {"label": int(value)},
+            }
+            for geometry, value in rasterio.features.shapes(
+                labels, transform=TRANSFORM
+            )
+        ],
+    }
+
+
+def geometries(flood_vectors):
+    """Return the shapely geometries of a FeatureCollection."""
+    return [
+        shape(feature["geometry"]) for feature in flood_vectors["features"]
+    ]
+
+
+def simplified(flood_vectors, tolerance):
+    """Return the features simplified with a tolerance in meters."""
+    topology = build_topology(flood_vectors, quantum=QUANTUM)
+    return topology_to_geojson(simplify_topology(topology, tolerance))
+
+
+@pytest.mark.parametrize("tolerance", [0, 10, 25, 60])
+@pytest.mark.parametrize("connectivity", [4, 8])
+@pytest.mark.parametrize("mask", random_masks())
+def test_simplified_polygons_are_valid(mask, connectivity, tolerance):
+    """Simplified polygons are valid, and a tolerance of 0 loses nothing."""
+    flood_vectors = vectorise_mask(
+        mask, TRANSFORM.to_gdal(), connectivity=connectivity
+    )
+    output = simplified(flood_vectors, tolerance)
+    polygons = geometries(output)
+    assert all(shapely.is_valid(polygons)), [
+        shapely.is_valid_reason(polygon) for polygon in polygons
+    ]
+    assert count_vertices(output) <= count_vertices(flood_vectors)
+    if tolerance == 0:
+        original = shapely.union_all(geometries(flood_vectors))
+        assert shapely.union_all(polygons).symmetric_difference(
+            original
+        ).area == pytest.approx(0, abs=1e-6)
+        # Parts of multipolygons are written as separate polygons
+        assert len(polygons) == sum(
+            len(getattr(geometry, "geoms", [geometry]))
+            for geometry in geometries(flood_vectors)
+        )
+
+
+@pytest.mark.parametrize("tolerance", [10, 25, 60])
+@pytest.mark.parametrize("seed", range(3))
+def test_shared_boundaries_stay_shared(seed, tolerance):
+    """Neighbouring polygons neither overlap nor leave gaps."""
+    flood_vectors = partition(seed)
+    original = geometries(flood_vectors)
+    output = simplified(flood_vectors, tolerance)
+    polygons = geometries(output)
+    assert len(polygons) == len(original)
+    assert count_vertices(output) < count_vertices(flood_vectors)
+    assert all(shapely.is_valid(polygons))
+
+    # The rectangle is still tiled: no overlap and no gap
+    extent = shapely.union_all(original)
+    union = shapely.union_all(polygons)
+    assert sum(polygon.area for polygon in polygons) == pytest.approx(
+        extent.area
+    )
+    assert union.symmetric_difference(extent).area == pytest.approx(
+        0, abs=1e-6
+    )
+
+    # Polygons sharing a boundary still share one, and only touch
+    for i, j in zip(*np.triu_indices(len(original), 1)):
+        if original[i].intersection(original[j]).length > 0:
+            assert polygons[i].intersection(polygons[j]).length > 0
+        assert polygons[i].intersection(polygons[j]).area == pytest.approx(
+            0, abs=1e-6
+        )
+
+
+def test_shared_arcs_are_stored_once():
+    """Boundaries between two polygons are one arc used in both directions."""
+    topology = build_topology(partition(0), quantum=QUANTUM)
+    uses = {}
+    for rings in topology["polygons"]:
+        for ring in rings:
+            for reference in ring:
+                index = max(reference, ~reference)
+                uses.setdefault(index, []).append(reference >= 0)
+    assert max(len(directions) for directions in uses.values()) == 2
+    assert all(
+        len(directions) == 1 or directions[0] != directions[1]
+        for directions in uses.values()
+    )
+    assert len(uses) == len(topology["arcs"])
+
+    topojson = topology_to_topojson(simplify_topology(topology, 25))
+    assert len(topojson["arcs"]) == len(topology["arcs"])
+
+
+def test_collapsed_holes_and_polygons_are_dropped():
+    """Rings smaller than the tolerance are dropped."""
+    mask = np.zeros((30, 30), dtype=bool)
+    mask[2:22, 2:22] = True
+    # A hole of one pixel, a hole of 3 x 3 pixels and an island of one pixel
+    mask[7, 7] = False
+    mask[14:17, 14:17] = False
+    mask[26, 26] = True
+    flood_vectors = vectorise_mask(mask, TRANSFORM.to_gdal())
+    polygons = geometries(simplified(flood_vectors, 0))
+    assert sorted(len(polygon.interiors) for polygon in polygons) == [0, 2]
+
+    polygons = geometries(simplified(flood_vectors, 12))
+    assert len(polygons) == 1
+    assert len(polygons[0].interiors) == 1
+
+
+def test_generalise_report():
+    """Each level reports fewer vertices and bytes than the input."""
+    flood_vectors = partition(1)
+    outputs, report = generalise(
+        flood_vectors,
+        levels={"analytics": 0, "display": 30},
+        quantum=QUANTUM,
+        meters_per_unit=1,
+        topojson=True,
+    )
+    assert report["input"]["features"] == len(flood_vectors["features"])
+    assert 0 <= report["analytics"]["vertices_reduction"]
+    assert (
+        report["analytics"]["vertices_reduction"]
+        < report["display"]["vertices_reduction"]
+    )
+    assert report["display"]["topojson_bytes"] < (
+        report["display"]["geojson_bytes"]
+    )
+    assert set(outputs["display"]) == {"geojson", "topojson"}
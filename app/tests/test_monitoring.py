@@ -0,0 +1,157 @@
+"""Tests of the incremental flood monitor with the NumPy backend."""
+import datetime
+
+import numpy as np
+import pytest
+from benchmarks.synthetic import synthetic_local_inputs
+from src import utils_monitoring
+from src.utils_monitoring import EPOCH, FloodMonitor, _next_day
+
+DATES = ["2022-10-05", "2022-10-17", "2022-10-29"]
+
+
+@pytest.fixture(scope="module")
+def local_inputs():
+    """Return synthetic inputs with one flooded scene on each date."""
+    inputs = synthetic_local_inputs(2, seed=3)
+    before, after = inputs["scenes"]
+    rng = np.random.default_rng(0)
+    scenes = [before]
+    for date in DATES:
+        # New noise, so that the dates flood slightly different pixels
+        speckle = rng.normal(0, 0.3, size=after["VH"].shape)
+        scenes.append(
+            dict(after, date=date, VH=(after["VH"] + speckle).astype("f4"))
+        )
+    return dict(inputs, scenes=scenes)
+
+
+def open_monitor(state_dir, local_inputs):
+    """Open the monitor of the synthetic area."""
+    return FloodMonitor(
+        str(state_dir),
+        None,
+        "2022-09-01",
+        "2022-09-30",
+        "2022-10-01",
+        backend="numpy",
+        local_inputs=local_inputs,
+    )
+
+
+def day(date):
+    """Return a date in days since 1970-01-01."""
+    return (datetime.date.fromisoformat(date) - EPOCH).days
+
+
+def test_updates_match_single_run(tmp_path, local_inputs):
+    """Updates date by date give the same maximum as one update."""
+    monitor = open_monitor(tmp_path / "once", local_inputs)
+    assert monitor.maximum_extent() is None
+    entries = monitor.update()
+    assert [entry["date"] for entry in entries] == DATES
+    assert monitor.update() == []
+
+    incremental = open_monitor(tmp_path / "dates", local_inputs)
+    for date in DATES:
+        assert len(incremental.update(end_date=_next_day(date))) == 1
+    np.testing.assert_array_equal(
+        incremental.maximum_extent(), monitor.maximum_extent()
+    )
+    np.testing.assert_array_equal(
+        incremental.first_flooded(), monitor.first_flooded()
+    )
+    maximum = monitor.maximum_extent()
+    assert maximum.any()
+    assert entries[-1]["maximum_km2"] == pytest.approx(maximum.sum() * 1e-4)
+    assert sum(entry["new_flooded_km2"] for entry in entries) == (
+        pytest.approx(entries[-1]["maximum_km2"])
+    )
+
+
+def test_late_date_keeps_earliest_flooding(tmp_path, local_inputs):
+    """A date older than the processed ones moves first flooding earlier."""
+    late = dict(local_inputs, scenes=local_inputs["scenes"][::2])
+    monitor = open_monitor(tmp_path, late)
+    monitor.update()
+    assert monitor.processed_dates() == {DATES[1]}
+    flooded_later = monitor.first_flooded() == day(DATES[1])
+    assert flooded_later.any()
+
+    # The acquisition of the first date is ingested after the second
+    monitor = open_monitor(tmp_path, local_inputs)
+    entries = monitor.update()
+    assert [entry["date"] for entry in entries] == [DATES[0], DATES[2]]
+    assert [entry["date"] for entry in monitor.history] == DATES
+
+    first_flooded = monitor.first_flooded()
+    reference = open_monitor(tmp_path / "reference", local_inputs)
+    reference.update()
+    np.testing.assert_array_equal(first_flooded, reference.first_flooded())
+    np.testing.assert_array_equal(
+        monitor.maximum_extent(), reference.maximum_extent()
+    )
+    assert (first_flooded[flooded_later] == day(DATES[0])).any()
+    assert (first_flooded[flooded_later] <= day(DATES[1])).all()
+    assert (first_flooded[monitor.maximum_extent()] > 0).all()
+
+
+def test_resume_after_interruption(tmp_path, local_inputs, monkeypatch):
+    """An interrupted update resumes at the date it failed on."""
+    smooth = utils_monitoring.local.smooth
+    calls = []
+
+    def failing_smooth(*args, **kwargs):
+        """Smooth the baseline and first date, then fail."""
+        calls.append(1)
+        if len(calls) > 2:
+            raise KeyboardInterrupt
+        return smooth(*args, **kwargs)
+
+    monkeypatch.setattr(utils_monitoring.local, "smooth", failing_smooth)
+    with pytest.raises(KeyboardInterrupt):
+        open_monitor(tmp_path, local_inputs).update()
+    monkeypatch.undo()
+
+    monitor = open_monitor(tmp_path, local_inputs)
+    assert monitor.processed_dates() == {DATES[0]}
+    entries = monitor.update()
+    assert [entry["date"] for entry in entries] == DATES[1:]
+
+    reference = open_monitor(tmp_path / "reference", local_inputs)
+    assert [entry["date"] for entry in reference.update()] == DATES
+    assert monitor.history == reference.history
+    np.testing.assert_array_equal(
+        monitor.first_flooded(), reference.first_flooded()
+    )
+
+
+def test_parameters_change_state(tmp_path, local_inputs):
+    """Monitors with other parameters keep their own state."""
+    monitor = open_monitor(tmp_path, local_inputs)
+    monitor.update()
+    other = FloodMonitor(
+        str(tmp_path),
+        None,
+        "2022-09-01",
+        "2022-09-30",
+        "2022-10-01",
+        difference_threshold=1.5,
+        backend="numpy",
+        local_inputs=local_inputs,
+    )
+    assert other.directory != monitor.directory
+    assert other.processed_dates() == set()
+
+
+def test_ee_backend_needs_asset_folder(tmp_path):
+    """The Earth Engine backend refuses to run without an asset folder."""
+    with pytest.raises(ValueError, match="asset folder"):
+        FloodMonitor(
+            str(tmp_path),
+            None,
+            "2022-09-01",
+            "2022-09-30",
+            "2022-10-01",
+            asset_folder=None,
+        )
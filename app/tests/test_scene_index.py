@@ -0,0 +1,189 @@
+"""Tests of the scene index, its incremental refreshes and pre-flight check."""
+import datetime
+import json
+
+import pytest
+from shapely.geometry import box, mapping
+from src import utils_scene_index
+from src.utils_scene_index import (
+    MILLISECONDS_PER_DAY,
+    SceneIndex,
+    _subtract_intervals,
+    preflight_check,
+    to_milliseconds,
+)
+
+AOI = mapping(box(10, 20, 11, 21))
+BOUNDS = (10, 20, 11, 21)
+
+
+def scene(scene_id, date, footprint, orbit_pass="ASCENDING", pols="VV,VH"):
+    """Return the GeoJSON feature of a scene acquired on a date."""
+    return {
+        "type": "Feature",
+        "geometry": mapping(footprint),
+        "properties": {
+            "id": scene_id,
+            "time_start": to_milliseconds(date) + 3600000,
+            "pass": orbit_pass,
+            "polarisations": pols.split(","),
+            "relative_orbit": 1,
+        },
+    }
+
+
+@pytest.mark.parametrize(
+    "interval, covered, missing",
+    [
+        ((0, 10), [], [(0, 10)]),
+        ((0, 10), [(0, 10)], []),
+        ((0, 10), [(-5, 20)], []),
+        ((0, 10), [(2, 4)], [(0, 2), (4, 10)]),
+        ((0, 10), [(6, 8), (2, 4)], [(0, 2), (4, 6), (8, 10)]),
+        ((0, 10), [(2, 5), (4, 7)], [(0, 2), (7, 10)]),
+        ((0, 10), [(-5, 3), (8, 15)], [(3, 8)]),
+        ((0, 10), [(-5, 0), (10, 15)], [(0, 10)]),
+        ((0, 10), [(0, 4), (4, 10)], []),
+    ],
+)
+def test_subtract_intervals(interval, covered, missing):
+    """The missing parts are disjoint, sorted and exclude covered parts."""
+    assert _subtract_intervals(interval, covered) == missing
+
+
+def test_missing_ranges(monkeypatch):
+    """Refreshes only request the periods not requested for the area."""
+    requests = []
+
+    def scene_features(bounds, start_date, end_date, page_size=1000):
+        """Record the requested periods and return no scenes."""
+        requests.append((start_date, end_date))
+        return []
+
+    monkeypatch.setattr(utils_scene_index, "scene_features", scene_features)
+    index = SceneIndex()
+    assert index.missing_ranges(BOUNDS, "2022-01-01", "2022-02-01") == [
+        (to_milliseconds("2022-01-01"), to_milliseconds("2022-02-01"))
+    ]
+    index.refresh_from_ee(BOUNDS, "2022-01-10", "2022-01-20")
+    assert index.missing_ranges(BOUNDS, "2022-01-01", "2022-02-01") == [
+        (to_milliseconds("2022-01-01"), to_milliseconds("2022-01-10")),
+        (to_milliseconds("2022-01-20"), to_milliseconds("2022-02-01")),
+    ]
+
+    # A smaller area is covered by the refresh, a larger one is not
+    assert not index.missing_ranges(
+        (10.2, 20.2, 10.8, 20.8), "2022-01-12", "2022-01-18"
+    )
+    assert index.missing_ranges((9, 20, 11, 21), "2022-01-12", "2022-01-18")
+
+    index.refresh_from_ee(BOUNDS, "2022-01-01", "2022-02-01")
+    assert requests == [
+        ("2022-01-10", "2022-01-20"),
+        ("2022-01-01", "2022-01-10"),
+        ("2022-01-20", "2022-02-01"),
+    ]
+    assert not index.missing_ranges(BOUNDS, "2022-01-01", "2022-02-01")
+
+
+def test_recent_periods_are_requested_again(monkeypatch):
+    """Periods within the ingestion latency stay missing after a refresh."""
+    monkeypatch.setattr(
+        utils_scene_index, "scene_features", lambda *args, **kwargs: []
+    )
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    start = (today - datetime.timedelta(days=20)).isoformat()
+    end = (today + datetime.timedelta(days=1)).isoformat()
+    index = SceneIndex()
+    index.refresh_from_ee(BOUNDS, start, end)
+    missing = index.missing_ranges(BOUNDS, start, end)
+    assert len(missing) == 1
+    latency = utils_scene_index.INGESTION_LATENCY_DAYS * MILLISECONDS_PER_DAY
+    assert missing[0][1] == to_milliseconds(end)
+    assert missing[0][1] - missing[0][0] > latency
+
+
+@pytest.fixture
+def index(tmp_path):
+    """Return an index loaded from a fixture with gaps in coverage."""
+    features = [
+        # Before: the area is covered by two halves on the same day
+        scene("b_west", "2022-01-05", box(9.5, 19.5, 10.6, 21.5)),
+        scene("b_east", "2022-01-05", box(10.5, 19.5, 11.5, 21.5)),
+        # After: half covered in the period, fully covered a few days later
+        scene("a_half", "2022-02-03", box(9.5, 19.5, 10.5, 21.5)),
+        scene("a_late", "2022-02-14", box(9.5, 19.5, 11.5, 21.5)),
+        scene(
+            "a_desc", "2022-02-04", box(9.5, 19.5, 11.5, 21.5), "DESCENDING"
+        ),
+        scene("a_vv", "2022-02-05", box(9.5, 19.5, 11.5, 21.5), pols="VV"),
+        # Only touching the area
+        scene("touch", "2022-02-06", box(11, 20, 12, 21)),
+    ]
+    path = tmp_path / "scenes.geojson"
+    path.write_text(
+        json.dumps({"type": "FeatureCollection", "features": features})
+    )
+    index = SceneIndex(str(tmp_path / "index" / "scenes.sqlite"))
+    assert index.load_fixture(str(path)) == len(features)
+    # Loading again updates the scenes instead of duplicating them
+    index.load_fixture(str(path))
+    assert len(index) == len(features)
+    return index
+
+
+def test_find_scenes(index):
+    """Scenes are filtered by pass, polarisation and intersection."""
+    scenes = index.find_scenes(AOI, "2022-02-01", "2022-02-10")
+    assert [scene["id"] for scene in scenes] == ["a_half", "a_desc", "a_vv"]
+    scenes = index.find_scenes(
+        AOI, "2022-02-01", "2022-02-10", "Ascending", "VH"
+    )
+    assert [scene["id"] for scene in scenes] == ["a_half"]
+
+
+def test_preflight_covered(index):
+    """Both periods covered pass the check without suggestions."""
+    report = preflight_check(
+        index, AOI, "2022-01-01", "2022-01-10", "2022-02-01", "2022-02-20"
+    )
+    assert report["ok"]
+    assert report["before"]["scenes"] == 2
+    assert report["before"]["coverage"] == pytest.approx(1)
+    assert report["after"]["suggestions"] == []
+
+
+def test_preflight_suggestions(index):
+    """A partly covered period fails and suggests the nearest coverage."""
+    report = preflight_check(
+        index, AOI, "2022-01-01", "2022-01-10", "2022-02-01", "2022-02-10"
+    )
+    assert not report["ok"]
+    assert report["before"]["coverage"] == pytest.approx(1)
+    after = report["after"]
+    assert after["scenes"] == 1
+    assert after["coverage"] == pytest.approx(0.5)
+    # Suggestions include the other pass direction and full coverage
+    # comes first, even from the other period
+    assert [
+        (suggestion["date"], suggestion["pass_direction"])
+        for suggestion in after["suggestions"]
+    ] == [
+        ("2022-02-04", "Descending"),
+        ("2022-02-14", "Ascending"),
+        ("2022-01-05", "Ascending"),
+    ]
+    assert [
+        suggestion["days_away"] for suggestion in after["suggestions"]
+    ] == [0, 5, 27]
+
+    report = preflight_check(
+        index,
+        AOI,
+        "2022-01-01",
+        "2022-01-10",
+        "2022-02-01",
+        "2022-02-10",
+        pass_direction=None,
+    )
+    assert report["ok"]
@@ -0,0 +1,117 @@
+"""Tests of the streamed FlatGeobuf and GeoParquet outputs."""
+import json
+
+import pyarrow.parquet as pq
+import pytest
+import shapely
+from shapely.geometry import box, mapping, shape
+from src.utils_vector_io import (
+    _row_groups_in_bbox,
+    iter_features,
+    read_features_bbox,
+    write_vectors,
+)
+
+# Squares of a 10 x 10 grid, row by row, so that each row group of 10
+# features covers one row of the grid
+FEATURES = [
+    {
+        "type": "Feature",
+        "geometry": mapping(box(col, row, col + 0.8, row + 0.8)),
+        "properties": {"label": row * 10 + col, "area": 0.64},
+    }
+    for row in range(10)
+    for col in range(10)
+]
+
+BOXES = [
+    (2.5, 3.5, 4.5, 5.5),
+    (-1, -1, 0.5, 0.5),
+    (0.85, 0, 0.95, 10),
+    (20, 20, 30, 30),
+]
+
+
+def labels(features):
+    """Return the sorted labels of features."""
+    return sorted(feature["properties"]["label"] for feature in features)
+
+
+def expected_labels(bbox):
+    """Return the labels of the features intersecting a box, brute force."""
+    return labels(
+        feature
+        for feature in FEATURES
+        if shape(feature["geometry"]).intersects(box(*bbox))
+    )
+
+
+@pytest.fixture(scope="module", params=[".parquet", ".fgb"])
+def path(request, tmp_path_factory):
+    """Return the path of the features written in each format."""
+    path = str(tmp_path_factory.mktemp("vectors") / f"grid{request.param}")
+    options = {"row_group_size": 10} if request.param == ".parquet" else {}
+    assert write_vectors(iter(FEATURES), path, **options) == len(FEATURES)
+    return path
+
+
+def test_round_trip(path):
+    """All features are read back with their geometry and properties."""
+    features = sorted(
+        iter_features(path), key=lambda feature: feature["properties"]["label"]
+    )
+    assert len(features) == len(FEATURES)
+    for feature, written in zip(features, FEATURES):
+        assert feature["properties"] == written["properties"]
+        assert shapely.equals(
+            shape(feature["geometry"]), shape(written["geometry"])
+        )
+
+
+@pytest.mark.parametrize("bbox", BOXES)
+def test_read_bbox(path, bbox):
+    """Reading by box returns the features intersecting the box."""
+    assert labels(read_features_bbox(path, bbox)) == expected_labels(bbox)
+
+
+@pytest.mark.parametrize(
+    "bbox, row_groups",
+    [
+        (BOXES[0], [3, 4, 5]),
+        (BOXES[1], [0]),
+        (BOXES[2], list(range(10))),
+        (BOXES[3], []),
+    ],
+)
+def test_row_group_pruning(tmp_path, bbox, row_groups):
+    """Only the row groups whose bbox statistics intersect a box are read."""
+    path = str(tmp_path / "grid.parquet")
+    write_vectors(FEATURES, path, row_group_size=10)
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_row_groups == 10
+    assert _row_groups_in_bbox(metadata, bbox) == row_groups
+
+
+def test_geoparquet_metadata(tmp_path):
+    """The GeoParquet metadata declares the bbox covering and the CRS."""
+    path = str(tmp_path / "grid.parquet")
+    write_vectors(FEATURES[:3], path, crs="EPSG:32637")
+    geo = json.loads(pq.read_schema(path).metadata[b"geo"])
+    column = geo["columns"]["geometry"]
+    assert geo["primary_column"] == "geometry"
+    assert column["encoding"] == "WKB"
+    assert column["covering"]["bbox"]["xmin"] == ["bbox", "xmin"]
+    assert column["crs"]["id"] == {"authority": "EPSG", "code": 32637}
+
+
+def test_empty_geoparquet(tmp_path):
+    """A stream without features writes a readable empty file."""
+    path = str(tmp_path / "empty.parquet")
+    assert write_vectors(iter([]), path) == 0
+    assert list(read_features_bbox(path, (0, 0, 1, 1))) == []
+
+
+def test_unknown_format(tmp_path):
+    """Other extensions are rejected."""
+    with pytest.raises(ValueError, match="Unknown vector format"):
+        write_vectors(FEATURES, str(tmp_path / "grid.shp"))
@@ -0,0 +1,80 @@
+"""Tests of the local vectoriser against GDAL, through rasterio."""
+import numpy as np
+import pytest
+import rasterio.features
+import shapely
+from rasterio.transform import Affine
+from shapely.geometry import shape
+from src.utils_vectorise import vectorise_mask
+
+TRANSFORM = Affine(10, 0, 500000, 0, -10, 4000000)
+
+# Pixels touching by a corner: two holes, a hole and the exterior, and two
+# parts of one group with 8-connectivity
+SADDLES = [
+    [
+        [1, 1, 1, 1],
+        [1, 0, 1, 1],
+        [1, 1, 0, 1],
+        [1, 1, 1, 1],
+    ],
+    [
+        [0, 1, 1],
+        [1, 0, 1],
+        [1, 1, 1],
+    ],
+    [
+        [1, 0, 0],
+        [0, 1, 1],
+        [0, 1, 0],
+    ],
+    [
+        [1, 0, 1],
+        [0, 1, 0],
+        [1, 0, 1],
+    ],
+]
+
+
+def masks():
+    """Return the saddle masks and random masks of several densities."""
+    generator = np.random.default_rng(0)
+    random_masks = [
+        generator.random((40, 50)) < density
+        for density in (0.3, 0.5, 0.6, 0.7)
+    ]
+    return [np.array(mask, dtype=bool) for mask in SADDLES] + random_masks
+
+
+@pytest.mark.parametrize("connectivity", [4, 8])
+@pytest.mark.parametrize("mask", masks())
+def test_vectorise_mask_matches_rasterio(mask, connectivity):
+    """Polygons are valid and cover the same pixels as rasterio's."""
+    flood_vectors = vectorise_mask(
+        mask, TRANSFORM.to_gdal(), connectivity=connectivity
+    )
+    geometries = [
+        shape(feature["geometry"]) for feature in flood_vectors["features"]
+    ]
+    expected = [
+        shape(geometry)
+        for geometry, value in rasterio.features.shapes(
+            mask.astype("uint8"),
+            transform=TRANSFORM,
+            connectivity=connectivity,
+        )
+        if value == 1
+    ]
+    invalid = [shapely.is_valid_reason(g) for g in geometries]
+    assert all(shapely.is_valid(geometries)), invalid
+    assert len(geometries) == len(expected)
+    assert sum(g.area for g in geometries) == pytest.approx(
+        sum(g.area for g in expected)
+    )
+    assert sum(
+        feature["properties"]["count"] for feature in flood_vectors["features"]
+    ) == int(mask.sum())
+    rasterised = rasterio.features.rasterize(
+        geometries, out_shape=mask.shape, transform=TRANSFORM
+    )
+    np.testing.assert_array_equal(rasterised.astype(bool), mask)
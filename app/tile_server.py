@@ -0,0 +1,81 @@
+"""Command-line entry point to serve the XYZ tiles of local flood extents.
+
+Example:
+    python app/tile_server.py raster.tif vector.fgb --port 8765
+
+The files, e.g. downloaded from the app or in batch, are served by
+src/utils_tiles.TileServer without any network access: rasters as PNG tiles,
+FlatGeobuf and GeoParquet polygons as Mapbox Vector Tiles. The URL template
+of each one is printed, to be added as a tile layer in a web map or a GIS.
+"""
+import argparse
+import os
+import sys
+import time
+
+from src.config_parameters import params
+from src.utils_tiles import TileServer
+from src.utils_vector_io import VECTOR_FORMATS
+
+
+def parse_arguments(arguments=None):
+    """
+    Parse the command-line arguments.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        argparse.Namespace: Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Serve the XYZ tiles of local flood extents."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="GeoTIFF flood rasters, FlatGeobuf or GeoParquet polygons",
+    )
+    parser.add_argument("--host", default=params["tile_server_host"])
+    parser.add_argument("--port", type=int, default=params["tile_server_port"])
+    parser.add_argument(
+        "--cache-mb",
+        type=int,
+        default=params["tile_cache_mb"],
+        help="Size of the in-memory tile cache",
+    )
+    return parser.parse_args(arguments)
+
+
+def main(arguments=None):
+    """
+    Serve rasters until interrupted.
+
+    Inputs:
+        arguments (list): Arguments, by default those of the command line.
+
+    Returns:
+        int: Exit code, 0.
+    """
+    arguments = parse_arguments(arguments)
+    server = TileServer(
+        arguments.host, arguments.port, arguments.cache_mb * 2**20
+    ).start()
+    for path in arguments.paths:
+        extension = os.path.splitext(path)[1].lower()
+        url = (
+            server.add_vectors(path)
+            if extension in VECTOR_FORMATS
+            else server.add_raster(path)
+        )
+        print(f"{path}: {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())